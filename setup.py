@@ -44,7 +44,9 @@ setup(
     extras_require={
         "postgresql": ["psycopg2>=2.8.6"],
         "mariadb": ["mariadb>=1.0.6"],
-        "mysql": ["pymysql>=1.0.2"]
+        "mysql": ["pymysql>=1.0.2"],
+        "orjson": ["orjson>=3.5.0"],
+        "websocket": ["websocket-client>=1.0.0"]
     },
     entry_points={
         "console_scripts": [
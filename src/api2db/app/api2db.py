@@ -5,22 +5,37 @@ Contains the Api2Db class
 """
 from ..ingest.api2pandas import Api2Pandas
 from .log import get_logger
+from .metrics import get_metrics
 from ..ingest.collector import Collector
-from ..ingest.api_form import ApiForm
+from ..ingest.fingerprint import PayloadFingerprint
+from ..ingest.async_import import iter_async, run_async
+from ..ingest.json_stream import is_raw, is_stream
+from ..ingest.json_decode import decode, read_raw
+from ..ingest.import_runner import CancelToken, ImportRunner, use_token
+from ..ingest.http_import import commit_validators, defer_validators, discard_validators
+from ..ingest.collector_state import CollectorState, get_state
+from .pipeline import Pipeline
 from ..store.store import Store
+from ..stream.segment_log import SegmentLog
+from ..stream.dedup_index import DedupIndex
+import pandas as pd
 import schedule
 from schedule import CancelJob
 from multiprocessing import Process
 from threading import Thread
+from concurrent.futures import ThreadPoolExecutor
 from queue import Queue as ThreadQueue
 from threading import Lock as ThreadLock
 import time
 import os
 import pickle
-from typing import Callable, List, Union
+import inspect
+from typing import Any, Callable, Iterator, List, Optional, Union
 
 DEV_SHRINK_DATA = 0
 """int: Library developer setting to shrink incoming data to the first DEV_SHRINK_DATA rows"""
+METRICS_SECONDS = 60
+"""int: The number of seconds between logging the metrics of a collector"""
 
 
 class Api2Db(object):
@@ -35,6 +50,14 @@ class Api2Db(object):
 
         """
         self.collector = collector
+        self.wals = {}
+        """dict: Maps the name of each pipeline to its write-ahead log, created in the collector process"""
+        self.dedups = {}
+        """dict: Maps the name of each pipeline to its index of collected rows, created per collector process"""
+        self.fingerprints = None
+        """Optional[api2db.ingest.fingerprint.PayloadFingerprint]: The fingerprints of the data points last imported"""
+        self.runner = None
+        """Optional[api2db.ingest.import_runner.ImportRunner]: Runs the import_target with a deadline or hedging"""
 
     def wrap_start(self) -> Process:
         """
@@ -77,31 +100,86 @@ class Api2Db(object):
             None
 
         Raises:
-            NameError or ModuleNotFoundError if streams cannot be created
+            NameError or ModuleNotFoundError if streams cannot be created, or ValueError if several pipelines of the
+            collector have the same name
         """
         # Get the logger via get_logger() which will get the logger for the current process pid
         logger = get_logger()
-        # Instantiate the stream objects. (Performed here because streams establish persistent external connections)
-        try:
-            streams = self.collector.streams()
-        except NameError as e:
-            raise Api2Db.import_handle(e)
-        stream_qs = [stream.q for stream in streams]
-        stream_locks = [stream.lock for stream in streams]
         freq = self.collector.seconds
         name = self.collector.name
+        pipelines = []
+        streams = []
+        # Branches are named after their ApiForm
+        names = self.collector.pipeline_names()
+        # Instantiate the stream objects. (Performed here because streams establish persistent external connections)
+        for pipeline_name, (_, api_form, pipeline_streams, _) in zip(names, self.collector.pipelines()):
+            try:
+                pipeline_streams = pipeline_streams()
+            except NameError as e:
+                raise Api2Db.import_handle(e)
+            # Attach each stream to the write-ahead log, so that streams resume from their committed offsets
+            if self.collector.wal:
+                if pipeline_name not in self.wals:
+                    self.wals[pipeline_name] = SegmentLog(pipeline_name)
+                keys = []
+                for stream in pipeline_streams:
+                    key = stream.stream_type if stream.stream_type not in keys else \
+                        f"{stream.stream_type}.{len(keys)}"
+                    keys.append(key)
+                    stream.attach_wal(self.wals[pipeline_name], key)
+            # Open the index of rows already collected
+            if self.collector.dedup_keys is not None and pipeline_name == name and name not in self.dedups:
+                self.dedups[name] = DedupIndex(name,
+                                               keys=self.collector.dedup_keys,
+                                               ttl=self.collector.dedup_ttl,
+                                               max_memory=self.collector.dedup_max_memory)
+            pipelines.append(Pipeline(name=pipeline_name,
+                                      api_form=api_form,
+                                      stream_qs=[stream.q for stream in pipeline_streams],
+                                      wal=self.wals.get(pipeline_name),
+                                      dedup=self.dedups.get(pipeline_name),
+                                      decode=self.collector.decode))
+            streams.extend(pipeline_streams)
+        stream_locks = [stream.lock for stream in streams]
+        if self.collector.skip_unchanged and self.fingerprints is None:
+            self.fingerprints = PayloadFingerprint(name)
+        if (self.collector.import_timeout is not None or self.collector.hedge) and self.runner is None:
+            self.runner = ImportRunner(name, timeout=self.collector.import_timeout, hedge=self.collector.hedge)
         # Start each stream
         for stream in streams:
             stream.start()
-        logger.info(f"import scheduled: [{freq} seconds] (api request data) -> (streams)")
-        # Schedule the collector refresh
-        schedule.every(freq).seconds.do(lambda:
-                                        Api2Db.collect_wrap(
-                                            self.collector.import_target,
-                                            self.collector.api_form,
-                                            stream_qs,
-                                            stream_locks)
-                                        ).tag(name)
+        import_target = self.collector.import_target
+        # Import targets that hold a connection open are started once and checked on, rather than polled
+        if getattr(import_target, "continuous", False):
+            logger.info(f"push import started: [{freq} seconds] (api push data) -> (streams)")
+            push = {}
+            Api2Db.push_wrap(import_target, pipelines, stream_locks, push, get_state(name))
+            # Schedule the connection check
+            schedule.every(freq).seconds.do(lambda:
+                                            Api2Db.push_wrap(
+                                                import_target,
+                                                pipelines,
+                                                stream_locks,
+                                                push,
+                                                get_state(name))
+                                            ).tag(name)
+        else:
+            # Take a token from the shared rate limiter before each import
+            if self.collector.rate_limit is not None:
+                import_target = self.collector.rate_limit.wrap(import_target)
+            logger.info(f"import scheduled: [{freq} seconds] (api request data) -> (streams)")
+            collecting = {}
+            # Schedule the collector refresh
+            schedule.every(freq).seconds.do(lambda:
+                                            Api2Db.collect_wrap(
+                                                import_target,
+                                                pipelines,
+                                                stream_locks,
+                                                collecting,
+                                                self.fingerprints,
+                                                self.runner,
+                                                get_state(name))
+                                            ).tag(name)
 
         tags = [next(iter(j.tags)) for j in schedule.jobs]
         tag = f"{name}.refresh"
@@ -110,29 +188,135 @@ class Api2Db(object):
             logger.info(f"storage refresh scheduled: [{freq} seconds] -> (check stores)")
             # Schedule the storage refresh
             schedule.every(freq).seconds.do(lambda:
-                                            Api2Db.store_wrap(self.collector.stores)
+                                            Api2Db.store_wrap(self.collector.all_stores)
                                             ).tag(tag)
         else:
             logger.info(f"storage refresh already running:\n\t[{freq} seconds] ({name}) -> (skipping)")
 
+        tag = f"{name}.metrics"
+        # If metrics logging is not running
+        if tag not in tags:
+            schedule.every(METRICS_SECONDS).seconds.do(Api2Db.log_metrics).tag(tag)
+
     @staticmethod
     def collect_wrap(import_target: Callable[[], Union[List[dict], None]],
-                     api_form: Callable[[], ApiForm],
-                     stream_qs: List[ThreadQueue],
-                     stream_locks: List[ThreadLock]
+                     pipelines: List[Pipeline],
+                     stream_locks: List[ThreadLock],
+                     collecting: dict,
+                     fingerprints: Optional[PayloadFingerprint]=None,
+                     runner: Optional[ImportRunner]=None,
+                     state: Optional[CollectorState]=None
                      ) -> Union[type(CancelJob), None]:
         """
-        Starts/restarts dead streams, and calls method collect to import data
+        Starts/restarts dead streams, and calls method collect to import data unless the previous import is still
+        running
 
         Args:
             import_target: Function that returns data imported from an Api
-            api_form: Function that instantiates and returns an ApiForm object
-            stream_qs: A list of queues to pass the incoming data into to be handled by stream targets
+            pipelines: The pipelines fed by the collector, each with its ApiForm and stream queues
             stream_locks: A list of locks that become acquirable if their respective stream has died
+            collecting: Holds the thread running the previous import
+            fingerprints: The fingerprints of the data points previously imported, if enabled
+            runner: Runs the import_target with a deadline or hedging, if enabled
+            state: The state of the collector, committed once the data of an import has been handed to the streams
 
         Returns:
             CancelJob if stream has died, restarting the streams, None otherwise
         """
+        # If one of the streams has died
+        if Api2Db.streams_died(stream_locks):
+            # Tell the scheduler to cancel the job
+            return CancelJob
+
+        # Imports do not overlap, so that the state staged by one import is not committed by another
+        t = collecting.get("thread")
+        if t is not None and t.is_alive():
+            logger = get_logger()
+            logger.warning("previous import still running: skipping")
+            return
+        # Spawn a thread with target collect
+        collecting["thread"] = Thread(target=Api2Db.collect,
+                                      args=(import_target, pipelines, fingerprints, runner, state,))
+        # Start the thread
+        collecting["thread"].start()
+
+    @staticmethod
+    def push_wrap(import_target: Callable[[], Iterator[List[dict]]],
+                  pipelines: List[Pipeline],
+                  stream_locks: List[ThreadLock],
+                  push: dict,
+                  state: Optional[CollectorState]=None
+                  ) -> Union[type(CancelJob), None]:
+        """
+        Starts/restarts dead streams, and starts the thread collecting from an import_target that holds a connection
+        open if it is not running
+
+        Args:
+            import_target: Function that returns a generator yielding batches of data as they are pushed by an Api
+            pipelines: The pipelines fed by the collector, each with its ApiForm and stream queues
+            stream_locks: A list of locks that become acquirable if their respective stream has died
+            push: Holds the thread collecting from the connection and its CancelToken
+            state: The state of the collector, committed once the connection is closed
+
+        Returns:
+            CancelJob if stream has died, closing the connection and restarting the streams, None otherwise
+        """
+        # If one of the streams has died
+        if Api2Db.streams_died(stream_locks):
+            # Close the connection, it is opened again with the new streams
+            if "token" in push:
+                push["token"].cancel()
+            # Tell the scheduler to cancel the job
+            return CancelJob
+
+        t = push.get("thread")
+        if t is None or not t.is_alive():
+            if t is not None:
+                logger = get_logger()
+                logger.warning("push import stopped: restarting")
+            push["token"] = CancelToken()
+            # Spawn a thread with target push
+            push["thread"] = Thread(target=Api2Db.push, args=(import_target, pipelines, push["token"], state,),
+                                    daemon=True)
+            # Start the thread
+            push["thread"].start()
+
+    @staticmethod
+    def push(import_target: Callable[[], Iterator[List[dict]]],
+             pipelines: List[Pipeline],
+             token: CancelToken,
+             state: Optional[CollectorState]=None
+             ) -> None:
+        """
+        Collects the batches of data yielded by an import_target that holds a connection open, until the token is
+        cancelled
+
+        Args:
+            import_target: Function that returns a generator yielding batches of data as they are pushed by an Api
+            pipelines: The pipelines fed by the collector
+            token: Cancelled to close the connection
+            state: The state of the collector, committed once the connection is closed
+
+        Returns:
+            None
+        """
+        use_token(token)
+        try:
+            Api2Db.collect(import_target, pipelines, state=state)
+        finally:
+            use_token(None)
+
+    @staticmethod
+    def streams_died(stream_locks: List[ThreadLock]) -> bool:
+        """
+        Checks whether a stream has died, and signals every stream to restart if one has
+
+        Args:
+            stream_locks: A list of locks that become acquirable if their respective stream has died
+
+        Returns:
+            True if a stream has died otherwise False
+        """
         stream_died = False
         # Check to see if each stream lock can be acquired
         for lock in stream_locks:
@@ -141,7 +325,6 @@ class Api2Db(object):
                 stream_died = True
                 break
 
-        # If one of the streams has died
         if stream_died:
             # Signal to all streams that they must be restarted by releasing the lock
             for lock in stream_locks:
@@ -149,60 +332,232 @@ class Api2Db(object):
                     lock.release()
                 except ValueError:
                     pass
-            # Tell the scheduler to cancel the job
-            return CancelJob
-
-        # Spawn a thread with target collect
-        t = Thread(target=Api2Db.collect, args=(import_target, api_form, stream_qs,))
-        # Start the thread
-        t.start()
+        return stream_died
 
     @staticmethod
     def collect(import_target: Callable[[], Union[List[dict], None]],
-                api_form: Callable[[], ApiForm],
-                stream_qs: List[ThreadQueue]
+                pipelines: List[Pipeline],
+                fingerprints: Optional[PayloadFingerprint]=None,
+                runner: Optional[ImportRunner]=None,
+                state: Optional[CollectorState]=None
                 ) -> None:
         """
         Performs a data-import, cleans the data, and sends the data into
         its stream queues
 
         Args:
-            import_target: Function that returns data imported from an Api
-            api_form: Function that instantiates and returns an ApiForm object
-            stream_qs: A list of queues to pass the incoming data into to be handled by stream targets
+            import_target: Function that returns data imported from an Api, or a generator yielding data as it is
+                           imported
+            pipelines: The pipelines fed by the collector. Each data point is cleaned by the ApiForm of every pipeline,
+                       in parallel when there are several, and passed into the stream queues of that pipeline. Each
+                       DataFrame is appended to the write-ahead log of the pipeline if it is enabled, and rows
+                       already collected are dropped if the pipeline has an index of collected rows
+            fingerprints: The fingerprints of the data points previously imported, if enabled. Data points that have
+                          not changed since the previous import are skipped before they are cleaned
+            runner: Runs the import_target with a deadline or hedging, if enabled. Imports that do not return before
+                    the deadline collect no data
+            state: The state of the collector. Values staged by the import_target are committed once every data
+                   point has been passed into the stream queues, and discarded if the import fails
 
         Returns:
             None
         """
         logger = get_logger()
-        # Create an instance of an Api2Pandas object passing the api_form constructor function
-        api2pandas = Api2Pandas(api_form)
-        if not api2pandas.dependencies_satisfied():
+        # Create an instance of an Api2Pandas object for each pipeline passing the api_form constructor function
+        api2pandas = [Api2Pandas(pipeline.api_form, decode=pipeline.decode) for pipeline in pipelines]
+        if len(api2pandas) == 0 or not all(a.dependencies_satisfied() for a in api2pandas):
             return
+        # Remember the ETag and Last-Modified headers of the responses only once their data has been collected
+        defer_validators()
         # Import the data
-        data = import_target()
-        if data is None or type(data) is not list:
+        try:
+            if runner is not None:
+                data = runner.run(import_target)
+            else:
+                data = import_target()
+                # Run async import targets on the event loop of the collector process
+                if inspect.isawaitable(data):
+                    data = run_async(data)
+        except Exception as e:
+            logger.exception(e)
+            data = None
+        # Step async generator import targets on the event loop of the collector process
+        if inspect.isasyncgen(data):
+            data = iter_async(data)
+        if data is None or not isinstance(data, (list, Iterator)):
+            discard_validators()
+            if state is not None:
+                state.rollback()
             return
-        # For each data point
-        for data_point in data:
-            if data_point is None:
-                return
-            # Clean the data and extract it into a Pandas DataFrame
-            df = api2pandas.extract(data_point)
-            if df is None:
+        executor = ThreadPoolExecutor(max_workers=len(pipelines)) if len(pipelines) > 1 else None
+        collected = False
+        # For each data point, pulling data points from generator import targets as they arrive
+        try:
+            for i, data_point in enumerate(data):
+                if data_point is None:
+                    return
+                # Skip data points that are identical to the previous import
+                fp = None
+                if fingerprints is not None and not is_stream(data_point):
+                    fp = fingerprints.changed(i, data_point)
+                    if fp is None:
+                        continue
+                if executor is None:
+                    pipeline = pipelines[0]
+                    ok = Api2Db.collect_point(api2pandas[0], data_point, pipeline.stream_qs, pipeline.wal,
+                                              pipeline.dedup)
+                else:
+                    points = Api2Db.share_point(api2pandas, data_point)
+                    futures = [executor.submit(Api2Db.collect_point, a, point, p.stream_qs, p.wal, p.dedup)
+                               for a, p, point in zip(api2pandas, pipelines, points)]
+                    ok = all([f.result() for f in futures])
+                if not ok:
+                    return
+                if fp is not None:
+                    fingerprints.commit(i, fp)
+            collected = True
+        except TimeoutError as e:
+            logger.warning(f"import not collected: {e}")
+        except Exception as e:
+            logger.exception(e)
+        finally:
+            if executor is not None:
+                executor.shutdown(wait=False)
+            # Stop generator import targets that were not exhausted
+            if inspect.isgenerator(data):
+                data.close()
+            # Only move the state of the collector, and remember the headers of the responses, once all of the data
+            # has been handed to the streams
+            if collected:
+                commit_validators()
+            else:
+                discard_validators()
+            if state is not None:
+                if collected:
+                    state.commit(durable=all(pipeline.wal is not None for pipeline in pipelines))
+                else:
+                    state.rollback()
+
+    @staticmethod
+    def share_point(api2pandas: List[Api2Pandas], data_point: Any) -> List[Any]:
+        """
+        Prepares a data point to be cleaned by several pipelines at once
+
+        Raw JSON documents that can only be read once, I.e. file objects and streamed responses, are read into memory
+        so that every pipeline can parse them. Pipelines that parse raw documents incrementally are given the raw
+        document, and when decoding is enabled the document is decoded once for all of the other pipelines
+
+        Args:
+            api2pandas: The Api2Pandas object of each pipeline
+            data_point: The data point
+
+        Returns:
+            The data point to clean with each pipeline
+        """
+        if not is_raw(data_point) or isinstance(data_point, str):
+            return [data_point] * len(api2pandas)
+        if is_stream(data_point):
+            stream = data_point
+            try:
+                data_point = read_raw(stream)
+            finally:
+                stream.close()
+        decoded = None
+        res = []
+        for a in api2pandas:
+            if a.decode and not a.incremental():
+                # Decode the document once, rather than once per pipeline
+                if decoded is None:
+                    decoded = [decode(data_point)]
+                res.append(decoded[0])
+            else:
+                res.append(data_point)
+        return res
+
+    @staticmethod
+    def collect_point(api2pandas: Api2Pandas,
+                      data_point: dict,
+                      stream_qs: List[ThreadQueue],
+                      wal: Optional[SegmentLog]=None,
+                      dedup: Optional[DedupIndex]=None
+                      ) -> bool:
+        """
+        Cleans a single data point, and sends the data into its stream queues
+
+        Args:
+            api2pandas: The Api2Pandas object used to extract the data
+            data_point: A data point imported from an Api, or a raw JSON document to parse incrementally
+            stream_qs: A list of queues to pass the incoming data into to be handled by stream targets
+            wal: The write-ahead log of the collector, if enabled
+            dedup: The index of rows already collected, if enabled
+
+        Returns:
+            False if the data point could not be cleaned and the import should be abandoned, otherwise True
+        """
+        # Clean the data and extract it into Pandas DataFrames, a batch at a time if it is parsed incrementally
+        batches = api2pandas.extract_batches(data_point)
+        try:
+            for df in batches:
+                if df is None:
+                    return False
+                Api2Db.collect_df(api2pandas, df, stream_qs, wal, dedup)
+        finally:
+            # Closes a streamed response or file object right away rather than when the generator is collected
+            batches.close()
+        return True
+
+    @staticmethod
+    def collect_df(api2pandas: Api2Pandas,
+                   df: pd.DataFrame,
+                   stream_qs: List[ThreadQueue],
+                   wal: Optional[SegmentLog]=None,
+                   dedup: Optional[DedupIndex]=None
+                   ) -> None:
+        """
+        Sends a cleaned DataFrame into its stream queues
+
+        Args:
+            api2pandas: The Api2Pandas object used to extract the data
+            df: The cleaned data
+            stream_qs: A list of queues to pass the incoming data into to be handled by stream targets
+            wal: The write-ahead log of the collector, if enabled
+            dedup: The index of rows already collected, if enabled
+
+        Returns:
+            None
+        """
+        logger = get_logger()
+        # Nothing has changed since the previous import
+        if len(df) == 0:
+            return
+        # DEV OPTION -> Allows data to be shrunk during development of library!
+        if DEV_SHRINK_DATA != 0:
+            df = df.head(DEV_SHRINK_DATA)
+        # Drop the rows that have already been collected
+        hashes = None
+        if dedup is not None:
+            rows = len(df)
+            df, hashes = dedup.filter_new(df)
+            get_metrics().incr(f"{dedup.name}.dedup_rows_dropped", rows - len(df))
+            if len(df) == 0:
                 return
-            # DEV OPTION -> Allows data to be shrunk during development of library!
-            if DEV_SHRINK_DATA != 0:
-                df = df.head(DEV_SHRINK_DATA)
-            dtypes_path = os.path.join("CACHE", f"{api2pandas.api_form.name}_dtypes.pkl")
-            # If the dtypes file is not created, create a dtypes file
-            if not os.path.isfile(dtypes_path):
-                logger.info(f"no dtypes found -> making dtypes...")
-                with open(dtypes_path, "wb") as f:
-                    pickle.dump(df.dtypes, f)
-            # Place the Pandas DataFrame into each stream queue
-            for q in stream_qs:
-                q.put(df)
+        dtypes_path = os.path.join("CACHE", f"{api2pandas.api_form.name}_dtypes.pkl")
+        # If the dtypes file is not created, create a dtypes file
+        if not os.path.isfile(dtypes_path):
+            logger.info(f"no dtypes found -> making dtypes...")
+            with open(dtypes_path, "wb") as f:
+                pickle.dump(df.dtypes, f)
+        # Write the Pandas DataFrame to the write-ahead log before any stream can see it
+        if wal is not None:
+            offset = wal.append(df)
+            df = (offset, df)
+        # Place the Pandas DataFrame into each stream queue
+        for q in stream_qs:
+            q.put(df)
+        # Only remember the rows once they have been handed to the streams
+        api2pandas.commit()
+        if dedup is not None:
+            dedup.commit(hashes)
 
     @staticmethod
     def store_wrap(stores: Callable[[], List[Store]]) -> None:
@@ -253,6 +608,19 @@ class Api2Db(object):
         t = Thread(target=store.store)
         t.start()
 
+    @staticmethod
+    def log_metrics() -> None:
+        """
+        Logs the metrics recorded by the collector process
+
+        Returns:
+            None
+        """
+        logger = get_logger()
+        metrics = get_metrics().snapshot()
+        if len(metrics) != 0:
+            logger.info("metrics: " + ", ".join(f"{k}={v}" for k, v in sorted(metrics.items())))
+
     @staticmethod
     def import_handle(e: Exception) -> Exception:
         """
@@ -0,0 +1,101 @@
+# -*- coding: utf-8 -*-
+"""
+Contains the Metrics class and the get_metrics function
+=======================================================
+"""
+from threading import Lock as ThreadLock
+import os
+
+
+class Metrics(object):
+    """Holds the counters, gauges and timings recorded by a collector process"""
+
+    def __init__(self):
+        """
+        Creates an empty Metrics object
+        """
+        self.lock = ThreadLock()
+        self.counters = {}
+        """dict: Maps a metric name to a monotonically increasing count"""
+        self.gauges = {}
+        """dict: Maps a metric name to its most recently recorded value"""
+        self.timings = {}
+        """dict: Maps a metric name to a list of [count, total_seconds, max_seconds]"""
+
+    def incr(self, key: str, value: int=1) -> None:
+        """
+        Increments a counter
+
+        Args:
+            key: The name of the counter
+            value: The amount to increment the counter by
+
+        Returns:
+            None
+        """
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def gauge(self, key: str, value: float) -> None:
+        """
+        Sets a gauge to a value
+
+        Args:
+            key: The name of the gauge
+            value: The current value
+
+        Returns:
+            None
+        """
+        with self.lock:
+            self.gauges[key] = value
+
+    def timing(self, key: str, seconds: float) -> None:
+        """
+        Records the duration of an operation
+
+        Args:
+            key: The name of the timing
+            seconds: The duration of the operation in seconds
+
+        Returns:
+            None
+        """
+        with self.lock:
+            count, total, peak = self.timings.get(key, [0, 0.0, 0.0])
+            self.timings[key] = [count + 1, total + seconds, max(peak, seconds)]
+
+    def snapshot(self) -> dict:
+        """
+        Yields a copy of every metric currently recorded
+
+        Returns:
+            A dictionary of metric names to values. Timings are reported as `name.count`, `name.avg` and `name.max`
+        """
+        with self.lock:
+            res = dict(self.counters)
+            res.update(self.gauges)
+            for k, (count, total, peak) in self.timings.items():
+                res[f"{k}.count"] = count
+                res[f"{k}.avg"] = total / count if count else 0.0
+                res[f"{k}.max"] = peak
+        return res
+
+
+_metrics = {}
+"""dict: Maps the pid of each process to its Metrics object"""
+
+
+def get_metrics() -> Metrics:
+    """
+    Retrieves the Metrics object for the current process
+
+    Each collector runs in its own process, so metrics are recorded per collector.
+
+    Returns:
+        The Metrics object for the current process
+    """
+    pid = os.getpid()
+    if pid not in _metrics:
+        _metrics.setdefault(pid, Metrics())
+    return _metrics[pid]
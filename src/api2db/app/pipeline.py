@@ -0,0 +1,48 @@
+# -*- coding: utf-8 -*-
+"""
+Contains the Pipeline class
+===========================
+
+NOTE:
+
+    A collector has one pipeline for its own ``api_form``, ``streams`` and ``stores``, and one more for each of its
+    ``branches``. Every pipeline is fed the same imported data, so a single request can be split into several tables.
+
+    Pipelines are created by :py:class:`api2db.app.api2db.Api2Db` in the collector process, since they hold the queues
+    of the running streams.
+"""
+from ..ingest.api_form import ApiForm
+from ..stream.segment_log import SegmentLog
+from ..stream.dedup_index import DedupIndex
+from queue import Queue as ThreadQueue
+from typing import Callable, List, Optional
+
+
+class Pipeline(object):
+    """The running state of one ApiForm of a collector, and the streams it feeds"""
+
+    def __init__(self,
+                 name: str,
+                 api_form: Callable[[], ApiForm],
+                 stream_qs: List[ThreadQueue],
+                 wal: Optional[SegmentLog]=None,
+                 dedup: Optional[DedupIndex]=None,
+                 decode: bool=False):
+        """
+        Creates a Pipeline object
+
+        Args:
+            name: The name of the pipeline, the name of the collector for its own ``api_form``, otherwise the name of
+                  the ApiForm of the branch
+            api_form: Function that instantiates and returns an ApiForm object
+            stream_qs: A list of queues to pass the incoming data into to be handled by stream targets
+            wal: The write-ahead log of the pipeline, if enabled
+            dedup: The index of rows already collected by the pipeline, if enabled
+            decode: When True data points that are raw JSON documents are decoded before they are pre-processed
+        """
+        self.name = name
+        self.api_form = api_form
+        self.stream_qs = stream_qs
+        self.wal = wal
+        self.dedup = dedup
+        self.decode = decode
@@ -9,8 +9,13 @@
 +-----------------+--------------+
 """
 from .data_feature import Feature
-from .post_process import ColumnAdd, ColumnApply, ColumnsCalculate, DateCast, DropNa, MergeStatic
+from .post_process import ChangeCapture, ColumnAdd, ColumnApply, ColumnsCalculate, DateCast, DropNa, MergeStatic
 from .pre_process import BadRowSwap, FeatureFlatten, GlobalExtract, ListExtract
 from .api2pandas import Api2Pandas
 from .api_form import ApiForm
 from .collector import Collector
+from .http_import import HttpImport
+from .push_import import PushImport
+from .rate_limit import RateLimiter
+from .response_cache import ResponseCache
+from .collector_state import CollectorState, get_state
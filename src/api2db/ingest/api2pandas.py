@@ -5,22 +5,28 @@ Contains the Api2Pandas class
 """
 from ..app.log import get_logger
 from .api_form import ApiForm
+from .json_stream import is_raw, is_stream
+from .json_decode import decode
+from ..app.metrics import get_metrics
 import pandas as pd
 import os
-from typing import Union, Callable
+import time
+from typing import Any, Callable, Iterator, List, Union
 
 
 class Api2Pandas(object):
     """Used to extract incoming data from an API into a pandas DataFrame"""
 
-    def __init__(self, api_form: Callable[[], ApiForm]):
+    def __init__(self, api_form: Callable[[], ApiForm], decode: bool=False):
         """
         Creates a Api2Pandas object and loads its ApiForm
 
         Args:
             api_form: The function that generates the ApiForm for the associated collector
+            decode: When True data that is a raw JSON document is decoded before it is pre-processed
         """
         self.api_form = api_form()
+        self.decode = decode
 
     def dependencies_satisfied(self) -> bool:
         """
@@ -46,6 +52,20 @@ class Api2Pandas(object):
                     res = False
         return res
 
+    def commit(self) -> None:
+        """
+        Commits the state of stateful post-processors once the DataFrame they produced has been handed to the streams
+
+        This feature currently only exists for
+        :py:class:`api2db.ingest.post_process.change_capture.ChangeCapture`
+
+        Returns:
+            None
+        """
+        for post in self.api_form.post_process:
+            if post.ctype in ["change_capture"]:
+                post.commit()
+
     def extract(self, data: dict) -> Union[pd.DataFrame, None]:
         """
         Performs data-extraction from data arriving from an API.
@@ -75,6 +95,113 @@ class Api2Pandas(object):
                 data = pre(lam_arg=data)
         if data is None:
             return data
+        return self.frame(data, pre_2_post)
+
+    def incremental(self) -> bool:
+        """
+        Checks if raw JSON documents are parsed incrementally, I.e. the first pre-processor is a ListExtract with a
+        ``path``
+
+        Returns:
+            True if raw JSON documents are parsed incrementally, otherwise False
+        """
+        pre_process = self.api_form.pre_process
+        return len(pre_process) != 0 and pre_process[0].ctype == "list_extract" and pre_process[0].path is not None
+
+    def extract_batches(self, data: Any) -> Iterator[Union[pd.DataFrame, None]]:
+        """
+        Performs data-extraction from data arriving from an API, decoding the data first if it is a raw JSON document
+
+        Workflow:
+
+            1. If the data is a raw JSON document and the first pre-processor is a ListExtract with a ``path``
+
+                * Incrementally parse the list located by the ListExtract in batches
+                * Perform the remaining pre-processing on each batch
+                * Perform all data-feature extraction and post-processing on each batch
+                * Yield a DataFrame containing the cleaned data of each batch
+
+            2. Otherwise decode the data if ``decode`` is set and it is a raw JSON document other than a str, and
+               yield the result of ``extract``
+
+        Args:
+            data: The data arriving from an API to perform data extraction on.
+
+        Returns:
+            A generator yielding the cleaned data of each batch, or None if it is not possible to clean a batch. When
+            the data is not parsed incrementally a single DataFrame is yielded. Streamed responses and file objects
+            are closed once the generator is exhausted or closed
+        """
+        # Streamed responses and file objects are closed once parsed, so that their connection returns to the pool
+        source = data
+        try:
+            logger = get_logger()
+            metrics = get_metrics()
+            name = self.api_form.name
+            pre_process = self.api_form.pre_process
+            incremental = self.incremental()
+            # Raw data is passed to the pre-processors unchanged unless decoding is enabled, and strings are only
+            # treated as JSON documents when parsing incrementally, since pre-processors may expect them
+            if not is_raw(data) or (not incremental and (isinstance(data, str) or not self.decode)):
+                start = time.time()
+                df = self.extract(data)
+                metrics.timing(f"{name}.extract", time.time() - start)
+                yield df
+                return
+            if not incremental:
+                start = time.time()
+                try:
+                    data = decode(data)
+                except Exception as e:
+                    logger.exception(e)
+                    yield None
+                    return
+                metrics.timing(f"{name}.decode", time.time() - start)
+                start = time.time()
+                df = self.extract(data)
+                metrics.timing(f"{name}.extract", time.time() - start)
+                yield df
+                return
+            if any(pre.ctype == "global_extract" for pre in pre_process):
+                logger.warning("GlobalExtract is not supported when parsing incrementally")
+                yield None
+                return
+            f = open(data, "rb") if isinstance(data, os.PathLike) else None
+            try:
+                batches = pre_process[0].batches(data if f is None else f)
+                while True:
+                    start = time.time()
+                    batch = next(batches, None)
+                    if batch is None:
+                        break
+                    metrics.timing(f"{name}.decode", time.time() - start)
+                    start = time.time()
+                    for pre in pre_process[1:]:
+                        batch = pre(lam_arg=batch)
+                    df = None if batch is None else self.frame(batch, {})
+                    metrics.timing(f"{name}.extract", time.time() - start)
+                    yield df
+            except Exception as e:
+                logger.exception(e)
+                yield None
+            finally:
+                if f is not None:
+                    f.close()
+        finally:
+            if is_stream(source):
+                source.close()
+
+    def frame(self, data: List[dict], pre_2_post: dict) -> pd.DataFrame:
+        """
+        Performs data-feature extraction and post-processing on pre-processed data
+
+        Args:
+            data: The pre-processed data, a list of dictionaries that will each become a row in the DataFrame
+            pre_2_post: The features extracted by GlobalExtract pre-processors
+
+        Returns:
+            The cleaned data
+        """
         rows = []
         # For each row in the data
         for data_point in data:
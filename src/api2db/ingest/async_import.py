@@ -0,0 +1,139 @@
+# -*- coding: utf-8 -*-
+"""
+Contains the get_loop, run_async, iter_async and fetch_pages functions
+======================================================================
+
+NOTE:
+
+    A collector's ``import_target`` may be written as an ``async def`` function. Each collector process runs a single
+    event loop in a background thread, and the coroutine returned by the ``import_target`` is run on that loop, so the
+    import behaves exactly like a synchronous ``import_target`` from the point of view of the rest of the collector.
+
+    The ``fetch_pages`` helper fetches many pages concurrently, keeping at most ``concurrency`` requests in flight,
+    so a pull of 100 pages takes roughly the latency of a single page rather than the latency of 100 pages.
+
+    .. code-block:: python3
+
+        def fetch_page(page):
+            return http_get("https://api.example.com/items", params={"page": page}).json()
+
+        async def example_import():
+            return await fetch_pages(fetch_page, range(1, 101), concurrency=20)
+
+    ``fetch`` may be either a coroutine function, or a regular blocking function such as one using
+    :py:func:`api2db.ingest.http_import.http_get`, in which case it is run in a thread pool on the event loop.
+
+    By default the import fails if any page fails to fetch, so that a partial pull is never collected as if it were
+    complete, and a cursor kept with :py:class:`api2db.ingest.collector_state.CollectorState` never moves past a page
+    that was not collected. Pass ``strict=False`` to collect the pages that were fetched and skip those that failed.
+"""
+from ..app.log import get_logger
+from concurrent.futures import ThreadPoolExecutor
+from threading import Thread, Lock as ThreadLock
+import asyncio
+import os
+from typing import Any, AsyncIterator, Awaitable, Callable, Iterable, Iterator, List, Union
+
+MAX_THREADS = 32
+"""int: The number of threads used to run blocking page fetches on the event loop of each process"""
+
+_loops = {}
+"""dict: Maps the pid of each process to the event loop running in its background thread"""
+
+_loops_lock = ThreadLock()
+
+
+def get_loop() -> asyncio.AbstractEventLoop:
+    """
+    Retrieves the event loop for the current process, starting it in a background thread on first use
+
+    Returns:
+        The event loop for the current process
+    """
+    pid = os.getpid()
+    with _loops_lock:
+        if pid not in _loops:
+            loop = asyncio.new_event_loop()
+            loop.set_default_executor(ThreadPoolExecutor(max_workers=MAX_THREADS))
+            Thread(target=loop.run_forever, daemon=True).start()
+            _loops[pid] = loop
+        return _loops[pid]
+
+
+def run_async(coro: Awaitable) -> Any:
+    """
+    Runs a coroutine on the event loop for the current process, and waits for its result
+
+    Args:
+        coro: The coroutine to run
+
+    Returns:
+        The result of the coroutine
+
+    Raises:
+        Any exception raised by the coroutine
+    """
+    return asyncio.run_coroutine_threadsafe(coro, get_loop()).result()
+
+
+def iter_async(agen: AsyncIterator) -> Iterator[Any]:
+    """
+    Iterates an async generator from a synchronous thread, stepping it on the event loop for the current process
+
+    Args:
+        agen: The async generator to iterate
+
+    Returns:
+        A generator yielding each item of the async generator as it arrives
+    """
+    try:
+        while True:
+            try:
+                yield run_async(agen.__anext__())
+            except StopAsyncIteration:
+                return
+    finally:
+        run_async(agen.aclose())
+
+
+async def fetch_pages(fetch: Callable[[Any], Union[Any, Awaitable]],
+                      pages: Iterable[Any],
+                      concurrency: int=10,
+                      strict: bool=True) -> List[Any]:
+    """
+    Fetches pages concurrently
+
+    Args:
+        fetch: A function that fetches a single page, given the page. Either a coroutine function or a blocking
+               function
+        pages: The pages to fetch, I.e. page numbers, offsets or URLs
+        concurrency: The maximum number of pages fetched at once
+        strict: When True an exception is raised once every page has finished if any page failed to fetch, otherwise
+                the pages that failed are omitted
+
+    Returns:
+        The pages fetched, in the order of ``pages``. Pages that returned None are omitted
+
+    Raises:
+        RuntimeError if ``strict`` is True and any page failed to fetch
+    """
+    logger = get_logger()
+    loop = asyncio.get_running_loop()
+    sem = asyncio.Semaphore(concurrency)
+    is_async = asyncio.iscoroutinefunction(fetch)
+
+    async def fetch_one(page):
+        async with sem:
+            try:
+                if is_async:
+                    return await fetch(page)
+                return await loop.run_in_executor(None, fetch, page)
+            except Exception as e:
+                logger.exception(e)
+                return e
+
+    res = await asyncio.gather(*(fetch_one(page) for page in pages))
+    errors = [r for r in res if isinstance(r, Exception)]
+    if strict and len(errors) != 0:
+        raise RuntimeError(f"{len(errors)} of {len(res)} pages failed to fetch") from errors[0]
+    return [r for r in res if r is not None and not isinstance(r, Exception)]
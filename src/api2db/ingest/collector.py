@@ -4,9 +4,10 @@ Contains the Collector class
 ============================
 """
 from .api_form import ApiForm
+from .rate_limit import RateLimiter
 from ..stream.stream import Stream
 from ..store.store import Store
-from typing import Callable, List, Union
+from typing import Callable, List, Optional, Tuple, Union
 from multiprocessing import Queue
 
 
@@ -17,10 +18,22 @@ class Collector(object):
                  name: str,
                  seconds: int,
                  import_target: Callable[[], Union[List[dict], None]],
-                 api_form: Callable[[], ApiForm],
-                 streams: Callable[[], List[Stream]],
-                 stores: Callable[[], List[Store]],
-                 debug: bool = True):
+                 api_form: Optional[Callable[[], ApiForm]],
+                 streams: Optional[Callable[[], List[Stream]]],
+                 stores: Optional[Callable[[], List[Store]]],
+                 debug: bool = True,
+                 wal: bool = False,
+                 dedup_keys: Optional[List[str]] = None,
+                 dedup_ttl: Optional[int] = 86400,
+                 dedup_max_memory: int = 1000000,
+                 skip_unchanged: bool = False,
+                 import_timeout: Optional[float] = None,
+                 hedge: bool = False,
+                 rate_limit: Optional[RateLimiter] = None,
+                 decode: bool = False,
+                 branches: Optional[List[Tuple[Callable[[], ApiForm],
+                                               Callable[[], List[Stream]],
+                                               Callable[[], List[Store]]]]] = None):
         """
         Creates a Collector object
 
@@ -73,10 +86,61 @@ class Collector(object):
                            API requests and treat the data as a single incoming request. Most APIs will return a single
                            response, and if the implementation of the ``import_target`` does not make multiple API calls
                            then simply wrap that data in a list when returning it from the function.
-            api_form: This is a function that returns an API form.
-            streams: This is a function that returns a list of Stream object subclasses.
-            stores: This is a function that returns a list of Store object subclasses.
+
+                           The ``import_target`` may also be an ``async def`` function, in which case it is run on the
+                           event loop of the collector process. Paginated APIs can then fetch their pages concurrently.
+                           :py:func:`See documentation for fetch_pages <api2db.ingest.async_import.fetch_pages>`
+
+                           The ``import_target`` may also be a generator function yielding data points, I.e. a page
+                           at a time, or an ``async def`` generator function. Each data point is cleaned and passed to
+                           the streams as soon as it is yielded, rather than once every data point has been imported,
+                           so the complete import never has to be held in memory at once.
+
+                           Data points may also be returned as raw JSON documents, I.e. bytes or a ``pathlib.Path``,
+                           which api2db decodes when ``decode`` is set to True. :py:mod:`See documentation for
+                           json_decode <api2db.ingest.json_decode>`
+
+                           APIs that push their data over Server-Sent Events or WebSockets are collected with a
+                           :py:class:`PushImport <api2db.ingest.push_import.PushImport>`, which holds the connection
+                           open and collects the incoming messages in micro-batches. The collector is then not polled,
+                           and ``seconds`` is the interval at which the connection and streams are checked.
+            api_form: This is a function that returns an API form. May be None when ``branches`` are set.
+            streams: This is a function that returns a list of Stream object subclasses. May be None when
+                     ``branches`` are set.
+            stores: This is a function that returns a list of Store object subclasses. May be None when ``branches``
+                    are set.
             debug: When set to True logs will be printed to the console. Set to False for production.
+            wal: When set to True each batch of data is written to a write-ahead log before being passed to the
+                 streams, and each stream commits its position in the log. Data waiting to be streamed survives a
+                 crash or restart of the collector. :py:class:`See documentation for the SegmentLog
+                 <api2db.stream.segment_log.SegmentLog>`
+            dedup_keys: When set, rows that have already been collected are dropped before they reach any stream.
+                        Rows are identified by the values of the `dedup_keys` columns, or by every column when set to
+                        an empty list. :py:class:`See documentation for the DedupIndex
+                        <api2db.stream.dedup_index.DedupIndex>`
+            dedup_ttl: The number of seconds a collected row is remembered for. When None rows are remembered forever
+            dedup_max_memory: The number of row hashes cached in memory by the DedupIndex
+            skip_unchanged: When set to True each data point returned by the ``import_target`` is fingerprinted, and
+                            data points identical to those returned by the previous import are skipped before they are
+                            cleaned. :py:class:`See documentation for the PayloadFingerprint
+                            <api2db.ingest.fingerprint.PayloadFingerprint>`
+            import_timeout: When set, an import that has not returned within ``import_timeout`` seconds is abandoned
+                            and no data is collected. :py:class:`See documentation for the ImportRunner
+                            <api2db.ingest.import_runner.ImportRunner>`
+            hedge: When set to True an import running longer than usual is attempted a second time, and the first
+                   attempt to return data is collected
+            rate_limit: When set, each call of the ``import_target`` takes a token from the rate limiter, which is
+                        shared with every other collector using the same rate limit ``key``. :py:class:`See
+                        documentation for the RateLimiter <api2db.ingest.rate_limit.RateLimiter>`
+            decode: When set to True data points returned by the ``import_target`` as raw JSON documents, I.e. bytes,
+                    a ``pathlib.Path`` or a file object, are decoded before they are passed to the pre-processors.
+                    Otherwise they are passed to the pre-processors unchanged
+            branches: A list of ``(api_form, streams, stores)`` tuples. The data imported by the ``import_target`` is
+                      fed to the collector's own ``api_form`` and to the ``api_form`` of every branch, so that a single
+                      import can be split into several tables. Every ApiForm must have a different name. The
+                      ``dedup_keys`` only apply to the collector's own ``api_form``. Raw JSON documents that can only be
+                      read once, I.e. file objects and streamed responses, are read into memory so that every pipeline
+                      can parse them. :py:class:`See documentation for the Pipeline <api2db.app.pipeline.Pipeline>`
         """
         self.name = name
         self.seconds = seconds
@@ -85,6 +149,16 @@ class Collector(object):
         self.streams = streams
         self.stores = stores
         self.debug = debug
+        self.wal = wal
+        self.dedup_keys = dedup_keys
+        self.dedup_ttl = dedup_ttl
+        self.dedup_max_memory = dedup_max_memory
+        self.skip_unchanged = skip_unchanged
+        self.import_timeout = import_timeout
+        self.hedge = hedge
+        self.rate_limit = rate_limit
+        self.decode = decode
+        self.branches = [] if branches is None else branches
         self.q = None
         """Optional[multiprocessing.Queue]: A queue used for message passing if collector is running in debug mode"""
 
@@ -99,3 +173,51 @@ class Collector(object):
             None
         """
         self.q = q
+
+    def pipelines(self) -> List[Tuple[Optional[str],
+                                      Callable[[], ApiForm],
+                                      Callable[[], List[Stream]],
+                                      Callable[[], List[Store]]]]:
+        """
+        Lists the pipelines fed by the collector
+
+        Returns:
+            A list of ``(name, api_form, streams, stores)`` tuples, the collector's own ``api_form`` first if it is set,
+            followed by each of the ``branches``. The name is the name of the collector for its own ``api_form``, and
+            None for the branches, which are named after their ApiForm
+        """
+        res = []
+        if self.api_form is not None:
+            res.append((self.name, self.api_form, self.streams, self.stores))
+        for api_form, streams, stores in self.branches:
+            res.append((None, api_form, streams, stores))
+        return res
+
+    def pipeline_names(self) -> List[str]:
+        """
+        Names the pipelines fed by the collector, instantiating the ApiForm of each branch. Called in the collector
+        process, so that the ApiForms are not instantiated by the process that creates the collector
+
+        Returns:
+            The name of each pipeline, in the order of ``pipelines``
+
+        Raises:
+            ValueError if several pipelines have the same name
+        """
+        names = [api_form().name if pipeline_name is None else pipeline_name
+                 for pipeline_name, api_form, _, _ in self.pipelines()]
+        # Pipelines name their tables, dtypes files and write-ahead logs, so a name shared by two pipelines would mix
+        # their data
+        duplicates = sorted(set(n for n in names if names.count(n) > 1))
+        if len(duplicates) != 0:
+            raise ValueError(f"collector {self.name} has several pipelines named {', '.join(duplicates)}")
+        return names
+
+    def all_stores(self) -> List[Store]:
+        """
+        Instantiates the stores of every pipeline fed by the collector
+
+        Returns:
+            A list of Store object subclasses
+        """
+        return [store for _, _, _, stores in self.pipelines() for store in stores()]
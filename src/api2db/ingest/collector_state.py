@@ -0,0 +1,219 @@
+# -*- coding: utf-8 -*-
+"""
+Contains the CollectorState class and the get_state function
+============================================================
+
+NOTE:
+
+    A CollectorState lets an ``import_target`` keep state between imports, such as the cursor of an API that supports
+    incremental fetching with ``since_id`` or ``updated_after`` parameters, so that each import only fetches what is
+    new.
+    The state of each collector is stored in the SQLite file
+
+        CACHE/**collector_name**_state.sqlite
+
+    so it survives restarts of the collector. Values must be JSON serializable.
+
+    .. code-block:: python3
+
+        def example_import():
+            state = get_state("example")
+            since = state.get("since_id", 0)
+            data = requests.get("https://api.example.com/items", params={"since_id": since}).json()
+            if len(data["items"]) != 0:
+                state.set("since_id", data["items"][-1]["id"])
+            return [data]
+
+    Values set by the ``import_target`` are only staged. They are committed atomically once every data point of the
+    import has been handed to the streams, and discarded if the import fails or is truncated at its deadline, so a
+    cursor never moves past data that has not been collected. Enable the collector's ``wal`` for the data to survive a
+    crash once it has been handed to the streams. If the collector crashes after the data has been handed to the streams
+    but before the state is committed, the data is fetched again by the next import. Use ``dedup_keys`` to drop the rows
+    collected twice.
+
+    Staged values are visible to ``get`` straight away, so a generator ``import_target`` can page with its cursor.
+    Values are staged separately for each attempt at an import run by an
+    :py:class:`ImportRunner <api2db.ingest.import_runner.ImportRunner>`, and the values staged by an attempt are
+    discarded once it is abandoned at its deadline or loses a hedge, so only the attempt whose data is collected moves
+    the cursor. A collector does not start an import while its previous import is still running, so the values staged
+    by one import are never committed by another.
+"""
+from ..app.log import get_logger
+from .import_runner import CancelToken, current_token
+from threading import Lock as ThreadLock
+import json
+import sqlite3
+import os
+import time
+from typing import Any, Optional
+
+_states = {}
+"""dict: Maps the pid of each process and the name of each collector to its CollectorState"""
+
+_states_lock = ThreadLock()
+
+
+class CollectorState(object):
+    """A persistent key-value store for the state of a collector, committed only once data reaches the streams"""
+
+    def __init__(self, name: str, path: Optional[str]=None):
+        """
+        Creates a CollectorState object. The state file is opened lazily upon first use
+
+        Args:
+            name: The name of the collector associated with the state
+            path: The path to the state file, defaults to CACHE/**collector_name**_state.sqlite
+        """
+        self.name = name
+        self.path = os.path.join("CACHE", f"{name}_state.sqlite") if path is None else path
+        self.staged = {}
+        """dict: The values set since the state was last committed, by the CancelToken of the attempt that set them"""
+        self.con = None
+        self.lock = ThreadLock()
+        self.warned = False
+
+    def connect(self) -> sqlite3.Connection:
+        """
+        Opens the state file, creating it if it does not exist. Must be called while holding the lock
+
+        Returns:
+            The connection to the state file
+        """
+        if self.con is None:
+            dir_path = os.path.dirname(self.path)
+            if dir_path != "" and not os.path.isdir(dir_path):
+                os.makedirs(dir_path, exist_ok=True)
+            self.con = sqlite3.connect(self.path, timeout=30.0, check_same_thread=False)
+            self.con.execute("PRAGMA journal_mode=WAL")
+            self.con.execute("CREATE TABLE IF NOT EXISTS state (key TEXT PRIMARY KEY, value TEXT, updated REAL)")
+            self.con.commit()
+        return self.con
+
+    def get(self, key: str, default: Any=None) -> Any:
+        """
+        Retrieves a value, including values staged but not yet committed
+
+        Args:
+            key: The name of the value
+            default: Returned if the value has never been set
+
+        Returns:
+            The value
+        """
+        token = current_token()
+        with self.lock:
+            staged = self.staged.get(token, {})
+            if key in staged:
+                return staged[key]
+            row = self.connect().execute("SELECT value FROM state WHERE key = ?", (key, )).fetchone()
+        return default if row is None else json.loads(row[0])
+
+    def set(self, key: str, value: Any) -> None:
+        """
+        Stages a value, which is committed once the data of the current import has been handed to the streams.
+        Values set by an attempt at an import that has been abandoned are discarded
+
+        Args:
+            key: The name of the value
+            value: The value, which must be JSON serializable
+
+        Returns:
+            None
+        """
+        json.dumps(value)
+        token = current_token()
+        with self.lock:
+            if token not in self.staged:
+                self.staged[token] = {}
+                if token is not None:
+                    token.callbacks.append(lambda: self.discard(token))
+            self.staged[token][key] = value
+            # The attempt may have been abandoned before its callback was added
+            if token is not None and token.cancelled:
+                self.staged.pop(token, None)
+
+    def discard(self, token: CancelToken) -> None:
+        """
+        Discards the values staged by an attempt at an import that has been abandoned
+
+        Args:
+            token: The CancelToken of the attempt
+
+        Returns:
+            None
+        """
+        with self.lock:
+            self.staged.pop(token, None)
+
+    def commit(self, durable: bool=True) -> None:
+        """
+        Atomically writes the staged values to the state file
+
+        Args:
+            durable: False if the data handed to the streams is not written to a write-ahead log, in which case a
+                     warning is logged, since the data is lost if the collector crashes before it is stored and the
+                     committed state means it is not fetched again
+
+        Returns:
+            None
+        """
+        logger = get_logger()
+        with self.lock:
+            staged = {}
+            for values in self.staged.values():
+                staged.update(values)
+            if len(staged) == 0:
+                return
+            if not durable and not self.warned:
+                logger.warning(f"state of {self.name} committed without a write-ahead log: data not yet stored is "
+                               f"lost if the collector crashes. Enable the collector's wal to keep it")
+                self.warned = True
+            now = time.time()
+            try:
+                con = self.connect()
+                with con:
+                    con.executemany("INSERT OR REPLACE INTO state (key, value, updated) VALUES (?, ?, ?)",
+                                    [(k, json.dumps(v), now) for k, v in staged.items()])
+                self.staged = {}
+            except Exception as e:
+                logger.exception(e)
+
+    def rollback(self) -> None:
+        """
+        Discards the staged values
+
+        Returns:
+            None
+        """
+        with self.lock:
+            self.staged = {}
+
+    def close(self) -> None:
+        """
+        Closes the state file, discarding any staged values
+
+        Returns:
+            None
+        """
+        with self.lock:
+            self.staged = {}
+            if self.con is not None:
+                self.con.close()
+            self.con = None
+
+
+def get_state(name: str) -> CollectorState:
+    """
+    Retrieves the state of a collector for the current process, creating it on first use
+
+    Args:
+        name: The name of the collector
+
+    Returns:
+        The CollectorState of the collector
+    """
+    k = (os.getpid(), name)
+    with _states_lock:
+        if k not in _states:
+            _states[k] = CollectorState(name)
+        return _states[k]
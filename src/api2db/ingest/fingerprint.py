@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+"""
+Contains the PayloadFingerprint class
+=====================================
+
+NOTE:
+
+    A PayloadFingerprint is used by a :py:class:`api2db.ingest.collector.Collector` with `skip_unchanged=True` to skip
+    data points that are identical to the data point returned at the same position by the previous import.
+
+    Each data point returned by the ``import_target`` is fingerprinted with a stable hash, either of its raw bytes or
+    of its JSON representation with sorted keys. When a data point has the same fingerprint as the data point at the
+    same position in the previous import, it is skipped before any pre-processing, feature extraction or
+    post-processing is performed, and nothing is passed to the streams.
+
+    The number of data points skipped and processed are recorded in the metrics of the collector as
+    **collector_name**.payloads_skipped and **collector_name**.payloads_changed
+"""
+from ..app.metrics import get_metrics
+import hashlib
+import json
+import os
+from typing import Any, Optional
+
+
+class PayloadFingerprint(object):
+    """Remembers the fingerprint of each data point imported by a collector to skip unchanged data points"""
+
+    def __init__(self, name: str):
+        """
+        Creates a PayloadFingerprint object
+
+        Args:
+            name: The name of the collector associated with the fingerprints
+        """
+        self.name = name
+        self.fingerprints = {}
+        """dict: Maps the position of each data point to the fingerprint of the data point last processed there"""
+
+    @staticmethod
+    def fingerprint(data_point: Any) -> str:
+        """
+        Computes a stable fingerprint of a data point
+
+        Args:
+            data_point: The data point, either raw bytes, a string, a path to a file, or JSON serializable data such
+                        as a dictionary
+
+        Returns:
+            The hex digest of the blake2b hash of the data point
+        """
+        if isinstance(data_point, os.PathLike):
+            h = hashlib.blake2b(digest_size=16)
+            with open(data_point, "rb") as f:
+                for chunk in iter(lambda: f.read(1 << 20), b""):
+                    h.update(chunk)
+            return h.hexdigest()
+        if isinstance(data_point, (bytes, bytearray, memoryview)):
+            raw = bytes(data_point)
+        elif isinstance(data_point, str):
+            raw = data_point.encode("utf-8")
+        else:
+            raw = json.dumps(data_point, sort_keys=True, separators=(",", ":"), default=str).encode("utf-8")
+        return hashlib.blake2b(raw, digest_size=16).hexdigest()
+
+    def changed(self, i: int, data_point: Any) -> Optional[str]:
+        """
+        Determines if a data point has changed since the previous import
+
+        Args:
+            i: The position of the data point in the import
+            data_point: The data point
+
+        Returns:
+            The fingerprint of the data point if it has changed, otherwise None
+        """
+        fp = PayloadFingerprint.fingerprint(data_point)
+        if self.fingerprints.get(i) == fp:
+            get_metrics().incr(f"{self.name}.payloads_skipped")
+            return None
+        get_metrics().incr(f"{self.name}.payloads_changed")
+        return fp
+
+    def commit(self, i: int, fp: str) -> None:
+        """
+        Remembers the fingerprint of a data point once it has been handed to the streams
+
+        Args:
+            i: The position of the data point in the import
+            fp: The fingerprint of the data point
+
+        Returns:
+            None
+        """
+        self.fingerprints[i] = fp
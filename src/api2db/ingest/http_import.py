@@ -0,0 +1,349 @@
+# -*- coding: utf-8 -*-
+"""
+Contains the HttpImport class and the get_session, http_get and response header staging functions
+=================================================================================================
+
+NOTE:
+
+    HttpImport is a ready-made ``import_target`` for collectors that import data with HTTP GET requests. Rather than
+    writing
+
+    .. code-block:: python3
+
+        def coincap_import():
+            data = None
+            url = "https://api.coincap.io/v2/assets/"
+            try:
+                data = [requests.get(url).json()]
+            except Exception as e:
+                logging.exception(e)
+            return data
+
+    a collector can be given
+
+    .. code-block:: python3
+
+        import_target=HttpImport("https://api.coincap.io/v2/assets/")
+
+    Every request made by a collector process shares a single pooled ``requests.Session``, so connections are kept
+    alive between imports rather than performing a new TCP and TLS handshake every time. Responses are requested with
+    compression.
+
+    When ``conditional=True`` the ``ETag`` and ``Last-Modified`` headers of each response are remembered, and sent back
+    as ``If-None-Match`` and ``If-Modified-Since`` on the next request to the same URL. A ``304 Not Modified`` response
+    means the API has no new data, and the import returns None without any data being processed.
+
+    While a collector is importing, the headers of each response are only staged. They are remembered once the data of
+    the import has been handed to the streams, and discarded if the import fails or is abandoned, so that a response
+    whose data was never collected is not answered with ``304 Not Modified`` the next time it is requested.
+
+    The following metrics are recorded for each host
+
+        * http.**host**.requests -> The number of requests made
+        * http.**host**.not_modified -> The number of requests answered with 304 Not Modified
+        * http.**host**.errors -> The number of requests that failed
+        * http.**host**.request -> The duration of the requests
+"""
+from ..app.log import get_logger
+from ..app.metrics import get_metrics
+from .import_runner import check_cancelled, current_token
+from .rate_limit import RateLimiter
+from .response_cache import ResponseCache
+from .json_decode import loads
+from requests.adapters import HTTPAdapter
+from urllib.parse import urlencode, urlsplit
+from threading import Lock as ThreadLock
+import requests
+import io
+import os
+import time
+from typing import Any, List, Optional, Tuple, Union
+
+POOL_SIZE = 10
+"""int: The number of connections kept alive per host by the session of each process"""
+
+_sessions = {}
+"""dict: Maps the pid of each process to its requests.Session"""
+
+_validators = {}
+"""dict: Maps the pid of each process to a dictionary mapping each request to its ETag and Last-Modified headers"""
+
+_staged_validators = {}
+"""dict: Maps the pid of each process importing for a collector to the headers received by the import, by the
+CancelToken of the attempt that received them"""
+
+_validators_lock = ThreadLock()
+
+
+def get_session() -> requests.Session:
+    """
+    Retrieves the pooled session for the current process, creating it on first use
+
+    Sessions are not shared between processes, since connections cannot be shared between processes.
+
+    Returns:
+        The requests.Session for the current process
+    """
+    pid = os.getpid()
+    if pid not in _sessions:
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=POOL_SIZE, pool_maxsize=POOL_SIZE)
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        session.headers.update({"Accept-Encoding": "gzip, deflate"})
+        _sessions.setdefault(pid, session)
+    return _sessions[pid]
+
+
+def defer_validators() -> None:
+    """
+    Stages the ETag and Last-Modified headers of the responses received by the current process until they are
+    committed or discarded. Called by a collector before it imports
+
+    Returns:
+        None
+    """
+    with _validators_lock:
+        _staged_validators[os.getpid()] = {}
+
+
+def commit_validators() -> None:
+    """
+    Remembers the headers staged since ``defer_validators`` was called, once the data of the import has been handed to
+    the streams
+
+    Returns:
+        None
+    """
+    pid = os.getpid()
+    with _validators_lock:
+        staged = _staged_validators.pop(pid, {})
+        validators = _validators.setdefault(pid, {})
+        for values in staged.values():
+            validators.update(values)
+
+
+def discard_validators() -> None:
+    """
+    Discards the headers staged since ``defer_validators`` was called, when the data of the import was not collected
+
+    Returns:
+        None
+    """
+    with _validators_lock:
+        _staged_validators.pop(os.getpid(), None)
+
+
+def save_validators(key: str, etag: Optional[str], last_modified: Optional[str]) -> None:
+    """
+    Remembers the ETag and Last-Modified headers of a response, or stages them if the current process is importing for
+    a collector. Headers received by an attempt at an import that has been abandoned are discarded
+
+    Args:
+        key: The URL and parameters of the request
+        etag: The ETag header of the response
+        last_modified: The Last-Modified header of the response
+
+    Returns:
+        None
+    """
+    pid = os.getpid()
+    token = current_token()
+    with _validators_lock:
+        if token is not None and token.cancelled:
+            return
+        staged = _staged_validators.get(pid)
+        if staged is None:
+            _validators.setdefault(pid, {})[key] = (etag, last_modified)
+            return
+        if token not in staged:
+            staged[token] = {}
+            if token is not None:
+                token.callbacks.append(lambda: staged.pop(token, None))
+        staged[token][key] = (etag, last_modified)
+        # The attempt may have been abandoned before its callback was added
+        if token is not None and token.cancelled:
+            staged.pop(token, None)
+
+
+def http_get(url: str,
+             params: Optional[dict]=None,
+             headers: Optional[dict]=None,
+             timeout: Union[float, Tuple[float, float]]=(5.0, 30.0),
+             conditional: bool=True,
+             stream: bool=False,
+             rate_limit: Optional[RateLimiter]=None) -> Optional[requests.Response]:
+    """
+    Performs a GET request using the pooled session for the current process
+
+    Args:
+        url: The URL to request
+        params: The query parameters of the request
+        headers: Additional headers to send with the request
+        timeout: The number of seconds to wait to connect and to wait between bytes of the response, either as a
+                 single number or as a tuple of (connect, read)
+        conditional: When True the request is made conditional on the response having changed since the previous
+                     request to the same URL with the same parameters
+        stream: When True the body of the response is not downloaded until it is read
+        rate_limit: When set, a token is taken from the rate limiter before the request is made
+
+    Returns:
+        The response, or None if the response has not changed since the previous request
+
+    Raises:
+        requests.RequestException if the request fails or the response has an error status, or TimeoutError if the
+        import making the request has been abandoned or the rate limit could not be acquired before its deadline
+    """
+    host = urlsplit(url).netloc
+    metrics = get_metrics()
+    key = f"{url}?{urlencode(sorted((params or {}).items()), doseq=True)}"
+    validators = _validators.setdefault(os.getpid(), {})
+    headers = dict(headers or {})
+    if conditional and key in validators:
+        etag, last_modified = validators[key]
+        if etag is not None:
+            headers["If-None-Match"] = etag
+        if last_modified is not None:
+            headers["If-Modified-Since"] = last_modified
+    if rate_limit is not None:
+        rate_limit.acquire_or_raise()
+    # Never wait past the deadline of the import, and do not start requests for imports that have been abandoned
+    token = current_token()
+    if token is not None:
+        check_cancelled()
+        remaining = token.remaining()
+        if remaining is not None:
+            timeout = tuple(min(t, remaining) for t in timeout) if isinstance(timeout, tuple) else \
+                min(timeout, remaining)
+    start = time.time()
+    metrics.incr(f"http.{host}.requests")
+    try:
+        response = get_session().get(url, params=params, headers=headers, timeout=timeout, stream=stream)
+        if response.status_code == 304:
+            metrics.incr(f"http.{host}.not_modified")
+            return None
+        response.raise_for_status()
+    except requests.RequestException:
+        metrics.incr(f"http.{host}.errors")
+        raise
+    finally:
+        metrics.timing(f"http.{host}.request", time.time() - start)
+    if conditional:
+        etag = response.headers.get("ETag")
+        last_modified = response.headers.get("Last-Modified")
+        if etag is not None or last_modified is not None:
+            save_validators(key, etag, last_modified)
+    return response
+
+
+class HttpImport(object):
+    """An import target that requests data from a URL with a pooled session and conditional requests"""
+
+    def __init__(self,
+                 url: str,
+                 params: Optional[dict]=None,
+                 headers: Optional[dict]=None,
+                 timeout: Union[float, Tuple[float, float]]=(5.0, 30.0),
+                 conditional: bool=True,
+                 raw: bool=False,
+                 stream: bool=False,
+                 rate_limit: Optional[RateLimiter]=None,
+                 cache: Optional[ResponseCache]=None):
+        """
+        Creates a HttpImport object
+
+        Args:
+            url: The URL to request
+            params: The query parameters of the request
+            headers: Additional headers to send with the request, I.e. authorization headers
+            timeout: The number of seconds to wait to connect and to wait between bytes of the response, either as a
+                     single number or as a tuple of (connect, read)
+            conditional: When True a request answered with 304 Not Modified imports no data
+            raw: When True the body of the response is imported as bytes rather than decoded as JSON, to be decoded
+                 by a collector created with ``decode=True``
+            stream: When True the response itself is imported without its body being read, so that the body can be
+                    parsed incrementally by a :py:class:`api2db.ingest.pre_process.list_extract.ListExtract` with a
+                    ``path``
+            rate_limit: When set, a token is taken from the rate limiter before each request. :py:class:`See
+                        documentation for the RateLimiter <api2db.ingest.rate_limit.RateLimiter>`
+            cache: When set, responses are served from the cache, which is shared with every other collector, and
+                   identical requests made by several collectors at once are coalesced into a single request. Requests
+                   served from the cache are never conditional. :py:class:`See documentation for the ResponseCache
+                   <api2db.ingest.response_cache.ResponseCache>`
+        """
+        self.url = url
+        self.params = params
+        self.headers = headers
+        self.timeout = timeout
+        self.conditional = conditional
+        self.raw = raw
+        self.stream = stream
+        self.rate_limit = rate_limit
+        self.cache = cache
+
+    def __call__(self) -> Optional[List[Any]]:
+        """
+        Performs the request
+
+        Returns:
+            A list containing the decoded response, or None if the request failed or there is no new data
+        """
+        logger = get_logger()
+        if self.cache is not None:
+            return self.cached()
+        try:
+            response = http_get(url=self.url,
+                                params=self.params,
+                                headers=self.headers,
+                                timeout=self.timeout,
+                                conditional=self.conditional,
+                                stream=self.stream,
+                                rate_limit=self.rate_limit)
+        except Exception as e:
+            logger.exception(e)
+            return None
+        if response is None:
+            logger.debug(f"{self.url} not modified")
+            return None
+        if self.stream:
+            return [response]
+        try:
+            return [response.content if self.raw else response.json()]
+        except Exception as e:
+            logger.exception(e)
+            return None
+
+    def cached(self) -> Optional[List[Any]]:
+        """
+        Performs the request through the response cache
+
+        Returns:
+            A list containing the decoded response, or None if the request failed
+        """
+        logger = get_logger()
+        key = ResponseCache.key("GET",
+                                self.url,
+                                urlencode(sorted((self.params or {}).items()), doseq=True),
+                                urlencode(sorted((self.headers or {}).items())))
+
+        def fetch():
+            return http_get(url=self.url,
+                            params=self.params,
+                            headers=self.headers,
+                            timeout=self.timeout,
+                            conditional=False,
+                            rate_limit=self.rate_limit).content
+
+        token = current_token()
+        try:
+            body = self.cache.get_or_fetch(key, fetch, timeout=None if token is None else token.remaining())
+        except Exception as e:
+            logger.exception(e)
+            return None
+        if self.stream:
+            return [io.BytesIO(body)]
+        try:
+            return [body if self.raw else loads(body)]
+        except Exception as e:
+            logger.exception(e)
+            return None
@@ -0,0 +1,323 @@
+# -*- coding: utf-8 -*-
+"""
+Contains the CancelToken and ImportRunner classes and the current_token, use_token and check_cancelled functions
+=================================================================================================================
+
+NOTE:
+
+    An ImportRunner is used by a :py:class:`api2db.ingest.collector.Collector` with ``import_timeout`` or ``hedge``
+    set to run its ``import_target`` in a separate thread, so that an API that hangs cannot hang the collector.
+
+    **Deadlines**
+
+    When the ``import_target`` has not returned within ``import_timeout`` seconds the import is abandoned and no data
+    is collected. The thread running the ``import_target`` is signalled to stop through its CancelToken. Python threads
+    cannot be stopped from the outside, so cancellation is cooperative
+
+        * :py:func:`api2db.ingest.http_import.http_get` refuses to start requests once the token is cancelled, and
+          never waits longer than the time remaining before the deadline
+        * ``async def`` import targets are cancelled on the event loop
+        * Any other ``import_target`` can call ``check_cancelled()`` between requests, which raises a TimeoutError once
+          the import has been abandoned
+
+    Data points yielded by generator import targets after the deadline are discarded, and the import is treated as
+    failed. The data points yielded before the deadline have already been collected, but the state staged by the
+    import is discarded, so the next import starts again from the same cursor.
+
+    **Hedged requests**
+
+    When ``hedge=True`` the runner records how long the ``import_target`` takes to return. Once enough imports have been
+    recorded, an import still running after the 95th percentile of those durations is hedged. A second attempt is
+    started, the first attempt to return data wins, and the other attempt is cancelled. An occasional slow response
+    then costs roughly the 95th percentile latency rather than the full latency of the slow response.
+
+    Hedging calls the ``import_target`` twice, so it should only be enabled for import targets without side effects.
+
+    The following metrics are recorded for each collector
+
+        * **collector_name**.import -> The duration of the imports that returned data
+        * **collector_name**.import_timeouts -> The number of imports abandoned at the deadline
+        * **collector_name**.import_hedged -> The number of imports that were hedged
+        * **collector_name**.import_hedge_wins -> The number of hedged imports won by the second attempt
+"""
+from .async_import import get_loop, iter_async, run_async
+from ..app.log import get_logger
+from ..app.metrics import get_metrics
+from threading import Thread, Event, local
+from queue import Queue as ThreadQueue, Empty
+from collections import deque
+import asyncio
+import inspect
+import time
+from typing import Any, Callable, Iterator, Optional
+
+_local = local()
+
+
+class CancelToken(object):
+    """Signals an import that it has been abandoned, and tracks the deadline of the import"""
+
+    def __init__(self, deadline: Optional[float]=None):
+        """
+        Creates a CancelToken object
+
+        Args:
+            deadline: The time the import will be abandoned, or None if it has no deadline
+        """
+        self.deadline = deadline
+        self.event = Event()
+        self.callbacks = []
+        """list: Functions called when the token is cancelled"""
+
+    @property
+    def cancelled(self) -> bool:
+        """bool: True once the import has been abandoned, or once its deadline has passed"""
+        return self.event.is_set() or (self.deadline is not None and time.time() >= self.deadline)
+
+    def cancel(self) -> None:
+        """
+        Abandons the import
+
+        Returns:
+            None
+        """
+        self.event.set()
+        for callback in self.callbacks:
+            callback()
+
+    def remaining(self) -> Optional[float]:
+        """
+        Computes the number of seconds remaining before the deadline
+
+        Returns:
+            The number of seconds remaining, or None if the import has no deadline
+        """
+        if self.deadline is None:
+            return None
+        return max(0.0, self.deadline - time.time())
+
+
+def current_token() -> Optional[CancelToken]:
+    """
+    Retrieves the CancelToken of the import running in the current thread
+
+    Returns:
+        The CancelToken, or None if the current thread is not running an import with a deadline or hedging
+    """
+    return getattr(_local, "token", None)
+
+
+def use_token(token: Optional[CancelToken]) -> None:
+    """
+    Sets the CancelToken of the import running in the current thread
+
+    Args:
+        token: The CancelToken, or None once the import has finished
+
+    Returns:
+        None
+    """
+    _local.token = token
+
+
+def check_cancelled() -> None:
+    """
+    Checks whether the import running in the current thread has been abandoned
+
+    Returns:
+        None
+
+    Raises:
+        TimeoutError if the import has been abandoned
+    """
+    token = current_token()
+    if token is not None and token.cancelled:
+        raise TimeoutError("import cancelled")
+
+
+class ImportRunner(object):
+    """Runs the import_target of a collector with a deadline, and optionally hedges slow imports"""
+
+    def __init__(self,
+                 name: str,
+                 timeout: Optional[float]=None,
+                 hedge: bool=False,
+                 quantile: float=0.95,
+                 min_samples: int=20,
+                 history: int=200):
+        """
+        Creates an ImportRunner object
+
+        Args:
+            name: The name of the collector associated with the runner
+            timeout: The number of seconds after which an import is abandoned, or None for no deadline
+            hedge: When True imports running longer than the ``quantile`` of previous imports are hedged
+            quantile: The quantile of previous import durations after which an import is hedged
+            min_samples: The number of imports recorded before imports are hedged
+            history: The number of most recent import durations the quantile is computed from
+        """
+        self.name = name
+        self.timeout = timeout
+        self.hedge = hedge
+        self.quantile = quantile
+        self.min_samples = min_samples
+        self.durations = deque(maxlen=history)
+        """collections.deque: The durations of the most recent imports that returned data"""
+
+    def hedge_delay(self) -> Optional[float]:
+        """
+        Computes the number of seconds after which an import is hedged
+
+        Returns:
+            The delay, or None if the import should not be hedged
+        """
+        if not self.hedge or len(self.durations) < self.min_samples:
+            return None
+        durations = sorted(self.durations)
+        return durations[min(len(durations) - 1, int(self.quantile * len(durations)))]
+
+    @staticmethod
+    def attempt(import_target: Callable[[], Any], token: CancelToken, results: ThreadQueue, i: int) -> None:
+        """
+        The target of the thread running a single attempt at an import
+
+        Args:
+            import_target: The import_target of the collector
+            token: The CancelToken of the attempt
+            results: The queue the result of the attempt is placed in
+            i: The number of the attempt
+
+        Returns:
+            None
+        """
+        _local.token = token
+        data = None
+        try:
+            data = import_target()
+            if inspect.isawaitable(data):
+                future = asyncio.run_coroutine_threadsafe(ImportRunner.awaitable(data), get_loop())
+                token.callbacks.append(future.cancel)
+                if token.cancelled:
+                    future.cancel()
+                data = future.result()
+        except Exception as e:
+            if not token.cancelled:
+                logger = get_logger()
+                logger.exception(e)
+        finally:
+            _local.token = None
+            results.put((i, data))
+
+    @staticmethod
+    async def awaitable(data: Any) -> Any:
+        """
+        Wraps an awaitable in a coroutine so that it can be scheduled on the event loop
+
+        Args:
+            data: The awaitable
+
+        Returns:
+            The result of the awaitable
+        """
+        return await data
+
+    def run(self, import_target: Callable[[], Any]) -> Any:
+        """
+        Performs an import
+
+        Args:
+            import_target: The import_target of the collector
+
+        Returns:
+            The data returned by the first attempt to return data, or None if no attempt returned data before the
+            deadline
+        """
+        if self.timeout is None and not self.hedge:
+            data = import_target()
+            if inspect.isawaitable(data):
+                data = run_async(data)
+            return data
+        metrics = get_metrics()
+        start = time.time()
+        deadline = None if self.timeout is None else start + self.timeout
+        hedge_at = self.hedge_delay()
+        hedge_at = None if hedge_at is None else start + hedge_at
+        results = ThreadQueue()
+        tokens = []
+
+        def launch():
+            token = CancelToken(deadline)
+            tokens.append(token)
+            Thread(target=ImportRunner.attempt,
+                   args=(import_target, token, results, len(tokens) - 1),
+                   daemon=True).start()
+
+        launch()
+        pending = 1
+        data = None
+        winner = None
+        while pending > 0:
+            waits = [t for t in (deadline, hedge_at) if t is not None]
+            wait = None if len(waits) == 0 else max(0.0, min(waits) - time.time())
+            try:
+                i, res = results.get(timeout=wait)
+            except Empty:
+                if hedge_at is not None and time.time() >= hedge_at:
+                    hedge_at = None
+                    metrics.incr(f"{self.name}.import_hedged")
+                    launch()
+                    pending += 1
+                    continue
+                break
+            pending -= 1
+            if res is not None:
+                data, winner = res, i
+                break
+        # Cancel the attempts that did not win, so that they stop and their staged state is discarded
+        for i, token in enumerate(tokens):
+            if i != winner:
+                token.cancel()
+        if winner is None:
+            if pending > 0:
+                logger = get_logger()
+                logger.warning(f"import abandoned after {self.timeout} seconds")
+                metrics.incr(f"{self.name}.import_timeouts")
+            return None
+        duration = time.time() - start
+        metrics.timing(f"{self.name}.import", duration)
+        if winner > 0:
+            metrics.incr(f"{self.name}.import_hedge_wins")
+        self.durations.append(duration)
+        # Generator import targets continue to run after they have returned, so they are bounded by the deadline
+        if inspect.isasyncgen(data):
+            data = iter_async(data)
+        if deadline is not None and inspect.isgenerator(data):
+            data = self.bounded(data, CancelToken(deadline))
+        return data
+
+    def bounded(self, data: Iterator[Any], token: CancelToken) -> Iterator[Any]:
+        """
+        Stops a generator import target once its deadline has passed
+
+        Args:
+            data: The generator returned by the import_target
+            token: The CancelToken of the import, made current while the generator runs
+
+        Returns:
+            A generator yielding the data points yielded by the import_target before the deadline
+
+        Raises:
+            TimeoutError once the deadline has passed, so that the truncated import is not treated as complete
+        """
+        _local.token = token
+        try:
+            for data_point in data:
+                if token.cancelled:
+                    get_metrics().incr(f"{self.name}.import_timeouts")
+                    # Discard the state staged by the import
+                    token.cancel()
+                    raise TimeoutError(f"import abandoned after {self.timeout} seconds")
+                yield data_point
+        finally:
+            _local.token = None
+            data.close()
@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+"""
+Contains the loads, read_raw and decode functions
+=================================================
+
+NOTE:
+
+    An ``import_target`` of a collector created with ``decode=True`` may return raw JSON documents rather than
+    decoded dictionaries, leaving the decoding to api2db. Each data point may be
+
+        * bytes containing the document
+        * A ``pathlib.Path`` to a file containing the document
+        * A binary file object, or a ``requests.Response``
+
+    Documents are decoded with `orjson <https://github.com/ijl/orjson>`_ when it is installed, which is several times
+    faster than the built-in ``json`` library, and with the built-in ``json`` library otherwise. Documents orjson
+    rejects but the built-in library accepts, I.e. documents containing ``NaN`` or integers larger than 64 bits, are
+    decoded with the built-in library, so the result never depends on whether orjson is installed.
+
+    Data points that are a str, and every data point of a collector created without ``decode=True``, are passed to
+    the pre-processors unchanged, since they may not contain JSON, unless they are parsed incrementally by a
+    :py:class:`api2db.ingest.pre_process.list_extract.ListExtract` with a ``path``.
+
+    The time spent decoding is recorded in the metrics of the collector as **collector_name**.decode, separately from
+    the time spent extracting the data, which is recorded as **collector_name**.extract
+"""
+import json
+import os
+from typing import Any, Union
+try:
+    import orjson
+except ModuleNotFoundError:
+    orjson = None
+
+
+def loads(raw: Union[bytes, bytearray, memoryview, str]) -> Any:
+    """
+    Decodes a JSON document, using orjson when it is installed
+
+    Args:
+        raw: The JSON document
+
+    Returns:
+        The decoded document
+
+    Raises:
+        json.JSONDecodeError if the document is invalid
+    """
+    if orjson is not None:
+        try:
+            return orjson.loads(raw)
+        except orjson.JSONDecodeError:
+            pass
+    if isinstance(raw, memoryview):
+        raw = raw.tobytes()
+    return json.loads(raw)
+
+
+def read_raw(data: Any) -> Union[bytes, bytearray, memoryview, str]:
+    """
+    Reads a raw JSON document into memory without decoding it
+
+    Args:
+        data: The JSON document as bytes or a str, a path to a file containing the document, a file object, or a
+              ``requests.Response``
+
+    Returns:
+        The JSON document
+    """
+    if isinstance(data, os.PathLike):
+        with open(data, "rb") as f:
+            return f.read()
+    elif hasattr(data, "iter_content"):
+        return data.content
+    elif hasattr(data, "read"):
+        return data.read()
+    return data
+
+
+def decode(data: Any) -> Any:
+    """
+    Reads and decodes a raw JSON document
+
+    Args:
+        data: The JSON document as bytes or a str, a path to a file containing the document, a file object, or a
+              ``requests.Response``
+
+    Returns:
+        The decoded document
+    """
+    return loads(read_raw(data))
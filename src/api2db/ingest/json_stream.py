@@ -0,0 +1,247 @@
+# -*- coding: utf-8 -*-
+"""
+Contains the iter_json_items, iter_json_batches, is_raw and is_stream functions
+==============================================================================
+
+NOTE:
+
+    ``iter_json_items`` parses the items of a single array within a JSON document incrementally, reading the document
+    a chunk at a time. Only the items of the array are decoded, one at a time, and everything before and after the
+    array is skipped without being decoded, so the fully decoded document never exists in memory.
+
+    The array is located using a path of object keys separated by ``.``. I.e. for the document
+
+    ::
+
+        {"meta": {"count": 2}, "result": {"rows": [{"id": 1}, {"id": 2}]}}
+
+    the path ``"result.rows"`` yields ``{"id": 1}`` and then ``{"id": 2}``. The path ``""`` is used when the document
+    itself is the array.
+
+    The document may be given as
+
+        * bytes or a str
+        * A binary or text file object, I.e. ``open("response.json", "rb")``
+        * A ``requests.Response`` requested with ``stream=True``
+        * An iterable of bytes or str chunks
+"""
+from json import JSONDecoder
+from json.decoder import JSONDecodeError, scanstring
+import codecs
+import os
+import re
+from typing import Any, Iterator, List
+
+CHUNK_SIZE = 1 << 16
+"""int: The number of bytes read from the document at a time"""
+
+_decoder = JSONDecoder()
+
+_whitespace = re.compile(r"[ \t\n\r]*")
+
+_structural = re.compile(r'["\[\]{}]')
+
+
+def is_raw(data: Any) -> bool:
+    """
+    Determines if data is an undecoded JSON document rather than data that has already been decoded
+
+    Args:
+        data: The data
+
+    Returns:
+        True if the data is bytes, a str, a path, a file object or a response, otherwise False
+    """
+    return isinstance(data, (bytes, bytearray, memoryview, str, os.PathLike)) or is_stream(data)
+
+
+def is_stream(data: Any) -> bool:
+    """
+    Determines if data is a JSON document that is read as it is parsed, and so can only be parsed once
+
+    Args:
+        data: The data
+
+    Returns:
+        True if the data is a file object or a streamed response, otherwise False
+    """
+    return hasattr(data, "read") or hasattr(data, "iter_content")
+
+
+def _chunks(source: Any, chunk_size: int) -> Iterator[str]:
+    """
+    Reads a JSON document a chunk at a time, decoding bytes as UTF-8
+
+    Args:
+        source: The document
+        chunk_size: The number of bytes read at a time
+
+    Returns:
+        A generator yielding the chunks of the document as strings
+    """
+    if isinstance(source, (bytes, bytearray, memoryview, str)):
+        chunks = [source]
+    elif hasattr(source, "iter_content"):
+        chunks = source.iter_content(chunk_size=chunk_size)
+    elif hasattr(source, "read"):
+        chunks = iter(lambda: source.read(chunk_size), source.read(0))
+    else:
+        chunks = source
+    decoder = codecs.getincrementaldecoder("utf-8")()
+    for chunk in chunks:
+        yield chunk if isinstance(chunk, str) else decoder.decode(bytes(chunk))
+    yield decoder.decode(b"", final=True)
+
+
+class _Reader(object):
+    """A buffer over the chunks of a JSON document, refilled as the document is parsed"""
+
+    def __init__(self, chunks: Iterator[str]):
+        self.chunks = chunks
+        self.buf = ""
+        self.pos = 0
+        self.eof = False
+
+    def fill(self) -> bool:
+        """Discards the consumed part of the buffer and appends the next chunk, returning False at the end"""
+        if self.eof:
+            return False
+        self.buf = self.buf[self.pos:]
+        self.pos = 0
+        for chunk in self.chunks:
+            if chunk:
+                self.buf += chunk
+                return True
+        self.eof = True
+        return False
+
+    def peek(self) -> str:
+        """Skips whitespace and returns the next character without consuming it, or "" at the end"""
+        while True:
+            self.pos = _whitespace.match(self.buf, self.pos).end()
+            if self.pos < len(self.buf):
+                return self.buf[self.pos]
+            if not self.fill():
+                return ""
+
+    def expect(self, chars: str) -> str:
+        """Consumes the next character, which must be one of ``chars``"""
+        c = self.peek()
+        if c == "" or c not in chars:
+            raise JSONDecodeError(f"Expecting one of {chars!r}", self.buf, self.pos)
+        self.pos += 1
+        return c
+
+    def string(self) -> str:
+        """Decodes the string starting at the next character"""
+        self.expect('"')
+        while True:
+            try:
+                s, self.pos = scanstring(self.buf, self.pos)
+                return s
+            except JSONDecodeError:
+                if not self.fill():
+                    raise
+
+    def value(self) -> Any:
+        """Decodes the value starting at the next character"""
+        self.peek()
+        while True:
+            try:
+                obj, end = _decoder.raw_decode(self.buf, self.pos)
+                # A number at the end of the buffer may continue in the next chunk
+                if end < len(self.buf) or self.eof:
+                    self.pos = end
+                    return obj
+            except JSONDecodeError:
+                if self.eof:
+                    raise
+            self.fill()
+
+    def skip(self) -> None:
+        """Skips the value starting at the next character without decoding it"""
+        c = self.peek()
+        if c not in "[{":
+            self.value()
+            return
+        self.pos += 1
+        depth = 1
+        while depth > 0:
+            m = _structural.search(self.buf, self.pos)
+            if m is None:
+                self.pos = len(self.buf)
+                if not self.fill():
+                    raise JSONDecodeError("Unterminated value", self.buf, self.pos)
+                continue
+            self.pos = m.start()
+            c = m.group()
+            if c == '"':
+                self.string()
+                continue
+            self.pos += 1
+            depth += 1 if c in "[{" else -1
+
+
+def iter_json_items(source: Any,
+                    path: str="",
+                    chunk_size: int=CHUNK_SIZE) -> Iterator[Any]:
+    """
+    Incrementally parses the items of an array within a JSON document
+
+    Args:
+        source: The JSON document
+        path: The object keys leading to the array, separated by ``.``
+        chunk_size: The number of bytes read from the document at a time
+
+    Returns:
+        A generator yielding each item of the array as it is parsed
+
+    Raises:
+        KeyError if the path does not exist in the document, or json.JSONDecodeError if the document is invalid
+    """
+    reader = _Reader(_chunks(source, chunk_size))
+    for key in [k for k in path.split(".") if k != ""]:
+        reader.expect("{")
+        while True:
+            if reader.peek() == "}":
+                raise KeyError(path)
+            k = reader.string()
+            reader.expect(":")
+            if k == key:
+                break
+            reader.skip()
+            if reader.expect(",}") == "}":
+                raise KeyError(path)
+    reader.expect("[")
+    if reader.peek() == "]":
+        return
+    while True:
+        yield reader.value()
+        if reader.expect(",]") == "]":
+            return
+
+
+def iter_json_batches(source: Any,
+                      path: str="",
+                      batch_size: int=1000,
+                      chunk_size: int=CHUNK_SIZE) -> Iterator[List[Any]]:
+    """
+    Incrementally parses the items of an array within a JSON document, grouping them into batches
+
+    Args:
+        source: The JSON document
+        path: The object keys leading to the array, separated by ``.``
+        batch_size: The maximum number of items in each batch
+        chunk_size: The number of bytes read from the document at a time
+
+    Returns:
+        A generator yielding lists of at most ``batch_size`` items
+    """
+    batch = []
+    for item in iter_json_items(source, path=path, chunk_size=chunk_size):
+        batch.append(item)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if len(batch) != 0:
+        yield batch
@@ -8,6 +8,7 @@
 | Revisions       | None         |
 +-----------------+--------------+
 """
+from .change_capture import ChangeCapture
 from .column_add import ColumnAdd
 from .column_apply import ColumnApply
 from .columns_calculate import ColumnsCalculate
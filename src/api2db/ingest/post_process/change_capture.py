@@ -0,0 +1,166 @@
+# -*- coding: utf-8 -*-
+"""
+Contains the ChangeCapture class
+================================
+
+Summary of ChangeCapture Usage:
+-------------------------------
+
+Many APIs return the full current state of every entity on every request. ChangeCapture remembers a hash of the
+values last seen for each entity, and only passes on rows for entities that are new or whose values have changed.
+
+**First request** ``df``
+
+==  =====  ======
+id  price  status
+==  =====  ======
+ 1   10.0  open
+ 2   20.0  open
+==  =====  ======
+
+**Second request** ``df``
+
+==  =====  ======
+id  price  status
+==  =====  ======
+ 1   10.0  open
+ 2   25.0  open
+ 3   30.0  open
+==  =====  ======
+
+::
+
+    post = ChangeCapture(keys=["id"], path="CACHE/my_collector_cdc.sqlite", op_key="op")
+
+**Second request after ChangeCapture** ``df``
+
+==  =====  ======  ======
+id  price  status  op
+==  =====  ======  ======
+ 2   25.0  open    update
+ 3   30.0  open    insert
+==  =====  ======  ======
+
+NOTE:
+
+    The values last seen for each entity are stored in the SQLite file at ``path``, so they survive restarts of the
+    collector. They are only written once the DataFrame has been handed to the streams, so a batch that is lost before
+    reaching the streams is captured again on the next request.
+
+    ChangeCapture should be the last post-processor, so that the values it compares are the values that are stored.
+"""
+from .post import Post
+from ...stream.hash_set import hash_rows
+import numpy as np
+import pandas as pd
+import sqlite3
+import os
+from typing import List, Optional
+
+
+class ChangeCapture(Post):
+    """Used to pass on only the rows of entities that are new or have changed since they were last seen"""
+
+    def __init__(self,
+                 keys: List[str],
+                 path: str,
+                 op_key: Optional[str]=None,
+                 exclude: Optional[List[str]]=None):
+        """
+        Creates a ChangeCapture object
+
+        Args:
+            keys: The columns that identify an entity
+            path: The path to the SQLite file the values last seen for each entity are stored in.
+                  I.e. ``path="CACHE/my_collector_cdc.sqlite"``
+            op_key: When set, a column with this name is added to the DataFrame containing ``"insert"`` for new
+                    entities and ``"update"`` for changed entities
+            exclude: Columns ignored when determining whether an entity has changed. Primarily used for arrival
+                     timestamps, which change on every request
+        """
+        self.ctype = "change_capture"
+        """str: type of data processor"""
+        self.keys = keys
+        self.path = path
+        self.op_key = op_key
+        self.exclude = [] if exclude is None else exclude
+        self.uncommitted = []
+        """list: (key hash, value hash) of the entities captured since the values were last committed"""
+
+    def connect(self) -> sqlite3.Connection:
+        """
+        Opens the SQLite file, creating it if it does not exist
+
+        Returns:
+            The connection to the SQLite file
+        """
+        dir_path = os.path.dirname(self.path)
+        if dir_path != "" and not os.path.isdir(dir_path):
+            os.makedirs(dir_path)
+        con = sqlite3.connect(self.path, timeout=30.0)
+        con.execute("PRAGMA journal_mode=WAL")
+        con.execute("CREATE TABLE IF NOT EXISTS last_seen (k INTEGER PRIMARY KEY, v INTEGER NOT NULL)")
+        return con
+
+    def lam_wrap(self, lam_arg: pd.DataFrame) -> pd.DataFrame:
+        """
+        Overrides super class method
+
+        Workflow:
+
+            1. Keep the last row for each entity in ``lam_arg``
+            2. Hash the ``keys`` of each row, and the values of each row excluding ``keys`` and ``exclude``
+            3. Look up the value hash last seen for each entity
+            4. Drop the rows of entities whose value hash has not changed
+            5. Add the ``op_key`` column if it is set
+            6. Return the modified DataFrame
+
+        Args:
+            lam_arg: The DataFrame to modify
+
+        Returns:
+            The modified DataFrame
+        """
+        lam_arg = lam_arg.drop_duplicates(subset=self.keys, keep="last")
+        values = [c for c in lam_arg.columns if c not in self.keys and c not in self.exclude]
+        key_hashes = hash_rows(lam_arg, subset=self.keys).view(np.int64)
+        if len(values) != 0:
+            value_hashes = hash_rows(lam_arg, subset=values).view(np.int64)
+        else:
+            value_hashes = np.zeros(len(lam_arg), dtype=np.int64)
+        last_seen = {}
+        con = self.connect()
+        try:
+            # SQLite limits the number of parameters in a single statement
+            for i in range(0, len(key_hashes), 500):
+                chunk = [int(h) for h in key_hashes[i:i + 500]]
+                query = f"SELECT k, v FROM last_seen WHERE k IN ({','.join('?' * len(chunk))})"
+                last_seen.update(con.execute(query, chunk).fetchall())
+        finally:
+            con.close()
+        previous = [last_seen.get(int(k)) for k in key_hashes]
+        changed = np.array([p is None or p != int(v) for p, v in zip(previous, value_hashes)], dtype=bool)
+        self.uncommitted.extend((int(k), int(v)) for k, v in zip(key_hashes[changed], value_hashes[changed]))
+        lam_arg = lam_arg[changed]
+        if self.op_key is not None:
+            ops = ["insert" if p is None else "update" for p, c in zip(previous, changed) if c]
+            lam_arg = lam_arg.assign(**{self.op_key: pd.Series(ops, index=lam_arg.index, dtype="string")})
+        return lam_arg
+
+    def commit(self) -> None:
+        """
+        Stores the values of the entities captured since the values were last committed. Called once the captured
+        rows have been handed to the streams
+
+        Returns:
+            None
+        """
+        if len(self.uncommitted) == 0:
+            return
+        con = self.connect()
+        try:
+            con.executemany("INSERT OR REPLACE INTO last_seen (k, v) VALUES (?, ?)", self.uncommitted)
+            con.commit()
+        finally:
+            con.close()
+        self.uncommitted = []
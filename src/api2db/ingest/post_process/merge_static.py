@@ -19,26 +19,37 @@ NOTE:
 
         3. Add a MergeStatic object to the frequently updating datas post-processors and set the path to the LocalStream
            storage path.
+
+    The locally stored file is loaded along with any deltas that have not yet been compacted into it, so updates made
+    by a LocalStream with mode set to `update` are visible as soon as they are written.
 """
 from .post import Post
-import pickle
+from ...stream.file_converter import FileConverter
+import os
 import pandas as pd
+from typing import Optional
 
 
 class MergeStatic(Post):
     """Merges incoming data with a locally stored DataFrame"""
-    def __init__(self, key: str, path: str):
+    def __init__(self, key: str, path: str, fmt: Optional[str]=None):
         """
         Creates a MergeStatic object
 
         Args:
             key: The key that the DataFrames should be merged on
-            path: The path to the locally stored file containing the pickled DataFrame to merge with
+            path: The path to the locally stored file containing the DataFrame to merge with
+            fmt: The format of the locally stored file. Defaults to the extension of ``path``, or pickle if the
+                 extension is not a known format
         """
         self.ctype = "merge_static"
         """str: type of data processor"""
         self.key = key
         self.path = path
+        if fmt is None:
+            fmt = os.path.splitext(path)[1][1:]
+            fmt = fmt if fmt in ("parquet", "json", "csv") else "pickle"
+        self.fmt = fmt
 
     def lam_wrap(self, lam_arg: pd.DataFrame) -> pd.DataFrame:
         """
@@ -46,7 +57,7 @@ class MergeStatic(Post):
 
         Workflow:
 
-            1. Load DataFrame ``df`` from file specified at ``self.path``
+            1. Load DataFrame ``df`` from file specified at ``self.path``, merging any pending deltas
             2. Use ``lam_arg`` to perform left-merge on ``self.key`` merging with ``df``
             3. Return the modified DataFrame
 
@@ -56,7 +67,8 @@ class MergeStatic(Post):
         Returns:
             The modified DataFrame
         """
-        with open(self.path, "rb") as f:
-            static = pickle.load(f)
+        static = FileConverter.static_load_df(path=self.path, fmt=self.fmt)
+        if static is None:
+            raise FileNotFoundError(self.path)
         lam_arg = lam_arg.merge(static, on=self.key, how="left")
         return lam_arg
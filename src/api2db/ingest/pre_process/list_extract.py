@@ -40,25 +40,65 @@ Example Usage of ListExtract:
         "name": "name_2"
     }
 ]
+
+Incremental Parsing with ListExtract:
+-------------------------------------
+
+When ``path`` is set, the list is located using a path of dictionary keys separated by ``.``
+
+::
+
+    pre = ListExtract(path="data_array")
+
+If the ``import_target`` returns the raw JSON document rather than a decoded dictionary, I.e. bytes, a file object or a
+``requests.Response`` requested with ``stream=True``, the items of the list are parsed incrementally from the document
+and passed to data-feature extraction in batches of at most ``batch_size`` items. Each batch becomes a separate
+DataFrame, so the fully decoded document never exists in memory.
+
+NOTE:
+
+    When parsing incrementally the ListExtract must be the first pre-processor, and GlobalExtract pre-processors
+    cannot be used since the rest of the document is never decoded.
 """
 from .pre import Pre
+from ..json_stream import iter_json_batches
 from ...app.log import get_logger
-from typing import Callable, Union, List
+from typing import Any, Callable, Iterator, Optional, Union, List
 
 
 class ListExtract(Pre):
     """Used to extract a list of dictionaries that will each represent a single row in a database"""
 
-    def __init__(self, lam: Callable[[dict], list]):
+    def __init__(self,
+                 lam: Optional[Callable[[dict], list]]=None,
+                 path: Optional[str]=None,
+                 batch_size: int=10000):
         """
         Creates a ListExtract object
 
         Args:
             lam: Anonymous function that attempts to extract a list of data that will become rows in a DataFrame
+            path: The dictionary keys leading to the list, separated by ``.``. Used instead of ``lam``, and allows the
+                  list to be parsed incrementally from a raw JSON document
+            batch_size: The maximum number of rows in each DataFrame when parsing incrementally
+
+        Raises:
+            ValueError if neither ``lam`` nor ``path`` is set
         """
+        if lam is None and path is None:
+            raise ValueError("ListExtract requires either lam or path")
         self.ctype = "list_extract"
         """str: type of data processor"""
+        if lam is None:
+            keys = [k for k in path.split(".") if k != ""]
+
+            def lam(x):
+                for k in keys:
+                    x = x[k]
+                return x
         self.lam = lam
+        self.path = path
+        self.batch_size = batch_size
         self.dtype = list
         """type(list): the datatype performing `lam` should yield"""
 
@@ -88,3 +128,15 @@ class ListExtract(Pre):
             logger.exception(e)
             res = None
         return res
+
+    def batches(self, raw: Any) -> Iterator[List[Any]]:
+        """
+        Incrementally parses the list from a raw JSON document
+
+        Args:
+            raw: The raw JSON document, either bytes, a str, a file object or a streamed ``requests.Response``
+
+        Returns:
+            A generator yielding lists of at most ``batch_size`` items that will become the rows of a DataFrame
+        """
+        return iter_json_batches(raw, path=self.path, batch_size=self.batch_size)
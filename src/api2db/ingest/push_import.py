@@ -0,0 +1,403 @@
+# -*- coding: utf-8 -*-
+"""
+Contains the PushImport class and the sse_events function
+==========================================================
+
+NOTE:
+
+    Collectors normally poll their API every ``seconds`` seconds. APIs that push their data over a long-lived
+    connection, I.e. Server-Sent Events or WebSockets, would have to be polled constantly and would still miss updates.
+    A PushImport holds the connection open instead, and micro-batches the incoming messages
+
+    .. code-block:: python3
+
+        # Server-Sent Events
+        import_target=PushImport("https://stream.example.com/trades", batch_size=500, batch_seconds=1.0)
+
+        # WebSockets, sending a subscription message each time the connection is established
+        import_target=PushImport("wss://ws.example.com/", subscribe=[{"type": "subscribe", "channel": "trades"}])
+
+    A batch is collected as soon as it holds ``batch_size`` messages, or ``batch_seconds`` after its first message
+    arrived, whichever comes first. Each batch is a list of the decoded messages, so the features of the ApiForm are
+    extracted from each message without a ListExtract.
+
+    Collectors with a PushImport as their ``import_target`` are not polled. The connection is opened when the collector
+    starts, and every ``seconds`` seconds the collector checks that its streams and its connection are still running.
+    Connections that fail or are closed by the server are re-established with exponential backoff, and Server-Sent
+    Events resume from the ``Last-Event-ID`` of the last event received. When the import is cancelled, I.e. because a
+    stream died, the messages that have already arrived are collected before the connection is closed, and once the
+    import is restarted Server-Sent Events resume from the last event collected.
+
+    WebSockets require the websocket-client library
+
+        > pip install websocket-client
+
+    The following metrics are recorded for each host
+
+        * push.**host**.connects -> The number of connections established
+        * push.**host**.reconnects -> The number of connections re-established after the previous connection was lost
+        * push.**host**.errors -> The number of connections that failed
+        * push.**host**.messages -> The number of messages received
+        * push.**host**.batch -> The time between the first message of a batch arriving and the batch being collected
+"""
+from ..app.log import get_logger
+from ..app.metrics import get_metrics
+from ..stream.retry import RetryPolicy
+from .import_runner import current_token
+from .http_import import http_get
+from .json_decode import loads
+from threading import Thread, Event
+from queue import Queue as ThreadQueue, Empty, Full
+from urllib.parse import urlencode, urlsplit
+import requests
+import json
+import time
+from typing import Any, Callable, Iterator, List, Optional, Union
+try:
+    import websocket
+except ModuleNotFoundError:
+    websocket = None
+
+CHUNK_SIZE = 65536
+"""int: The maximum number of bytes read from a Server-Sent Events connection at once"""
+
+
+def _lines(read: Callable[[], bytes]) -> Iterator[str]:
+    """
+    Splits a byte stream into lines as the bytes arrive, on CRLF, LF or CR
+
+    Args:
+        read: Returns the next bytes of the stream, or an empty bytes object once the stream has ended
+
+    Returns:
+        A generator yielding each line without its line ending
+    """
+    buf = b""
+    while True:
+        chunk = read()
+        if not chunk:
+            break
+        buf += chunk
+        while True:
+            ends = [i for i in (buf.find(b"\r"), buf.find(b"\n")) if i != -1]
+            if len(ends) == 0:
+                break
+            i = min(ends)
+            # A CR at the end of the buffer may be followed by a LF that has not arrived yet
+            if buf[i:i + 1] == b"\r" and i == len(buf) - 1:
+                break
+            yield buf[:i].decode("utf-8", errors="replace")
+            buf = buf[i + 2:] if buf[i:i + 2] == b"\r\n" else buf[i + 1:]
+    if buf.endswith(b"\r"):
+        yield buf[:-1].decode("utf-8", errors="replace")
+
+
+def sse_events(response: requests.Response) -> Iterator[dict]:
+    """
+    Parses the events of a Server-Sent Events response as they arrive
+
+    Args:
+        response: The response, requested with ``stream=True``
+
+    Returns:
+        A generator yielding a dictionary with the keys ``event``, ``id`` and ``data`` for each event
+    """
+    raw = response.raw
+    if hasattr(raw, "read1"):
+        # Returns whatever has arrived, rather than waiting for a full chunk
+        lines = _lines(lambda: raw.read1(CHUNK_SIZE))
+    else:
+        chunks = response.iter_content(chunk_size=None)
+        lines = _lines(lambda: next(chunks, b""))
+    event, event_id, data = "message", None, []
+    for line in lines:
+        if line == "":
+            # A blank line dispatches the event
+            if len(data) != 0:
+                yield {"event": event, "id": event_id, "data": "\n".join(data)}
+            event, data = "message", []
+            continue
+        # Lines starting with a colon are comments, which servers send as heartbeats
+        if line.startswith(":"):
+            continue
+        field, _, value = line.partition(":")
+        value = value[1:] if value.startswith(" ") else value
+        if field == "data":
+            data.append(value)
+        elif field == "event":
+            event = value
+        elif field == "id" and "\0" not in value:
+            event_id = value
+
+
+class PushImport(object):
+    """An import target that holds a Server-Sent Events or WebSocket connection open and micro-batches its messages"""
+
+    continuous = True
+    """bool: Marks the import target as holding a connection open, so that its collector is not polled"""
+
+    def __init__(self,
+                 url: str,
+                 protocol: Optional[str]=None,
+                 params: Optional[dict]=None,
+                 headers: Optional[dict]=None,
+                 subscribe: Optional[List[Union[str, dict]]]=None,
+                 events: Optional[List[str]]=None,
+                 batch_size: int=100,
+                 batch_seconds: float=1.0,
+                 raw: bool=False,
+                 idle_timeout: float=60.0,
+                 retry_policy: Optional[RetryPolicy]=None,
+                 max_queued: int=10000):
+        """
+        Creates a PushImport object
+
+        Args:
+            url: The URL to connect to
+            protocol: Either "sse" or "websocket", defaults to "websocket" for ws:// and wss:// URLs and "sse" otherwise
+            params: The query parameters of the connection
+            headers: Additional headers to send when connecting
+            subscribe: Messages sent over a WebSocket each time the connection is established. Dictionaries are sent
+                       as JSON
+            events: The types of Server-Sent Events to collect, or None to collect every event
+            batch_size: The number of messages after which a batch is collected
+            batch_seconds: The number of seconds after the first message of a batch arrived that the batch is collected
+            raw: When True messages are collected as received, otherwise they are decoded as JSON
+            idle_timeout: The number of seconds without receiving anything after which the connection is considered
+                          dead and re-established
+            retry_policy: Computes the delay before reconnecting, defaults to a delay growing from 1 to 60 seconds
+            max_queued: The number of messages held while waiting to be collected, after which the connection is not
+                        read from until the messages have been collected
+
+        Raises:
+            ValueError if the protocol is not supported, or ModuleNotFoundError if websocket-client is not installed
+        """
+        if protocol is None:
+            protocol = "websocket" if urlsplit(url).scheme in ("ws", "wss") else "sse"
+        if protocol not in ("sse", "websocket"):
+            raise ValueError(f"unsupported push protocol: {protocol}")
+        if protocol == "websocket" and websocket is None:
+            raise ModuleNotFoundError("WebSockets have additional dependencies\n"
+                                      "Run the following:\n"
+                                      "pip install websocket-client --upgrade\n")
+        self.url = url
+        self.protocol = protocol
+        self.params = params
+        self.headers = headers
+        self.subscribe = subscribe
+        self.events = events
+        self.batch_size = batch_size
+        self.batch_seconds = batch_seconds
+        self.raw = raw
+        self.idle_timeout = idle_timeout
+        self.retry_policy = RetryPolicy(base=1.0, cap=60.0) if retry_policy is None else retry_policy
+        self.max_queued = max_queued
+        self.last_id = None
+        """Optional[str]: The id of the last Server-Sent Event collected, sent as ``Last-Event-ID`` when connecting"""
+
+    def __call__(self) -> Iterator[List[Any]]:
+        """
+        Opens the connection
+
+        Returns:
+            A generator yielding each batch of messages, which runs until the import is cancelled
+        """
+        return self.batches()
+
+    def batches(self) -> Iterator[List[Any]]:
+        """
+        Reads messages from the connection in a separate thread, and groups them into batches
+
+        Returns:
+            A generator yielding each batch of messages, which runs until the CancelToken of the import running in
+            the current thread is cancelled. The messages that have arrived when the import is cancelled are yielded
+            before the generator returns
+        """
+        metrics = get_metrics()
+        host = urlsplit(self.url).netloc
+        token = current_token()
+        q = ThreadQueue(maxsize=self.max_queued)
+        stop = Event()
+        conn = []
+        Thread(target=self.read, args=(q, stop, conn), daemon=True).start()
+        # Each message is held with the id of the event it arrived in
+        batch = []
+        first = None
+        try:
+            while token is None or not token.cancelled:
+                # Wake up at least once a second to check whether the import has been cancelled
+                wait = 1.0 if first is None else max(0.0, min(1.0, first + self.batch_seconds - time.time()))
+                try:
+                    batch.append(q.get(timeout=wait))
+                    first = time.time() if first is None else first
+                except Empty:
+                    pass
+                if first is not None and (len(batch) >= self.batch_size or time.time() >= first + self.batch_seconds):
+                    metrics.timing(f"push.{host}.batch", time.time() - first)
+                    data, batch, first = batch, [], None
+                    yield [message for _, message in data]
+                    self.collected(data)
+            # Stop reading, and collect the messages that have already arrived rather than discarding them
+            self.disconnect(stop, conn)
+            while True:
+                try:
+                    batch.append(q.get_nowait())
+                except Empty:
+                    break
+            for i in range(0, len(batch), self.batch_size):
+                data = batch[i:i + self.batch_size]
+                yield [message for _, message in data]
+                self.collected(data)
+        finally:
+            self.disconnect(stop, conn)
+
+    def collected(self, data: List[tuple]) -> None:
+        """
+        Records the id of the last event of a batch once the batch has been collected
+
+        Args:
+            data: The batch, a list of ``(event_id, message)`` tuples
+
+        Returns:
+            None
+        """
+        if data[-1][0] is not None:
+            self.last_id = data[-1][0]
+
+    @staticmethod
+    def disconnect(stop: Event, conn: list) -> None:
+        """
+        Stops the thread reading messages, and closes its connection
+
+        Args:
+            stop: Set once the messages are no longer being collected
+            conn: Holds the open connection
+
+        Returns:
+            None
+        """
+        stop.set()
+        # Unblock the reading thread
+        for c in conn:
+            try:
+                c.close()
+            except Exception:
+                pass
+
+    def read(self, q: ThreadQueue, stop: Event, conn: list) -> None:
+        """
+        The target of the thread reading messages from the connection, which re-establishes the connection with
+        exponential backoff whenever it is lost
+
+        Args:
+            q: The queue the decoded messages are placed in, each with the id of the event it arrived in
+            stop: Set once the messages are no longer being collected
+            conn: Holds the open connection, so that it can be closed from another thread
+
+        Returns:
+            None
+        """
+        logger = get_logger()
+        metrics = get_metrics()
+        host = urlsplit(self.url).netloc
+        # The first connection resumes from the last event collected. Messages received since then are still queued,
+        # so reconnections resume from the last event received
+        last_id = [self.last_id]
+        attempt = 0
+        connected = False
+        while not stop.is_set():
+            try:
+                messages = self.sse(conn, last_id) if self.protocol == "sse" else self.websocket(stop, conn)
+                for message in messages:
+                    # The connection yields None once it has been established
+                    if message is None:
+                        attempt = 0
+                        metrics.incr(f"push.{host}.connects")
+                        if connected:
+                            metrics.incr(f"push.{host}.reconnects")
+                        connected = True
+                        continue
+                    metrics.incr(f"push.{host}.messages")
+                    if not self.raw:
+                        try:
+                            message = loads(message)
+                        except ValueError:
+                            logger.warning(f"push message from {host} is not valid JSON: {message[:100]}")
+                            continue
+                    while not stop.is_set():
+                        try:
+                            q.put((last_id[0], message), timeout=1.0)
+                            break
+                        except Full:
+                            pass
+                    if stop.is_set():
+                        break
+            except Exception as e:
+                if not stop.is_set():
+                    metrics.incr(f"push.{host}.errors")
+                    logger.warning(f"push connection to {host} failed: {e}")
+            if stop.is_set():
+                break
+            attempt += 1
+            delay = self.retry_policy.delay(attempt)
+            logger.warning(f"push connection to {host} lost, reconnecting in {delay:.1f} seconds")
+            stop.wait(delay)
+
+    def sse(self, conn: list, last_id: list) -> Iterator[Optional[str]]:
+        """
+        Opens a Server-Sent Events connection
+
+        Args:
+            conn: Holds the open connection, so that it can be closed from another thread
+            last_id: Holds the id of the last event received, sent as ``Last-Event-ID`` when reconnecting
+
+        Returns:
+            A generator yielding None once the connection is established, then the data of each event
+        """
+        headers = {"Accept": "text/event-stream", "Accept-Encoding": "identity", "Cache-Control": "no-cache"}
+        headers.update(self.headers or {})
+        if last_id[0] is not None:
+            headers["Last-Event-ID"] = last_id[0]
+        response = http_get(self.url, params=self.params, headers=headers, timeout=(5.0, self.idle_timeout),
+                            conditional=False, stream=True)
+        conn[:] = [response]
+        try:
+            yield None
+            for event in sse_events(response):
+                if event["id"] is not None:
+                    last_id[0] = event["id"]
+                if self.events is None or event["event"] in self.events:
+                    yield event["data"]
+        finally:
+            response.close()
+
+    def websocket(self, stop: Event, conn: list) -> Iterator[Optional[Union[str, bytes]]]:
+        """
+        Opens a WebSocket connection, and sends the subscription messages
+
+        Args:
+            stop: Set once the messages are no longer being collected
+            conn: Holds the open connection, so that it can be closed from another thread
+
+        Returns:
+            A generator yielding None once the connection is established, then each message
+        """
+        url = self.url
+        if self.params:
+            url = f"{url}{'&' if '?' in url else '?'}{urlencode(self.params, doseq=True)}"
+        ws = websocket.create_connection(url,
+                                         header=[f"{k}: {v}" for k, v in (self.headers or {}).items()],
+                                         timeout=self.idle_timeout)
+        conn[:] = [ws]
+        try:
+            for message in self.subscribe or []:
+                ws.send(message if isinstance(message, str) else json.dumps(message))
+            yield None
+            while not stop.is_set():
+                message = ws.recv()
+                # An empty message means the server closed the connection
+                if message in ("", b""):
+                    return
+                yield message
+        finally:
+            ws.close()
@@ -0,0 +1,184 @@
+# -*- coding: utf-8 -*-
+"""
+Contains the RateLimiter class
+==============================
+
+NOTE:
+
+    Collectors run in separate processes, so collectors requesting data from the same API each schedule their requests
+    without knowing about the others, and together may exceed the rate limit of the API. A RateLimiter is a token
+    bucket shared by every collector process, stored in the SQLite file
+
+        CACHE/rate_limits.sqlite
+
+    Every RateLimiter with the same ``key`` draws from the same bucket, no matter which process it is in. The bucket
+    holds at most ``burst`` tokens and is refilled at ``rate`` tokens per second. Each request takes a token, waiting
+    for the bucket to refill when it is empty. The ``key`` is usually the host of the API, or the name of a quota that
+    is shared by several hosts.
+
+    .. code-block:: python3
+
+        coincap_limit = RateLimiter("api.coincap.io", rate=2.0, burst=5)
+
+        # Every request made by the import target takes a token
+        import_target=HttpImport("https://api.coincap.io/v2/assets/", rate_limit=coincap_limit)
+
+        # Or every call of the import target takes a token
+        Collector(..., rate_limit=coincap_limit)
+
+    Import targets that make several requests per call can call ``acquire`` before each request.
+
+    The time spent waiting for tokens is recorded in the metrics of the collector as rate_limit.**key**.wait
+"""
+from .import_runner import current_token
+from ..app.metrics import get_metrics
+from threading import Lock as ThreadLock
+import functools
+import sqlite3
+import os
+import time
+from typing import Any, Callable, Optional
+
+_connections = {}
+"""dict: Maps the pid of each process and the path of each rate limit file to its connection and lock"""
+
+
+class RateLimiter(object):
+    """A token bucket shared by every collector process"""
+
+    def __init__(self,
+                 key: str,
+                 rate: float,
+                 burst: Optional[float]=None,
+                 path: Optional[str]=None):
+        """
+        Creates a RateLimiter object. The rate limit file is opened lazily upon first use
+
+        Args:
+            key: The name of the bucket, I.e. the host of an API or the name of a quota group
+            rate: The number of tokens added to the bucket per second
+            burst: The maximum number of tokens in the bucket, defaults to ``rate`` or 1, whichever is larger
+            path: The path to the rate limit file, defaults to CACHE/rate_limits.sqlite
+        """
+        self.key = key
+        self.rate = rate
+        self.burst = max(1.0, rate) if burst is None else burst
+        self.path = os.path.join("CACHE", "rate_limits.sqlite") if path is None else path
+
+    def connect(self) -> tuple:
+        """
+        Opens the rate limit file for the current process, creating it if it does not exist
+
+        Returns:
+            The connection to the rate limit file, and the lock guarding it
+        """
+        k = (os.getpid(), self.path)
+        if k not in _connections:
+            dir_path = os.path.dirname(self.path)
+            if dir_path != "" and not os.path.isdir(dir_path):
+                os.makedirs(dir_path, exist_ok=True)
+            # Transactions are managed explicitly, so that reading and updating a bucket is atomic across processes
+            con = sqlite3.connect(self.path, timeout=30.0, check_same_thread=False, isolation_level=None)
+            con.execute("PRAGMA journal_mode=WAL")
+            con.execute("CREATE TABLE IF NOT EXISTS buckets (key TEXT PRIMARY KEY, tokens REAL, updated REAL)")
+            _connections.setdefault(k, (con, ThreadLock()))
+        return _connections[k]
+
+    def take(self, tokens: float) -> float:
+        """
+        Attempts to take tokens from the bucket
+
+        Args:
+            tokens: The number of tokens to take
+
+        Returns:
+            0.0 if the tokens were taken, otherwise the number of seconds until enough tokens will be available
+
+        Raises:
+            ValueError if more tokens are requested than the bucket can hold
+        """
+        if tokens > self.burst:
+            raise ValueError(f"cannot take {tokens} tokens from rate limit {self.key}, "
+                             f"which holds at most {self.burst}")
+        con, lock = self.connect()
+        with lock:
+            con.execute("BEGIN IMMEDIATE")
+            try:
+                now = time.time()
+                row = con.execute("SELECT tokens, updated FROM buckets WHERE key = ?", (self.key, )).fetchone()
+                available = self.burst if row is None else min(self.burst, row[0] + (now - row[1]) * self.rate)
+                wait = 0.0
+                if available >= tokens:
+                    available -= tokens
+                else:
+                    wait = (tokens - available) / self.rate
+                con.execute("INSERT OR REPLACE INTO buckets (key, tokens, updated) VALUES (?, ?, ?)",
+                            (self.key, available, now))
+                con.execute("COMMIT")
+            except Exception:
+                con.execute("ROLLBACK")
+                raise
+        return wait
+
+    def acquire(self, tokens: float=1.0, timeout: Optional[float]=None) -> bool:
+        """
+        Takes tokens from the bucket, waiting until enough tokens are available
+
+        Args:
+            tokens: The number of tokens to take
+            timeout: The maximum number of seconds to wait, or None to wait as long as necessary
+
+        Returns:
+            True if the tokens were taken, False if they could not be taken within the timeout
+
+        Raises:
+            ValueError if more tokens are requested than the bucket can hold, since they could never be taken
+        """
+        start = time.time()
+        try:
+            while True:
+                wait = self.take(tokens)
+                if wait == 0.0:
+                    return True
+                if timeout is not None:
+                    remaining = start + timeout - time.time()
+                    if remaining <= 0:
+                        return False
+                    wait = min(wait, remaining)
+                time.sleep(wait)
+        finally:
+            get_metrics().timing(f"rate_limit.{self.key}.wait", time.time() - start)
+
+    def acquire_or_raise(self, tokens: float=1.0) -> None:
+        """
+        Takes tokens from the bucket, waiting no longer than the deadline of the import running in the current thread
+
+        Args:
+            tokens: The number of tokens to take
+
+        Returns:
+            None
+
+        Raises:
+            TimeoutError if the tokens could not be taken before the deadline, or ValueError if more tokens are
+            requested than the bucket can hold
+        """
+        token = current_token()
+        if not self.acquire(tokens, timeout=None if token is None else token.remaining()):
+            raise TimeoutError(f"rate limit {self.key} not acquired before the deadline")
+
+    def wrap(self, import_target: Callable[[], Any]) -> Callable[[], Any]:
+        """
+        Wraps an import target so that each call takes a token from the bucket first
+
+        Args:
+            import_target: The import target to wrap
+
+        Returns:
+            The wrapped import target
+        """
+        @functools.wraps(import_target)
+        def limited():
+            self.acquire_or_raise()
+            return import_target()
+        return limited
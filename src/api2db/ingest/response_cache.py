@@ -0,0 +1,225 @@
+# -*- coding: utf-8 -*-
+"""
+Contains the ResponseCache class
+================================
+
+NOTE:
+
+    Collectors that request the same endpoint with the same parameters, and differ only in their ApiForm, would each
+    make the same request from their own process. A ResponseCache stores the body of each response in the SQLite file
+
+        CACHE/responses.sqlite
+
+    which is shared by every collector process. A response is served from the cache for ``ttl`` seconds after it was
+    requested. Once the cache holds more than ``max_bytes`` of responses, the least recently used responses are evicted.
+
+    Identical requests are coalesced. The first collector to request a response that is missing from the cache takes a
+    lease on it and makes the request, while every other collector requesting the same response waits for the lease to
+    be released and is then served from the cache. A single request is made no matter how many collectors need the
+    response. A lease held by a collector that crashed expires after ``lease_seconds``.
+
+    .. code-block:: python3
+
+        import_target=HttpImport("https://api.coincap.io/v2/assets/", cache=ResponseCache(ttl=30))
+
+    The following metrics are recorded
+
+        * response_cache.hits -> The number of responses served from the cache
+        * response_cache.misses -> The number of responses requested
+        * response_cache.coalesced -> The number of responses served from the cache after waiting for another request
+        * response_cache.evicted -> The number of responses evicted to keep the cache within ``max_bytes``
+"""
+from ..app.metrics import get_metrics
+from threading import Lock as ThreadLock, get_ident
+import hashlib
+import sqlite3
+import os
+import time
+from typing import Callable, Optional, Union
+
+_connections = {}
+"""dict: Maps the pid of each process and the path of each response cache file to its connection and lock"""
+
+
+class ResponseCache(object):
+    """A response cache shared by every collector process, with TTL expiry, LRU eviction and request coalescing"""
+
+    def __init__(self,
+                 ttl: float=30.0,
+                 max_bytes: int=256 * 1024 * 1024,
+                 lease_seconds: float=60.0,
+                 path: Optional[str]=None):
+        """
+        Creates a ResponseCache object. The response cache file is opened lazily upon first use
+
+        Args:
+            ttl: The number of seconds a response is served from the cache
+            max_bytes: The maximum total size of the responses in the cache
+            lease_seconds: The number of seconds after which a lease held by a request that never finished expires
+            path: The path to the response cache file, defaults to CACHE/responses.sqlite
+        """
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.lease_seconds = lease_seconds
+        self.path = os.path.join("CACHE", "responses.sqlite") if path is None else path
+
+    @staticmethod
+    def key(*parts: Union[str, bytes]) -> str:
+        """
+        Computes the cache key of a request
+
+        Args:
+            *parts: The parts identifying the request, I.e. its method, URL, parameters and headers
+
+        Returns:
+            The cache key
+        """
+        h = hashlib.sha1()
+        for part in parts:
+            h.update(part if isinstance(part, bytes) else str(part).encode("utf-8"))
+            h.update(b"\0")
+        return h.hexdigest()
+
+    def connect(self) -> tuple:
+        """
+        Opens the response cache file for the current process, creating it if it does not exist
+
+        Returns:
+            The connection to the response cache file, and the lock guarding it
+        """
+        k = (os.getpid(), self.path)
+        if k not in _connections:
+            dir_path = os.path.dirname(self.path)
+            if dir_path != "" and not os.path.isdir(dir_path):
+                os.makedirs(dir_path, exist_ok=True)
+            # Transactions are managed explicitly, so that leases are taken atomically across processes
+            con = sqlite3.connect(self.path, timeout=30.0, check_same_thread=False, isolation_level=None)
+            con.execute("PRAGMA journal_mode=WAL")
+            con.execute("PRAGMA synchronous=NORMAL")
+            con.execute("CREATE TABLE IF NOT EXISTS responses ("
+                        "key TEXT PRIMARY KEY, "
+                        "body BLOB, "
+                        "size INTEGER NOT NULL DEFAULT 0, "
+                        "expires REAL NOT NULL DEFAULT 0, "
+                        "accessed REAL NOT NULL DEFAULT 0, "
+                        "lease TEXT, "
+                        "lease_until REAL NOT NULL DEFAULT 0)")
+            con.execute("CREATE INDEX IF NOT EXISTS ix_responses_accessed ON responses (accessed)")
+            _connections.setdefault(k, (con, ThreadLock()))
+        return _connections[k]
+
+    def lookup(self, key: str, owner: str) -> tuple:
+        """
+        Looks up a response, taking a lease on it if it is missing and no other request holds a lease on it
+
+        Args:
+            key: The cache key of the request
+            owner: Identifies the request taking the lease
+
+        Returns:
+            (body, leased) where body is the cached response or None, and leased is True if the lease was taken
+        """
+        con, lock = self.connect()
+        with lock:
+            con.execute("BEGIN IMMEDIATE")
+            try:
+                now = time.time()
+                row = con.execute("SELECT body, expires, lease, lease_until FROM responses WHERE key = ?",
+                                  (key, )).fetchone()
+                if row is not None and row[0] is not None and row[1] > now:
+                    con.execute("UPDATE responses SET accessed = ? WHERE key = ?", (now, key))
+                    con.execute("COMMIT")
+                    return row[0], False
+                if row is not None and row[2] is not None and row[3] > now:
+                    con.execute("COMMIT")
+                    return None, False
+                con.execute("INSERT OR IGNORE INTO responses (key) VALUES (?)", (key, ))
+                con.execute("UPDATE responses SET lease = ?, lease_until = ? WHERE key = ?",
+                            (owner, now + self.lease_seconds, key))
+                con.execute("COMMIT")
+                return None, True
+            except Exception:
+                con.execute("ROLLBACK")
+                raise
+
+    def store(self, key: str, owner: str, body: Optional[bytes]) -> None:
+        """
+        Stores a response and releases the lease on it, evicting the least recently used responses if the cache has
+        grown larger than ``max_bytes``
+
+        Args:
+            key: The cache key of the request
+            owner: Identifies the request holding the lease
+            body: The response, or None to release the lease without storing a response
+
+        Returns:
+            None
+        """
+        con, lock = self.connect()
+        evicted = 0
+        with lock:
+            con.execute("BEGIN IMMEDIATE")
+            try:
+                now = time.time()
+                if body is None:
+                    con.execute("UPDATE responses SET lease = NULL, lease_until = 0 WHERE key = ? AND lease = ?",
+                                (key, owner))
+                else:
+                    con.execute("INSERT OR REPLACE INTO responses (key, body, size, expires, accessed) "
+                                "VALUES (?, ?, ?, ?, ?)",
+                                (key, sqlite3.Binary(body), len(body), now + self.ttl, now))
+                    con.execute("DELETE FROM responses WHERE expires <= ? AND lease_until <= ?", (now, now))
+                    total = con.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+                    if total > self.max_bytes:
+                        for k, size in con.execute("SELECT key, size FROM responses WHERE key != ? AND size > 0 "
+                                                   "ORDER BY accessed", (key, )).fetchall():
+                            if total <= self.max_bytes:
+                                break
+                            con.execute("DELETE FROM responses WHERE key = ?", (k, ))
+                            total -= size
+                            evicted += 1
+                con.execute("COMMIT")
+            except Exception:
+                con.execute("ROLLBACK")
+                raise
+        if evicted != 0:
+            get_metrics().incr("response_cache.evicted", evicted)
+
+    def get_or_fetch(self,
+                     key: str,
+                     fetch: Callable[[], Optional[bytes]],
+                     timeout: Optional[float]=None,
+                     poll: float=0.05) -> Optional[bytes]:
+        """
+        Retrieves a response from the cache, or fetches and caches it if it is missing. When another request holds
+        the lease on the response, waits for that request to finish instead of fetching the response again
+
+        Args:
+            key: The cache key of the request
+            fetch: Makes the request and returns the body of the response, or None if there is no response to cache
+            timeout: The maximum number of seconds to wait for another request, after which the response is fetched
+            poll: The number of seconds between checks of a lease held by another request
+
+        Returns:
+            The body of the response, or None if ``fetch`` returned None
+        """
+        metrics = get_metrics()
+        owner = f"{os.getpid()}.{get_ident()}"
+        start = time.time()
+        waited = False
+        while True:
+            body, leased = self.lookup(key, owner)
+            if body is not None:
+                metrics.incr("response_cache.coalesced" if waited else "response_cache.hits")
+                return bytes(body)
+            if leased or (timeout is not None and time.time() - start >= timeout):
+                break
+            waited = True
+            time.sleep(poll)
+        metrics.incr("response_cache.misses")
+        body = None
+        try:
+            body = fetch()
+        finally:
+            self.store(key, owner, body)
+        return body
@@ -4,8 +4,13 @@ Contains the Store class
 ==================================
 """
 from ..stream.stream import Stream
+from ..stream.partitions import PartitionIndex
+from ..stream.hash_set import HashSet, hash_rows
+from ..stream.manifest import ShardManifest
 from ..app.log import get_logger
 import os
+import time
+import pandas as pd
 from typing import Optional, List
 
 
@@ -20,7 +25,10 @@ class Store(Stream):
                  drop_duplicate_exclude: Optional[List[str]]=None,
                  move_shards_path: Optional[str]=None,
                  move_composed_path: Optional[str]=None,
-                 chunk_size: int=0
+                 chunk_size: int=0,
+                 max_memory_hashes: int=1000000,
+                 manifest: bool=False,
+                 reconcile_seconds: int=300
                  ):
         """
         Creates a Store object and attempts to build its dtypes.
@@ -28,7 +36,11 @@ class Store(Stream):
         Args:
             name: The name of the collector the store is associated with
             seconds: The number of seconds between storage cycles
-            path: The path to the directory that will contain sharded files that should be recomposed for storage
+            path: The path to the directory that will contain sharded files that should be recomposed for storage.
+                  If the directory is partitioned, I.e. by a Stream2Local with `partition_by` set, each partition
+                  containing files is composed and stored separately, and only partitions that have changed since the
+                  previous storage cycle are listed. Shards are moved to the same partition within
+                  ``move_shards_path`` and ``move_composed_path``
             fmt: The file format of the sharded files
 
                 * `fmt="parquet"` (recommended) stores the DataFrame using parquet format
@@ -58,7 +70,27 @@ class Store(Stream):
             move_composed_path: :py:meth:`Documentation and Examples found here
                                 <api2db.stream.file_converter.FileConverter.static_compose_df_from_dir>`
 
-            chunk_size: CURRENTLY NOT SUPPORTED
+            chunk_size:
+
+                * `chunk_size=0` (default)
+
+                  The files in the path are composed into a single DataFrame that is deduplicated and stored at once
+
+                * `chunk_size=100000`
+
+                  The files are read in batches of at most chunk_size rows and stored in chunks of chunk_size rows.
+                  Rows are deduplicated across chunks by their hashes, which are spilled to disk once
+                  ``max_memory_hashes`` hashes are held, so peak memory stays bounded no matter how much data is
+                  waiting to be stored. When ``move_composed_path`` is set, each chunk is stored there as its own file
+
+            max_memory_hashes: Only used when `chunk_size` is greater than 0. The number of row hashes held in memory
+                               for deduplication before they are spilled to disk
+            manifest: When True the store finds the files to store by querying the manifest of the path rather
+                      than listing it, and records the upload status of each file so that a file uploaded before a
+                      crash is not uploaded again. Files are only moved or deleted once they have been uploaded.
+                      :py:class:`See documentation for the ShardManifest <api2db.stream.manifest.ShardManifest>`
+            reconcile_seconds: Only used when `manifest=True`. The number of seconds between reconciling the manifest
+                               with the files in the path, which registers files that were not registered when written
 
 
         """
@@ -72,11 +104,19 @@ class Store(Stream):
         self.drop_duplicate_exclude = drop_duplicate_exclude
         self.move_shards_path = move_shards_path
         self.move_composed_path = move_composed_path
+        self.max_memory_hashes = max_memory_hashes
         self.build_dependencies()
         self.stream = None
         """Optional[api2db.stream.stream.Stream]: The stream instance used to store data"""
         self.store_str = None
         """Optional[str]: A string used for logging"""
+        self.partitions = PartitionIndex(self.path) if self.path is not None else None
+        """Optional[api2db.stream.partitions.PartitionIndex]: Finds the partitions of the path containing files"""
+        self.manifest = ShardManifest(self.path) if manifest and self.path is not None else None
+        """Optional[api2db.stream.manifest.ShardManifest]: The manifest of the files in the path"""
+        self.reconcile_seconds = reconcile_seconds
+        self.reconcile_at = 0.0
+        """float: The time the manifest will next be reconciled with the files in the path"""
 
     def build_dependencies(self) -> None:
         """
@@ -95,7 +135,8 @@ class Store(Stream):
 
     def store(self) -> None:
         """
-        Composed a DataFrame from the files in the stores path, and stores the data to the storage target.
+        Composes a DataFrame from the files in each partition of the stores path that has changed, and stores the data
+        to the storage target.
 
         Returns:
             None
@@ -104,12 +145,131 @@ class Store(Stream):
         self.dtypes = self.build_dtypes()
         if self.dtypes is None:
             return
-        df = self.static_compose_df_from_dir(path=self.path,
+        if self.manifest is not None:
+            self.store_manifest()
+        else:
+            parts = self.partitions.scan() if self.partitions is not None else []
+            if len(parts) == 0:
+                logger.warning(f"no files found at {self.path} to store, api may be down")
+            for rel in parts:
+                self.store_partition(rel)
+        # Replay a bounded chunk of any uploads that previously failed
+        self.stream.check_failures()
+
+    def store_manifest(self) -> None:
+        """
+        Stores the files registered in the manifest that have not yet been moved or deleted, partition by partition.
+        Files that were uploaded before a crash are moved or deleted without being uploaded again
+
+        Returns:
+            None
+        """
+        logger = get_logger()
+        now = time.time()
+        if now >= self.reconcile_at:
+            self.reconcile_at = now + self.reconcile_seconds
+            count = self.manifest.reconcile(self.partitions)
+            if count != 0:
+                logger.info(f"registered {count} files found at {self.path} missing from its manifest")
+        pending = self.manifest.pending()
+        if len(pending) == 0:
+            logger.warning(f"no files found at {self.path} to store, api may be down")
+        for rel, entries in pending.items():
+            uploaded = [os.path.basename(entry["file"]) for entry in entries if entry["status"] == "uploaded"]
+            self.retire(rel, uploaded)
+            files = [os.path.basename(entry["file"]) for entry in entries if entry["status"] != "uploaded"]
+            if len(files) == 0:
+                continue
+            if self.chunk_size > 0:
+                self.store_partition_chunked(rel, files)
+            else:
+                self.store_files(rel, files)
+
+    def store_files(self, rel: str, files: List[str]) -> None:
+        """
+        Composes a DataFrame from files in a single partition of the stores path registered in the manifest, stores
+        the data to the storage target, and then moves or deletes the files
+
+        Args:
+            rel: The relative path of the partition, ``""`` for the stores path itself
+            files: The file names
+
+        Returns:
+            None
+        """
+        logger = get_logger()
+        path = os.path.join(self.path, rel)
+        self.manifest.mark([os.path.join(rel, fname) for fname in files], "uploading")
+        df = self.static_load_dfs(paths=[os.path.join(path, fname) for fname in files], fmt=self.fmt)
+        if df is None:
+            # Keep files that could not be read rather than deleting data that was never stored
+            logger.error(f"{len(files)} files at {path} could not be loaded... marking as corrupt")
+            self.manifest.mark([os.path.join(rel, fname) for fname in files], "corrupt")
+            return
+        if self.move_composed_path is not None:
+            fname = f"{files[0].split('.')[0]}_{files[-1].split('.')[0] if len(files) > 1 else None}.{self.fmt}"
+            self.static_store_df(df=df, path=os.path.join(self.move_composed_path, rel, fname), fmt=self.fmt)
+        try:
+            df = df.astype(self.dtypes)
+        except Exception as e:
+            # Keep files whose data does not match the dtypes, they are not retired until their data is stored
+            logger.exception(e)
+            logger.error(f"{len(files)} files at {path} do not match the dtypes of {self.name}... marking as corrupt")
+            self.manifest.mark([os.path.join(rel, fname) for fname in files], "corrupt")
+            return
+        if self.drop_duplicate_exclude is not None:
+            df = df.drop_duplicates(subset=df.columns.difference(self.drop_duplicate_exclude))
+        else:
+            df = df.drop_duplicates()
+        logger.info(self.store_str.format(len(df)))
+        self.stream.stream(df)
+        self.manifest.mark([os.path.join(rel, fname) for fname in files], "uploaded")
+        self.retire(rel, files)
+
+    def retire(self, rel: str, files: List[str]) -> None:
+        """
+        Moves or deletes files in a single partition of the stores path once they have been stored, and removes them
+        from the manifest
+
+        Args:
+            rel: The relative path of the partition, ``""`` for the stores path itself
+            files: The file names
+
+        Returns:
+            None
+        """
+        if len(files) == 0:
+            return
+        self.static_retire_files(path=os.path.join(self.path, rel),
+                                 files=files,
+                                 move_shards_path=None if self.move_shards_path is None else
+                                 os.path.join(self.move_shards_path, rel))
+        if self.manifest is not None:
+            self.manifest.remove([os.path.join(rel, fname) for fname in files])
+
+    def store_partition(self, rel: str) -> None:
+        """
+        Composes a DataFrame from the files in a single partition of the stores path, and stores the data to the
+        storage target.
+
+        Args:
+            rel: The relative path of the partition, ``""`` for the stores path itself
+
+        Returns:
+            None
+        """
+        if self.chunk_size > 0:
+            self.store_partition_chunked(rel)
+            return
+        logger = get_logger()
+        path = os.path.join(self.path, rel)
+        df = self.static_compose_df_from_dir(path=path,
                                              fmt=self.fmt,
-                                             move_shards_path=self.move_shards_path,
-                                             move_composed_path=self.move_composed_path)
+                                             move_shards_path=None if self.move_shards_path is None else
+                                             os.path.join(self.move_shards_path, rel),
+                                             move_composed_path=None if self.move_composed_path is None else
+                                             os.path.join(self.move_composed_path, rel))
         if df is None:
-            logger.warning(f"no files found at {self.path} to store, api may be down")
             return
         try:
             df = df.astype(self.dtypes)
@@ -123,6 +283,108 @@ class Store(Stream):
         logger.info(self.store_str.format(len(df)))
         self.stream.stream(df)
 
+    def store_partition_chunked(self, rel: str, files: Optional[List[str]]=None) -> None:
+        """
+        Stores the files in a single partition of the stores path in chunks of at most ``chunk_size`` rows, holding
+        only a single chunk in memory at a time
+
+        Files are moved or deleted once every chunk has been handed to the storage target. When the store has a
+        manifest, each file is marked as uploaded as soon as every chunk containing its rows has been handed to the
+        storage target. Files with a chunk that does not match the dtypes are kept, and marked as corrupt in the
+        manifest.
+
+        Args:
+            rel: The relative path of the partition, ``""`` for the stores path itself
+            files: The file names to store, defaults to every file in the partition
+
+        Returns:
+            None
+        """
+        logger = get_logger()
+        path = os.path.join(self.path, rel)
+        files = self.static_list_files(path) if files is None else files
+        if len(files) == 0:
+            return
+        if self.manifest is not None:
+            self.manifest.mark([os.path.join(rel, fname) for fname in files], "uploading")
+        # Files whose rows have all been read, and that are not yet marked as uploaded
+        consumed = []
+        # Files with rows that could not be stored
+        skipped = []
+        seen = HashSet(max_memory=self.max_memory_hashes)
+        buffer = []
+        rows = 0
+        chunks = 0
+        try:
+            for fname in files:
+                for df in self.static_iter_df(path=os.path.join(path, fname), fmt=self.fmt, batch_size=self.chunk_size):
+                    try:
+                        df = df.astype(self.dtypes)
+                    except Exception as e:
+                        logger.exception(e)
+                        skipped.append(fname)
+                        break
+                    subset = None
+                    if self.drop_duplicate_exclude is not None:
+                        subset = df.columns.difference(self.drop_duplicate_exclude)
+                    df = df[seen.add_new(hash_rows(df, subset=subset))]
+                    if len(df) == 0:
+                        continue
+                    buffer.append(df)
+                    rows += len(df)
+                    if rows >= self.chunk_size:
+                        self.store_chunk(pd.concat(buffer, ignore_index=True), rel, files, chunks)
+                        buffer, rows, chunks = [], 0, chunks + 1
+                        self.mark_uploaded(rel, consumed)
+                        consumed = []
+                if fname not in skipped:
+                    consumed.append(fname)
+            if len(buffer) != 0:
+                self.store_chunk(pd.concat(buffer, ignore_index=True), rel, files, chunks)
+            self.mark_uploaded(rel, consumed)
+        finally:
+            seen.close()
+        if len(skipped) != 0:
+            # Keep files whose data does not match the dtypes, they are not retired until their data is stored
+            logger.error(f"{len(skipped)} files at {path} do not match the dtypes of {self.name}... keeping them")
+            if self.manifest is not None:
+                self.manifest.mark([os.path.join(rel, fname) for fname in skipped], "corrupt")
+        self.retire(rel, [fname for fname in files if fname not in skipped])
+
+    def mark_uploaded(self, rel: str, files: List[str]) -> None:
+        """
+        Marks files in the manifest as uploaded, if the store has a manifest
+
+        Args:
+            rel: The relative path of the partition, ``""`` for the stores path itself
+            files: The file names
+
+        Returns:
+            None
+        """
+        if self.manifest is not None:
+            self.manifest.mark([os.path.join(rel, fname) for fname in files], "uploaded")
+
+    def store_chunk(self, df: pd.DataFrame, rel: str, files: List[str], i: int) -> None:
+        """
+        Stores a single chunk to the storage target
+
+        Args:
+            df: The chunk to store
+            rel: The relative path of the partition the chunk was read from
+            files: The file names the chunk was read from
+            i: The index of the chunk within the partition
+
+        Returns:
+            None
+        """
+        logger = get_logger()
+        logger.info(self.store_str.format(len(df)))
+        if self.move_composed_path is not None:
+            fname = f"{files[0].split('.')[0]}_{files[-1].split('.')[0] if len(files) > 1 else None}_{i}.{self.fmt}"
+            self.static_store_df(df=df, path=os.path.join(self.move_composed_path, rel, fname), fmt=self.fmt)
+        self.stream.stream(df)
+
     def start(self):
         """
         Store objects subclass Stream but do not contain a start method. Stores should NEVER use start
@@ -72,7 +72,7 @@ class Store2Bigquery(Store):
                 * `if_exists="replace"` Replaces the table with the new data
                 * `if_exists="fail"` Fails to upload the new data if the table exists
 
-            chunk_size: CURRENTLY NOT SUPPORTED
+            :py:class:`Documentation found here <api2db.store.store.Store>`
         """
         super().__init__(name=name,
                          seconds=seconds,
@@ -80,7 +80,8 @@ class Store2Bigquery(Store):
                          fmt=fmt,
                          drop_duplicate_exclude=drop_duplicate_exclude,
                          move_shards_path=move_shards_path,
-                         move_composed_path=move_composed_path)
+                         move_composed_path=move_composed_path,
+                         chunk_size=chunk_size)
         self.stream = Stream2Bigquery(name=name,
                                       auth_path=auth_path,
                                       pid=pid,
@@ -72,7 +72,7 @@ class Store2Omnisci(Store):
                                 <api2db.stream.file_converter.FileConverter.static_compose_df_from_dir>`
 
             protocol: The protocol to use when connecting to the database
-            chunk_size: CURRENTLY NOT SUPPORTED
+            :py:class:`Documentation found here <api2db.store.store.Store>`
         """
         super().__init__(name=name,
                          seconds=seconds,
@@ -80,7 +80,8 @@ class Store2Omnisci(Store):
                          fmt=fmt,
                          drop_duplicate_exclude=drop_duplicate_exclude,
                          move_shards_path=move_shards_path,
-                         move_composed_path=move_composed_path)
+                         move_composed_path=move_composed_path,
+                         chunk_size=chunk_size)
         self.stream = Stream2Omnisci(name=name,
                                      db_name=db_name,
                                      username=username,
@@ -5,7 +5,7 @@ Contains the Store2Sql class
 """
 from .store import Store
 from ..stream.stream2sql import Stream2Sql
-from typing import Optional, List
+from typing import Optional, List, Union
 
 
 class Store2Sql(Store):
@@ -27,6 +27,10 @@ class Store2Sql(Store):
                  move_shards_path: Optional[str]=None,
                  move_composed_path: Optional[str]=None,
                  if_exists: str="append",
+                 primary_keys: Optional[List[str]]=None,
+                 indexes: Optional[List[Union[str, List[str]]]]=None,
+                 partition_by: Optional[str]=None,
+                 string_length: Optional[int]=None,
                  chunk_size: int=0,
                  ):
         """
@@ -45,6 +49,7 @@ class Store2Sql(Store):
                 * `dialect="mysql"` -> Use this to connect to a mysql database
                 * `dialect="mariadb"` -> Use this to connect to a mariadb database
                 * `dialect="postgresql"` -> Use this to connect to a postgresql database
+                * `dialect="sqlite"` -> Use this to store to a local SQLite file, ``db_name`` is the path to the file
                 * `dialect="amazon_aurora"` -> COMING SOON
                 * `dialect="oracle"` -> COMING SOON
                 * `dialect="microsoft_sql"` -> COMING SOON
@@ -84,7 +89,17 @@ class Store2Sql(Store):
             move_composed_path: :py:meth:`Documentation and Examples found here
                                 <api2db.stream.file_converter.FileConverter.static_compose_df_from_dir>`
 
-            chunk_size: CURRENTLY NOT SUPPORTED
+            if_exists:
+
+                * `if_exists="append"` Adds the data to the table
+                * `if_exists="replace"` Replaces the table with the new data
+                * `if_exists="fail"` Fails to upload the new data if the table exists
+
+            primary_keys: The columns that make up the primary key of the table
+            indexes: The secondary indexes to create on the table, each either a column name or a list of column names
+            partition_by: A partitioning hint passed through to the dialect when the table is created
+            string_length: When provided, `string` columns are created as ``VARCHAR(string_length)``
+            :py:class:`Documentation found here <api2db.store.store.Store>`
         """
         super().__init__(name=name,
                          seconds=seconds,
@@ -92,7 +107,8 @@ class Store2Sql(Store):
                          fmt=fmt,
                          drop_duplicate_exclude=drop_duplicate_exclude,
                          move_shards_path=move_shards_path,
-                         move_composed_path=move_composed_path)
+                         move_composed_path=move_composed_path,
+                         chunk_size=chunk_size)
         self.stream = Stream2Sql(name=name,
                                  db_name=db_name,
                                  dialect=dialect,
@@ -102,9 +118,13 @@ class Store2Sql(Store):
                                  auth_path=auth_path,
                                  port=port,
                                  if_exists=if_exists,
+                                 primary_keys=primary_keys,
+                                 indexes=indexes,
+                                 partition_by=partition_by,
+                                 string_length=string_length,
                                  chunk_size=chunk_size,
                                  store=True)
         self.store_str = (
             "storage files composed, attempting to store {} "
-            f"rows to {self.stream.dialect}://{self.stream.host}/{self.stream.db_name}"
+            f"rows to {self.stream.log_str}"
         )
@@ -0,0 +1,202 @@
+# -*- coding: utf-8 -*-
+"""
+Contains the DedupIndex class
+=============================
+
+NOTE:
+
+    A DedupIndex is used by a :py:class:`api2db.ingest.collector.Collector` with ``dedup_keys`` set to drop rows that
+    have already been collected before they reach any stream. APIs that are polled periodically often return mostly
+    the same rows on every request, and without the index each of those rows would be stored again on every request.
+
+    Each row is identified by a 64-bit hash of its ``dedup_keys`` columns. Hashes are stored along with the time they
+    were first seen in
+
+        CACHE/**collector_name**_dedup.sqlite
+
+    so the index survives restarts of the collector. A row is dropped if its hash was first seen less than ``ttl``
+    seconds ago, so a row that keeps being returned by the API is collected again once every ``ttl`` seconds. Hashes
+    older than ``ttl`` are purged from the index periodically.
+
+    At most ``max_memory`` of the most recently seen hashes are cached in memory, so the memory used by the index stays
+    bounded no matter how many rows have been seen. Hashes missing from the cache are looked up on disk.
+
+    Rows are only added to the index by ``commit``, once their batch has been handed to the streams, so rows whose
+    batch was never delivered are collected again by the next import.
+"""
+from .hash_set import hash_rows
+from ..app.log import get_logger
+from threading import Lock as ThreadLock
+from collections import OrderedDict
+import numpy as np
+import pandas as pd
+import sqlite3
+import os
+import time
+from typing import List, Optional, Tuple
+
+
+class DedupIndex(object):
+    """A persistent, memory bounded index of the rows a collector has already collected"""
+
+    def __init__(self,
+                 name: str,
+                 keys: Optional[List[str]]=None,
+                 ttl: Optional[float]=86400,
+                 max_memory: int=1000000,
+                 path: Optional[str]=None):
+        """
+        Creates a DedupIndex object
+
+        Args:
+            name: The name of the collector associated with the index
+            keys: The columns that identify a row, defaults to every column
+            ttl: The number of seconds a row is remembered for. When None rows are remembered forever
+            max_memory: The number of hashes cached in memory
+            path: The path to the index file, defaults to CACHE/**collector_name**_dedup.sqlite
+        """
+        self.name = name
+        self.keys = keys if keys is None or len(keys) != 0 else None
+        self.ttl = ttl
+        self.max_memory = max_memory
+        self.path = os.path.join("CACHE", f"{name}_dedup.sqlite") if path is None else path
+        self.memory = OrderedDict()
+        """collections.OrderedDict: Maps the most recently seen hashes to the time they were first seen"""
+        self.uncommitted = []
+        """list: (hash, time) of hashes added since the index was last committed"""
+        self.purge_at = 0.0 if ttl is not None else float("inf")
+        """float: The time expired hashes will next be purged from disk"""
+        self.con = None
+        self.lock = ThreadLock()
+
+    def connect(self) -> sqlite3.Connection:
+        """
+        Opens the index file, creating it if it does not exist. Must be called while holding the lock
+
+        Returns:
+            The connection to the index file
+        """
+        if self.con is None:
+            dir_path = os.path.dirname(self.path)
+            if dir_path != "" and not os.path.isdir(dir_path):
+                os.makedirs(dir_path)
+            self.con = sqlite3.connect(self.path, timeout=30.0, check_same_thread=False)
+            self.con.execute("PRAGMA journal_mode=WAL")
+            self.con.execute("PRAGMA synchronous=NORMAL")
+            self.con.execute("CREATE TABLE IF NOT EXISTS seen (h INTEGER PRIMARY KEY, ts REAL NOT NULL)")
+            self.con.commit()
+        return self.con
+
+    def lookup(self, hashes: np.ndarray, cutoff: float) -> np.ndarray:
+        """
+        Looks up hashes missing from the memory cache on disk, caching those found. Must be called while holding the
+        lock
+
+        Args:
+            hashes: The hashes to look up
+            cutoff: Hashes first seen before this time are treated as unseen
+
+        Returns:
+            A boolean array that is True for each hash seen since ``cutoff``
+        """
+        con = self.connect()
+        signed = hashes.view(np.int64)
+        found = {}
+        # SQLite limits the number of parameters in a single statement
+        for i in range(0, len(signed), 500):
+            chunk = [int(h) for h in signed[i:i + 500]]
+            query = f"SELECT h, ts FROM seen WHERE ts >= ? AND h IN ({','.join('?' * len(chunk))})"
+            found.update(con.execute(query, [cutoff] + chunk).fetchall())
+        for h, ts in found.items():
+            self.remember(int(np.int64(h).view(np.uint64)), ts)
+        return np.fromiter((int(h) in found for h in signed), dtype=bool, count=len(signed))
+
+    def remember(self, h: int, ts: float) -> None:
+        """
+        Caches a hash in memory, evicting the least recently seen hash once the cache is full. Must be called while
+        holding the lock
+
+        Args:
+            h: The hash
+            ts: The time the hash was first seen
+
+        Returns:
+            None
+        """
+        self.memory[h] = ts
+        self.memory.move_to_end(h)
+        if len(self.memory) > self.max_memory:
+            self.memory.popitem(last=False)
+
+    def filter_new(self, df: pd.DataFrame) -> Tuple[pd.DataFrame, np.ndarray]:
+        """
+        Drops the rows of a DataFrame that have been seen within the ttl. The remaining rows are not added to the
+        index until their hashes are passed to ``commit``
+
+        Args:
+            df: The DataFrame to deduplicate
+
+        Returns:
+            (df, hashes) where df holds the rows of the DataFrame that have not been seen within the ttl, and hashes
+            holds their hashes
+        """
+        if len(df) == 0:
+            return df, np.empty(0, dtype=np.uint64)
+        hashes = hash_rows(df, subset=self.keys)
+        now = time.time()
+        cutoff = -np.inf if self.ttl is None else now - self.ttl
+        with self.lock:
+            new = ~pd.Series(hashes).duplicated().to_numpy()
+            cached = np.fromiter((self.memory.get(int(h), -np.inf) >= cutoff for h in hashes),
+                                 dtype=bool,
+                                 count=len(hashes))
+            for h in hashes[cached]:
+                self.memory.move_to_end(int(h))
+            new &= ~cached
+            if new.any():
+                new[new] = ~self.lookup(hashes[new], cutoff)
+        return df[new], hashes[new]
+
+    def commit(self, hashes: Optional[np.ndarray]=None) -> None:
+        """
+        Adds the hashes of rows that have been handed to the streams to the index, writes the hashes added since the
+        last commit to disk, and purges expired hashes at most once per ttl
+
+        Args:
+            hashes: The hashes returned by ``filter_new`` for rows that have been handed to the streams
+
+        Returns:
+            None
+        """
+        logger = get_logger()
+        now = time.time()
+        with self.lock:
+            for h in hashes if hashes is not None else []:
+                self.remember(int(h), now)
+                self.uncommitted.append((int(np.uint64(h).view(np.int64)), now))
+            if len(self.uncommitted) == 0 and time.time() < self.purge_at:
+                return
+            try:
+                con = self.connect()
+                con.executemany("INSERT OR REPLACE INTO seen (h, ts) VALUES (?, ?)", self.uncommitted)
+                now = time.time()
+                if self.ttl is not None and now >= self.purge_at:
+                    self.purge_at = now + self.ttl
+                    con.execute("DELETE FROM seen WHERE ts < ?", (now - self.ttl, ))
+                con.commit()
+                self.uncommitted = []
+            except Exception as e:
+                logger.exception(e)
+
+    def close(self) -> None:
+        """
+        Commits and closes the index file
+
+        Returns:
+            None
+        """
+        self.commit()
+        with self.lock:
+            if self.con is not None:
+                self.con.close()
+            self.con = None
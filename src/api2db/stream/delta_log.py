@@ -0,0 +1,207 @@
+# -*- coding: utf-8 -*-
+"""
+Contains the DeltaLog class
+===========================
+
+NOTE:
+
+    The DeltaLog is used by :py:class:`api2db.stream.stream2local.Stream2Local` when `mode="update"`. Rather than
+    loading and rewriting the whole file at ``path`` for every incoming batch, each batch is written as a small delta
+    file in the directory ``path.deltas/``
+
+    ::
+
+        CACHE/collector_name_static.parquet
+        CACHE/collector_name_static.parquet.deltas/
+        |                                         |- .meta.json
+        |                                         |- 1634482800000000000.parquet
+        |                                         |- 1634482810000000000.parquet
+
+    Once the number of deltas or their total size reaches a threshold, the deltas are merged into the base file in a
+    background thread. The base file is replaced atomically and only the deltas that were merged are deleted.
+
+    :py:meth:`api2db.stream.file_converter.FileConverter.static_load_df` merges pending deltas into the base file
+    when loading it, so readers such as :py:class:`api2db.ingest.post_process.merge_static.MergeStatic` always see
+    the base plus every delta, with the most recently written row winning for each set of ``keys``. Readers list the
+    deltas before loading the base file, and load the base file again if a delta is compacted before they load it, so
+    a read that overlaps a compaction, in any process, still sees every row.
+"""
+from .file_converter import FileConverter
+from ..app.log import get_logger
+from threading import Lock as ThreadLock
+from threading import Thread
+import pandas as pd
+import json
+import os
+import time
+from typing import List, Optional
+
+
+class DeltaLog(object):
+    """Appends batches as delta files next to a base file and compacts them into it in the background"""
+
+    def __init__(self,
+                 path: str,
+                 fmt: str,
+                 keys: Optional[List[str]]=None,
+                 dtypes: Optional[dict]=None,
+                 compact_deltas: int=100,
+                 compact_bytes: int=67108864):
+        """
+        Creates a DeltaLog object
+
+        Args:
+            path: The path to the base file
+            fmt: The format of the base file and the deltas
+            keys: The keys identifying a row. The most recently written row is kept for each set of keys. When None
+                  entire rows are compared
+            dtypes: The dtypes to cast the base file to when compacting
+            compact_deltas: The number of deltas at which they are merged into the base file
+            compact_bytes: The total size in bytes of the deltas at which they are merged into the base file
+        """
+        self.path = path
+        self.fmt = fmt
+        self.keys = keys
+        self.dtypes = dtypes
+        self.dir_path = FileConverter.static_delta_dir(path)
+        """str: The directory the deltas are stored in"""
+        self.compact_deltas = compact_deltas
+        self.compact_bytes = compact_bytes
+        self.lock = ThreadLock()
+        """threading.Lock: Held while compacting, so that only one compaction runs at a time"""
+        self.count_lock = ThreadLock()
+        self.thread = None
+        """Optional[threading.Thread]: The thread of the most recent compaction"""
+        self.last_ts = 0
+        files = FileConverter.static_list_deltas(self.path)
+        self.count = len(files)
+        """int: The number of pending deltas"""
+        self.bytes = sum(os.path.getsize(os.path.join(self.dir_path, fname)) for fname in files)
+        """int: The total size in bytes of the pending deltas"""
+
+    def write_meta(self) -> None:
+        """
+        Records the keys of the deltas so that readers merge them the same way
+
+        Returns:
+            None
+        """
+        if not os.path.isdir(self.dir_path):
+            os.makedirs(self.dir_path)
+        path = os.path.join(self.dir_path, ".meta.json")
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({"keys": self.keys, "fmt": self.fmt}, f)
+        os.replace(tmp_path, path)
+
+    def append(self, df: pd.DataFrame) -> bool:
+        """
+        Writes a batch as a new delta, or as the base file if no base file exists
+
+        Args:
+            df: The batch to write
+
+        Returns:
+            True if the batch was written otherwise False
+        """
+        if not os.path.isfile(self.path) and self.count == 0:
+            return FileConverter.static_replace_df(df=df, path=self.path, fmt=self.fmt)
+        if self.count == 0:
+            self.write_meta()
+        # File names must be unique even if batches arrive within the same nanosecond
+        ts = max(int(time.time() * 1e9), self.last_ts + 1)
+        self.last_ts = ts
+        path = os.path.join(self.dir_path, f"{ts}.{self.fmt}")
+        if not FileConverter.static_replace_df(df=df, path=path, fmt=self.fmt):
+            return False
+        with self.count_lock:
+            self.count += 1
+            self.bytes += os.path.getsize(path)
+        return True
+
+    def due(self) -> bool:
+        """
+        Determines if the deltas should be merged into the base file
+
+        Returns:
+            True if the deltas should be merged otherwise False
+        """
+        return self.count >= self.compact_deltas or (self.count != 0 and self.bytes >= self.compact_bytes)
+
+    def compact_async(self) -> None:
+        """
+        Merges the deltas into the base file in a background thread, unless a compaction is already running
+
+        Returns:
+            None
+        """
+        if self.thread is not None and self.thread.is_alive():
+            return
+        self.thread = Thread(target=self.compact)
+        self.thread.start()
+
+    def compact(self) -> None:
+        """
+        Merges the deltas present when called into the base file, atomically replaces the base file, and deletes the
+        merged deltas. Deltas written while compacting are left for the next compaction
+
+        Returns:
+            None
+        """
+        logger = get_logger()
+        if not self.lock.acquire(blocking=False):
+            return
+        try:
+            files = FileConverter.static_list_deltas(self.path)
+            if len(files) == 0:
+                return
+            sizes = sum(os.path.getsize(os.path.join(self.dir_path, fname)) for fname in files)
+            df = FileConverter.static_load_df(path=self.path, fmt=self.fmt, deltas=False)
+            df = FileConverter.static_merge_deltas(df=df, path=self.path, fmt=self.fmt, files=files)
+            if df is None:
+                return
+            if self.dtypes is not None:
+                df = df.astype(self.dtypes)
+            logger.debug(f"compacting {len(files)} deltas into {self.path}")
+            if not FileConverter.static_replace_df(df=df, path=self.path, fmt=self.fmt):
+                return
+            for fname in files:
+                try:
+                    os.remove(os.path.join(self.dir_path, fname))
+                except Exception as e:
+                    logger.exception(e)
+            with self.count_lock:
+                self.count = max(self.count - len(files), 0)
+                self.bytes = max(self.bytes - sizes, 0)
+        except Exception as e:
+            logger.exception(e)
+        finally:
+            self.lock.release()
+
+    def clear(self) -> None:
+        """
+        Deletes every pending delta. Used when the base file is replaced outright
+
+        Returns:
+            None
+        """
+        logger = get_logger()
+        self.wait()
+        for fname in FileConverter.static_list_deltas(self.path):
+            try:
+                os.remove(os.path.join(self.dir_path, fname))
+            except Exception as e:
+                logger.exception(e)
+        with self.count_lock:
+            self.count = 0
+            self.bytes = 0
+
+    def wait(self) -> None:
+        """
+        Waits for a running compaction to finish
+
+        Returns:
+            None
+        """
+        if self.thread is not None:
+            self.thread.join()
@@ -0,0 +1,303 @@
+# -*- coding: utf-8 -*-
+"""
+Contains the FailureJournal class
+=================================
+
+NOTE:
+
+    Batches that a stream fails to upload are stored in
+
+        STORE/upload_failed/**collector_name**/**stream_type**/date=**YYYY-MM-DD**/**timestamp_ns**.parquet
+
+    Batches are partitioned by the UTC date they failed, and a date partition is removed once every batch in it has
+    been replayed.
+
+    The journal keeps an index of these batches in ``_index.jsonl`` within the same directory. Each line of the index
+    either adds a pending batch ``{"op": "add", "file": ..., "rows": ..., "ts": ...}`` or marks a batch as replayed
+    ``{"op": "done", "file": ...}``. The index is read once when the journal is first used, so replaying failed batches
+    never has to list the directory or load every file at once. Files found in the directory that are missing from the
+    index (I.e. stored by an older version of api2db) are added to the index when it is loaded.
+"""
+from .file_converter import FileConverter
+from ..app.log import get_logger
+from ..app.metrics import get_metrics
+from threading import Lock as ThreadLock
+from threading import RLock
+from collections import OrderedDict
+import pandas as pd
+import pyarrow.parquet as pq
+import json
+import os
+import time
+from typing import List, Union
+
+
+class FailureJournal(object):
+    """Indexes the batches a stream has failed to upload so that they can be replayed incrementally"""
+
+    journals = {}
+    """dict: Maps the directory of each journal to its instance, shared by every stream in the process"""
+    journals_lock = ThreadLock()
+
+    @staticmethod
+    def get(name: str, stream_type: str) -> "FailureJournal":
+        """
+        Retrieves the journal for a collector and stream type, creating it on first use
+
+        A Stream and the Stream used by a Store of the same type share a failure directory, so they must share a
+        journal.
+
+        Args:
+            name: The name of the collector
+            stream_type: The type of the stream
+
+        Returns:
+            The FailureJournal for the directory
+        """
+        path = f"STORE/upload_failed/{name}/{stream_type}/"
+        with FailureJournal.journals_lock:
+            if path not in FailureJournal.journals:
+                FailureJournal.journals[path] = FailureJournal(name, stream_type)
+            return FailureJournal.journals[path]
+
+    def __init__(self, name: str, stream_type: str):
+        """
+        Creates a FailureJournal object. The index is loaded lazily upon first use
+
+        Args:
+            name: The name of the collector
+            stream_type: The type of the stream
+        """
+        self.name = name
+        self.stream_type = stream_type
+        self.path = f"STORE/upload_failed/{name}/{stream_type}/"
+        """str: The directory the failed batches are stored in"""
+        self.index_path = os.path.join(self.path, "_index.jsonl")
+        """str: The path to the index of pending batches"""
+        self.pending = OrderedDict()
+        """collections.OrderedDict: Maps the file name of each pending batch to its index entry, oldest first"""
+        self.claimed = set()
+        """set: File names of pending batches currently being replayed"""
+        self.loaded = False
+        self.lock = RLock()
+
+    def load(self) -> None:
+        """
+        Loads the index, reconciles it with the directory, and rewrites it without completed entries
+
+        Returns:
+            None
+        """
+        logger = get_logger()
+        pending = OrderedDict()
+        if os.path.isfile(self.index_path):
+            with open(self.index_path, "r") as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        # A partially written line from a crash
+                        continue
+                    if entry.get("op") == "add":
+                        pending[entry["file"]] = {"file": entry["file"], "rows": entry["rows"], "ts": entry["ts"]}
+                    elif entry.get("op") == "done":
+                        pending.pop(entry["file"], None)
+        for fname in list(pending.keys()):
+            if not os.path.isfile(os.path.join(self.path, fname)):
+                pending.pop(fname)
+        for dir_path, dirnames, fnames in os.walk(self.path):
+            dirnames[:] = sorted(d for d in dirnames if d.startswith("date="))
+            for fname in sorted(fnames):
+                fname = os.path.relpath(os.path.join(dir_path, fname), self.path)
+                if not fname.endswith(".parquet") or fname in pending:
+                    continue
+                try:
+                    rows = pq.read_metadata(os.path.join(self.path, fname)).num_rows
+                except Exception as e:
+                    logger.exception(e)
+                    continue
+                pending[fname] = {"file": fname,
+                                  "rows": rows,
+                                  "ts": os.path.getmtime(os.path.join(self.path, fname))}
+        self.pending = OrderedDict(sorted(pending.items(), key=lambda x: x[1]["ts"]))
+        if len(self.pending) != 0 or os.path.isfile(self.index_path):
+            self.rewrite()
+        self.loaded = True
+        self.report()
+
+    def rewrite(self) -> None:
+        """
+        Rewrites the index so that it only contains pending batches
+
+        Returns:
+            None
+        """
+        if not os.path.isdir(self.path):
+            os.makedirs(self.path)
+        tmp_path = f"{self.index_path}.tmp"
+        with open(tmp_path, "w") as f:
+            for entry in self.pending.values():
+                f.write(json.dumps({"op": "add", **entry}) + "\n")
+        os.replace(tmp_path, self.index_path)
+
+    def append(self, entry: dict) -> None:
+        """
+        Appends a single entry to the index
+
+        Args:
+            entry: The entry to append
+
+        Returns:
+            None
+        """
+        with open(self.index_path, "a") as f:
+            f.write(json.dumps(entry) + "\n")
+
+    def record(self, df: pd.DataFrame) -> bool:
+        """
+        Stores a batch that failed to upload and adds it to the index
+
+        Args:
+            df: The batch that failed to upload
+
+        Returns:
+            True if the batch was stored otherwise False
+        """
+        with self.lock:
+            if not self.loaded:
+                self.load()
+            ts = int(time.time() * 1e9)
+            fname = os.path.join(f"date={time.strftime('%Y-%m-%d', time.gmtime(ts / 1e9))}", f"{ts}.parquet")
+            if not FileConverter.static_store_df(df=df, path=os.path.join(self.path, fname), fmt="parquet"):
+                return False
+            entry = {"file": fname, "rows": len(df), "ts": ts / 1e9}
+            self.append({"op": "add", **entry})
+            self.pending[fname] = entry
+        self.report()
+        return True
+
+    def claim(self, max_rows: int) -> List[dict]:
+        """
+        Claims the oldest pending batches for replay, up to ``max_rows`` rows. At least one batch is claimed if any
+        are pending, regardless of its size
+
+        Args:
+            max_rows: The maximum number of rows to claim
+
+        Returns:
+            The index entries of the claimed batches
+        """
+        res = []
+        with self.lock:
+            if not self.loaded:
+                self.load()
+            rows = 0
+            for fname, entry in self.pending.items():
+                if fname in self.claimed:
+                    continue
+                if len(res) != 0 and rows + entry["rows"] > max_rows:
+                    break
+                self.claimed.add(fname)
+                res.append(entry)
+                rows += entry["rows"]
+        return res
+
+    def load_df(self, entry: dict) -> Union[pd.DataFrame, None]:
+        """
+        Loads the batch of a claimed entry
+
+        Args:
+            entry: The claimed entry
+
+        Returns:
+            The batch if it could be loaded otherwise None
+        """
+        return FileConverter.static_load_df(path=os.path.join(self.path, entry["file"]), fmt="parquet")
+
+    def release(self, entries: List[dict]) -> None:
+        """
+        Returns claimed entries to the pending batches without replaying them
+
+        Args:
+            entries: The claimed entries
+
+        Returns:
+            None
+        """
+        with self.lock:
+            for entry in entries:
+                self.claimed.discard(entry["file"])
+
+    def complete(self, entry: dict, keep: bool=False) -> None:
+        """
+        Removes a replayed batch from the index and deletes its file
+
+        Args:
+            entry: The claimed entry
+            keep: When True the file is renamed with a ``.corrupt`` suffix rather than deleted. Used for batches that
+                  can never be uploaded, so that they can be inspected
+
+        Returns:
+            None
+        """
+        logger = get_logger()
+        path = os.path.join(self.path, entry["file"])
+        try:
+            if keep:
+                os.replace(path, f"{path}.corrupt")
+            else:
+                os.remove(path)
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            logger.exception(e)
+        with self.lock:
+            self.claimed.discard(entry["file"])
+            self.pending.pop(entry["file"], None)
+            self.remove_partition(os.path.dirname(entry["file"]))
+            if len(self.pending) == 0:
+                self.rewrite()
+            else:
+                self.append({"op": "done", "file": entry["file"]})
+        get_metrics().incr(f"{self.name}.{self.stream_type}.failed_rows_replayed", 0 if keep else entry["rows"])
+        self.report()
+
+    def remove_partition(self, rel: str) -> None:
+        """
+        Removes a date partition once it is empty. Must be called while holding the lock, so that no batch is being
+        recorded into the partition
+
+        Args:
+            rel: The relative path of the partition
+
+        Returns:
+            None
+        """
+        if rel == "":
+            return
+        try:
+            os.rmdir(os.path.join(self.path, rel))
+        except OSError:
+            # The partition still contains batches
+            pass
+
+    def report(self) -> None:
+        """
+        Records how far behind the failed upload backlog is
+
+            * **collector_name**.**stream_type**.failed_batches_pending -> The number of batches waiting for replay
+            * **collector_name**.**stream_type**.failed_rows_pending -> The number of rows waiting for replay
+            * **collector_name**.**stream_type**.failed_backlog_seconds -> The age of the oldest pending batch
+
+        Returns:
+            None
+        """
+        with self.lock:
+            batches = len(self.pending)
+            rows = sum(entry["rows"] for entry in self.pending.values())
+            oldest = next(iter(self.pending.values()))["ts"] if batches != 0 else None
+        metrics = get_metrics()
+        metrics.gauge(f"{self.name}.{self.stream_type}.failed_batches_pending", batches)
+        metrics.gauge(f"{self.name}.{self.stream_type}.failed_rows_pending", rows)
+        metrics.gauge(f"{self.name}.{self.stream_type}.failed_backlog_seconds",
+                      0.0 if oldest is None else time.time() - oldest)
@@ -4,10 +4,17 @@ Contains the FileConverter class
 ================================
 """
 import os
+import json
 import pickle
 import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+from concurrent.futures import ThreadPoolExecutor
 from ..app.log import get_logger
-from typing import Optional, Union
+from typing import Iterator, List, Optional, Union
+
+DELTA_READ_ATTEMPTS = 5
+"""int: The number of times a file is loaded again when its deltas are compacted into it while it is being loaded"""
 
 
 class FileConverter(object):
@@ -202,39 +209,11 @@ class FileConverter(object):
         logger = get_logger()
         df = None
         if os.path.isdir(path):
-            files = os.listdir(path)
-            for fname in files:
-                new_df = FileConverter.static_load_df(path=os.path.join(path, fname), fmt=fmt)
-                if df is None:
-                    df = new_df
-                else:
-                    if new_df is not None:
-                        try:
-                            df = df.append(new_df)
-                        except Exception as e:
-                            logger.exception(e)
+            files = FileConverter.static_list_files(path)
+            df = FileConverter.static_load_dfs(paths=[os.path.join(path, fname) for fname in files], fmt=fmt)
             if df is None:
                 return None
-            if move_shards_path is not None:
-                if not os.path.isdir(move_shards_path) and force:
-                    try:
-                        os.makedirs(move_shards_path)
-                    except Exception as e:
-                        logger.exception(e)
-                if os.path.isdir(move_shards_path):
-                    for fname in files:
-                        try:
-                            os.rename(os.path.join(path, fname), os.path.join(move_shards_path, fname))
-                        except Exception as e:
-                            logger.exception(e)
-            else:
-                for fname in files:
-                    try:
-                        os.remove(os.path.join(path, fname))
-                    except FileNotFoundError:
-                        pass
-                    except Exception as e:
-                        logger.exception(e)
+            FileConverter.static_retire_files(path=path, files=files, move_shards_path=move_shards_path, force=force)
             if move_composed_path is not None:
                 if not os.path.isdir(move_composed_path) and force:
                     try:
@@ -252,6 +231,166 @@ class FileConverter(object):
             df = df.reset_index(drop=True)
         return df
 
+    @staticmethod
+    def static_list_files(path: str) -> List[str]:
+        """
+        Lists the files in a directory, ignoring hidden files which are either in progress or metadata, and
+        directories which are partitions
+
+        Args:
+            path: The directory path to list
+
+        Returns:
+            The sorted file names
+        """
+        if not os.path.isdir(path):
+            return []
+        with os.scandir(path) as it:
+            return sorted(entry.name for entry in it if not entry.name.startswith(".") and entry.is_file())
+
+    @staticmethod
+    def static_retire_files(path: str,
+                            files: List[str],
+                            move_shards_path: Optional[str]=None,
+                            force: bool=True) -> None:
+        """
+        Moves files that have been composed to ``move_shards_path``, or deletes them if ``move_shards_path`` is None
+
+        Args:
+            path: The directory path containing the files
+            files: The file names
+            move_shards_path: The path to move the files to
+            force: Forces creation of the directory to move files to if it does not exist
+
+        Returns:
+            None
+        """
+        logger = get_logger()
+        if move_shards_path is not None:
+            if not os.path.isdir(move_shards_path) and force:
+                try:
+                    os.makedirs(move_shards_path)
+                except Exception as e:
+                    logger.exception(e)
+            if os.path.isdir(move_shards_path):
+                for fname in files:
+                    try:
+                        os.rename(os.path.join(path, fname), os.path.join(move_shards_path, fname))
+                    except Exception as e:
+                        logger.exception(e)
+        else:
+            for fname in files:
+                try:
+                    os.remove(os.path.join(path, fname))
+                except FileNotFoundError:
+                    pass
+                except Exception as e:
+                    logger.exception(e)
+
+    @staticmethod
+    def static_iter_df(path: str, fmt: str, batch_size: int) -> Iterator[pd.DataFrame]:
+        """
+        Loads a DataFrame from a file in batches. Parquet files are read one record batch at a time, so only a single
+        batch is held in memory. Files of other formats are loaded whole and then split
+
+        Args:
+            path: The path to the file
+            fmt: The format of the file, see ``static_load_df``
+            batch_size: The maximum number of rows in each batch
+
+        Returns:
+            An iterator of the batches of the file
+        """
+        if fmt == "parquet":
+            try:
+                f = pq.ParquetFile(path)
+            except Exception as e:
+                logger = get_logger()
+                logger.exception(e)
+                return
+            for batch in f.iter_batches(batch_size=batch_size):
+                yield batch.to_pandas()
+            return
+        df = FileConverter.static_load_df(path=path, fmt=fmt)
+        if df is None:
+            return
+        for i in range(0, len(df), batch_size):
+            yield df.iloc[i:i + batch_size]
+
+    @staticmethod
+    def static_load_dfs(paths: List[str], fmt: str, max_workers: int=8) -> Union[pd.DataFrame, None]:
+        """
+        Loads several files in parallel and concatenates them into a single DataFrame
+
+        The files are concatenated once, in the order given, so composing N files copies the data once rather than N
+        times. Columns missing from some of the files are filled with nulls
+
+        Args:
+            paths: The paths to the files
+            fmt: The format of the files, see ``static_load_df``
+            max_workers: The maximum number of files read at the same time
+
+        Returns:
+            The concatenated DataFrame, or None if none of the files could be loaded
+        """
+        logger = get_logger()
+        if len(paths) == 0:
+            return None
+        if fmt == "parquet" and len(paths) > 1:
+            df = FileConverter.parquet_load_many(paths=paths, max_workers=max_workers)
+            if df is not None:
+                return df
+        if len(paths) == 1:
+            frames = [FileConverter.static_load_df(path=paths[0], fmt=fmt)]
+        else:
+            with ThreadPoolExecutor(max_workers=min(max_workers, len(paths))) as executor:
+                frames = list(executor.map(lambda p: FileConverter.static_load_df(path=p, fmt=fmt), paths))
+        frames = [frame for frame in frames if frame is not None]
+        if len(frames) == 0:
+            return None
+        try:
+            return pd.concat(frames, ignore_index=True, sort=False)
+        except Exception as e:
+            logger.exception(e)
+        return None
+
+    @staticmethod
+    def parquet_load_many(paths: List[str], max_workers: int=8) -> Union[pd.DataFrame, None]:
+        """
+        Loads several .parquet files in parallel as arrow tables, unifies their schemas and converts them to a single
+        DataFrame. Arrow releases the GIL while reading, and the data is converted to pandas only once
+
+        Args:
+            paths: The paths to the files
+            max_workers: The maximum number of files read at the same time
+
+        Returns:
+            The concatenated DataFrame, or None if the files could not be combined as arrow tables
+        """
+        logger = get_logger()
+
+        def read(path):
+            try:
+                if os.path.isfile(path):
+                    return pq.read_table(path)
+            except Exception as e:
+                logger.exception(e)
+
+        with ThreadPoolExecutor(max_workers=min(max_workers, len(paths))) as executor:
+            tables = [table for table in executor.map(read, paths) if table is not None]
+        if len(tables) == 0:
+            return None
+        try:
+            if int(pa.__version__.split(".")[0]) >= 14:
+                table = pa.concat_tables(tables, promote_options="default")
+            else:
+                table = pa.concat_tables(tables, promote=True)
+            return table.to_pandas()
+        except Exception as e:
+            # Incompatible column types are left for pandas to combine
+            logger.debug(e)
+        return None
+
     @staticmethod
     def static_store_df(df: pd.DataFrame, path: str, fmt: str) -> bool:
         """
@@ -280,6 +419,32 @@ class FileConverter(object):
             return FileConverter.parquet_store(path, df)
         return False
 
+    @staticmethod
+    def static_replace_df(df: pd.DataFrame, path: str, fmt: str) -> bool:
+        """
+        Stores a DataFrame to a file atomically. The DataFrame is stored to a hidden temporary file in the same
+        directory which then replaces the file, so that readers never see a partially written file
+
+        Args:
+            df: The DataFrame to store to a file
+            path: The path to the file the DataFrame should be stored in
+            fmt: The format to store the DataFrame in, see ``static_store_df``
+
+        Returns:
+            True if successful, else False
+        """
+        dir_path, fname = os.path.split(path)
+        tmp_path = os.path.join(dir_path, f".{fname}.tmp")
+        if not FileConverter.static_store_df(df=df, path=tmp_path, fmt=fmt):
+            return False
+        try:
+            os.replace(tmp_path, path)
+            return True
+        except Exception as e:
+            logger = get_logger()
+            logger.exception(e)
+        return False
+
     @staticmethod
     def pickle_store(path: str, df: pd.DataFrame, force: bool=True) -> bool:
         """
@@ -395,7 +560,10 @@ class FileConverter(object):
         return False
 
     @staticmethod
-    def static_load_df(path: str, fmt: str, dtypes: Optional[dict]=None) -> Union[pd.DataFrame, None]:
+    def static_load_df(path: str,
+                       fmt: str,
+                       dtypes: Optional[dict]=None,
+                       deltas: bool=True) -> Union[pd.DataFrame, None]:
         """
         Loads a DataFrame from a file
 
@@ -409,19 +577,35 @@ class FileConverter(object):
                 * `fmt="csv"` loads the DataFrame using csv format
 
             dtypes: The dtypes to cast the DataFrame to before returning it. I.e. DataFrame.astype(dtypes)
+            deltas: When True, deltas written by a :py:class:`api2db.stream.delta_log.DeltaLog` that have not yet
+                    been compacted into the file are merged into the loaded DataFrame
 
         Returns:
             Loaded DataFrame if successful, otherwise None
         """
         df = None
-        if fmt == "pickle":
-            df = FileConverter.pickle_load(path)
-        elif fmt == "json":
-            df = FileConverter.json_load(path)
-        elif fmt == "csv":
-            df = FileConverter.csv_load(path)
-        elif fmt == "parquet":
-            df = FileConverter.parquet_load(path)
+        for _ in range(DELTA_READ_ATTEMPTS):
+            # List the deltas before loading the file. A delta is only deleted once the file it was compacted into has
+            # replaced the file, so a delta that vanishes before it is loaded means the file must be loaded again
+            files = FileConverter.static_list_deltas(path) if deltas else []
+            if fmt == "pickle":
+                df = FileConverter.pickle_load(path)
+            elif fmt == "json":
+                df = FileConverter.json_load(path)
+            elif fmt == "csv":
+                df = FileConverter.csv_load(path)
+            elif fmt == "parquet":
+                df = FileConverter.parquet_load(path)
+            if len(files) == 0:
+                break
+            try:
+                df = FileConverter.static_merge_deltas(df=df, path=path, fmt=fmt, files=files)
+                break
+            except FileNotFoundError:
+                df = None
+        else:
+            logger = get_logger()
+            logger.warning(f"{path} was compacted {DELTA_READ_ATTEMPTS} times while being loaded")
         if df is not None and dtypes is not None:
             try:
                 df = df.astype(dtypes)
@@ -433,6 +617,78 @@ class FileConverter(object):
             df = df.reset_index(drop=True)
         return df
 
+    @staticmethod
+    def static_delta_dir(path: str) -> str:
+        """
+        Args:
+            path: The path to a file
+
+        Returns:
+            The directory that deltas to the file are stored in
+        """
+        return f"{path}.deltas"
+
+    @staticmethod
+    def static_list_deltas(path: str) -> List[str]:
+        """
+        Lists the deltas to a file that have not yet been compacted into it
+
+        Args:
+            path: The path to the file
+
+        Returns:
+            The file names of the deltas, oldest first
+        """
+        dir_path = FileConverter.static_delta_dir(path)
+        if not os.path.isdir(dir_path):
+            return []
+        files = [f for f in os.listdir(dir_path) if not f.startswith(".") and f.split(".")[0].isdigit()]
+        return sorted(files, key=lambda f: int(f.split(".")[0]))
+
+    @staticmethod
+    def static_merge_deltas(df: Optional[pd.DataFrame],
+                            path: str,
+                            fmt: str,
+                            files: Optional[List[str]]=None) -> Union[pd.DataFrame, None]:
+        """
+        Merges the deltas to a file into a DataFrame loaded from the file. For each set of keys recorded with the
+        deltas, the most recently written row is kept
+
+        Args:
+            df: The DataFrame loaded from the file, or None if the file does not exist
+            path: The path to the file
+            fmt: The format of the deltas
+            files: The file names of the deltas to merge, defaults to every delta
+
+        Returns:
+            The merged DataFrame, or None if there is nothing to load
+
+        Raises:
+            FileNotFoundError if one of the deltas was deleted, I.e. compacted into the file, before it was loaded
+        """
+        dir_path = FileConverter.static_delta_dir(path)
+        keys = None
+        try:
+            with open(os.path.join(dir_path, ".meta.json"), "r") as f:
+                keys = json.load(f).get("keys")
+        except (OSError, ValueError):
+            pass
+        if files is None:
+            files = FileConverter.static_list_deltas(path)
+        frames = [] if df is None else [df]
+        for fname in files:
+            delta_path = os.path.join(dir_path, fname)
+            delta = FileConverter.static_load_df(path=delta_path, fmt=fmt, deltas=False)
+            if delta is None and not os.path.isfile(delta_path):
+                raise FileNotFoundError(delta_path)
+            if delta is not None:
+                frames.append(delta)
+        if len(frames) == 0:
+            return None
+        if len(frames) == 1:
+            return frames[0]
+        return pd.concat(frames, ignore_index=True).drop_duplicates(subset=keys, keep="last")
+
     @staticmethod
     def pickle_load(path: str) -> Union[pd.DataFrame, None]:
         """
@@ -0,0 +1,154 @@
+# -*- coding: utf-8 -*-
+"""
+Contains the HashSet class and the hash_rows function
+=====================================================
+
+NOTE:
+
+    A HashSet holds 64-bit row hashes produced by ``hash_rows``. Up to ``max_memory`` hashes are held in memory. Beyond
+    that the hashes are spilled to a SQLite file on disk, so the memory used to deduplicate data stays fixed no matter
+    how much data is deduplicated.
+"""
+from ..app.log import get_logger
+import numpy as np
+import pandas as pd
+import sqlite3
+import os
+import tempfile
+from typing import List, Optional
+
+
+def hash_rows(df: pd.DataFrame, subset: Optional[List[str]]=None) -> np.ndarray:
+    """
+    Hashes each row of a DataFrame
+
+    Args:
+        df: The DataFrame to hash
+        subset: The columns to hash, defaults to every column
+
+    Returns:
+        An array of one unsigned 64-bit hash per row
+    """
+    if subset is not None:
+        df = df[list(subset)]
+    return pd.util.hash_pandas_object(df, index=False).to_numpy(dtype=np.uint64)
+
+
+class HashSet(object):
+    """A set of row hashes that spills to disk once it grows beyond a fixed number of hashes"""
+
+    def __init__(self, path: Optional[str]=None, max_memory: int=1000000):
+        """
+        Creates an empty HashSet object
+
+        Args:
+            path: The path to the SQLite file hashes are spilled to, defaults to a temporary file that is removed when
+                  the set is closed
+            max_memory: The number of hashes held in memory before they are spilled to disk
+        """
+        self.path = path
+        self.temporary = path is None
+        """bool: True if the spill file is removed when the set is closed"""
+        self.max_memory = max_memory
+        self.memory = set()
+        """set: The hashes held in memory"""
+        self.con = None
+        """Optional[sqlite3.Connection]: The connection to the spill file, opened once the set first spills"""
+
+    def connect(self) -> sqlite3.Connection:
+        """
+        Opens the spill file, creating it if it does not exist
+
+        Returns:
+            The connection to the spill file
+        """
+        if self.con is None:
+            if self.path is None:
+                fd, self.path = tempfile.mkstemp(suffix=".sqlite")
+                os.close(fd)
+            self.con = sqlite3.connect(self.path, check_same_thread=False)
+            self.con.execute("PRAGMA journal_mode=WAL")
+            self.con.execute("PRAGMA synchronous=NORMAL")
+            self.con.execute("CREATE TABLE IF NOT EXISTS hashes (h INTEGER PRIMARY KEY)")
+            self.con.commit()
+        return self.con
+
+    def spilled(self, hashes: np.ndarray) -> np.ndarray:
+        """
+        Determines which hashes have been spilled to disk
+
+        Args:
+            hashes: The hashes to look up
+
+        Returns:
+            A boolean array that is True for each hash present on disk
+        """
+        res = np.zeros(len(hashes), dtype=bool)
+        if self.con is None or len(hashes) == 0:
+            return res
+        signed = hashes.view(np.int64)
+        found = set()
+        # SQLite limits the number of parameters in a single statement
+        for i in range(0, len(signed), 500):
+            chunk = [int(h) for h in signed[i:i + 500]]
+            query = f"SELECT h FROM hashes WHERE h IN ({','.join('?' * len(chunk))})"
+            found.update(row[0] for row in self.con.execute(query, chunk))
+        if len(found) != 0:
+            res = np.fromiter((int(h) in found for h in signed), dtype=bool, count=len(signed))
+        return res
+
+    def spill(self) -> None:
+        """
+        Moves the hashes held in memory to disk
+
+        Returns:
+            None
+        """
+        logger = get_logger()
+        con = self.connect()
+        logger.debug(f"spilling {len(self.memory)} hashes to {self.path}")
+        signed = np.fromiter(self.memory, dtype=np.uint64, count=len(self.memory)).view(np.int64)
+        con.executemany("INSERT OR IGNORE INTO hashes (h) VALUES (?)", ((int(h), ) for h in signed))
+        con.commit()
+        self.memory = set()
+
+    def add_new(self, hashes: np.ndarray) -> np.ndarray:
+        """
+        Adds hashes to the set
+
+        Args:
+            hashes: The hashes to add
+
+        Returns:
+            A boolean array that is True for each hash that was not already in the set, counting only the first
+            occurrence of hashes repeated within ``hashes``
+        """
+        hashes = np.asarray(hashes, dtype=np.uint64)
+        new = ~pd.Series(hashes).duplicated().to_numpy()
+        new &= np.fromiter((int(h) not in self.memory for h in hashes), dtype=bool, count=len(hashes))
+        new[new] = ~self.spilled(hashes[new])
+        self.memory.update(int(h) for h in hashes[new])
+        if len(self.memory) >= self.max_memory:
+            self.spill()
+        return new
+
+    def close(self) -> None:
+        """
+        Closes the spill file, removing it if it is temporary
+
+        Returns:
+            None
+        """
+        logger = get_logger()
+        if self.con is not None:
+            self.con.close()
+            self.con = None
+        if self.temporary and self.path is not None:
+            for path in (self.path, f"{self.path}-wal", f"{self.path}-shm"):
+                try:
+                    if os.path.isfile(path):
+                        os.remove(path)
+                except Exception as e:
+                    logger.exception(e)
+            self.path = None
+        self.memory = set()
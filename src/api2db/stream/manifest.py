@@ -0,0 +1,254 @@
+# -*- coding: utf-8 -*-
+"""
+Contains the ShardManifest class
+================================
+
+NOTE:
+
+    A ShardManifest records every shard written to a directory in the SQLite file ``.manifest.sqlite`` within the
+    directory. For each shard it records
+
+        * file -> The path of the shard relative to the directory, including its partition
+        * partition -> The relative path of the partition of the shard, ``""`` if the directory is not partitioned
+        * rows -> The number of rows in the shard
+        * bytes -> The size of the shard in bytes
+        * schema -> A fingerprint of the schema of the shard
+        * status -> ``"new"``, ``"uploading"``, ``"uploaded"`` or ``"corrupt"``
+
+    A :py:class:`api2db.stream.stream2local.Stream2Local` with `manifest=True` registers each shard once it has been
+    written, and a :py:class:`api2db.store.store.Store` with `manifest=True` finds its work by querying the manifest
+    rather than listing the directory. Each shard is marked ``"uploading"`` before it is uploaded and ``"uploaded"``
+    once it has been handed to the storage target, and is removed from the manifest once it has been moved or deleted.
+    A store that crashes after uploading a shard but before moving it only moves the shard when it restarts, rather
+    than uploading it again.
+
+    Shards written by anything that does not register them are picked up when the store reconciles the manifest with
+    the directory, which it does periodically rather than on every storage cycle.
+
+    Shards that cannot be read, or whose data does not match the dtypes of the store, are marked ``"corrupt"`` and kept
+    in the directory for inspection. They are no longer returned as pending work.
+"""
+from .partitions import PartitionIndex
+from ..app.log import get_logger
+from threading import Lock as ThreadLock
+import pyarrow as pa
+import pyarrow.parquet as pq
+import pandas as pd
+import hashlib
+import sqlite3
+import os
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional
+
+
+class ShardManifest(object):
+    """Records the shards written to a directory and their upload status"""
+
+    def __init__(self, path: str):
+        """
+        Creates a ShardManifest object. The manifest file is opened lazily upon first use
+
+        Args:
+            path: The directory the shards are written to
+        """
+        self.path = path
+        self.db_path = os.path.join(path, ".manifest.sqlite")
+        """str: The path to the manifest file"""
+        self.con = None
+        self.lock = ThreadLock()
+
+    @staticmethod
+    def schema_version(schema: pa.Schema) -> str:
+        """
+        Fingerprints a schema, ignoring its metadata
+
+        Args:
+            schema: The schema to fingerprint
+
+        Returns:
+            A 16 character fingerprint of the schema
+        """
+        return hashlib.sha1(schema.remove_metadata().to_string().encode()).hexdigest()[:16]
+
+    @staticmethod
+    def df_schema_version(df: pd.DataFrame) -> Optional[str]:
+        """
+        Fingerprints the schema a DataFrame is stored with
+
+        Args:
+            df: The DataFrame to fingerprint
+
+        Returns:
+            A 16 character fingerprint of the schema, or None if the DataFrame cannot be represented in arrow
+        """
+        try:
+            return ShardManifest.schema_version(pa.Schema.from_pandas(df, preserve_index=False))
+        except Exception:
+            return None
+
+    def connect(self) -> sqlite3.Connection:
+        """
+        Opens the manifest file, creating it if it does not exist. Must be called while holding the lock
+
+        Returns:
+            The connection to the manifest file
+        """
+        if self.con is None:
+            if not os.path.isdir(self.path):
+                os.makedirs(self.path)
+            # The stream writing shards and the store uploading them may run in different processes
+            self.con = sqlite3.connect(self.db_path, timeout=30.0, check_same_thread=False)
+            self.con.execute("PRAGMA journal_mode=WAL")
+            self.con.execute("PRAGMA synchronous=NORMAL")
+            self.con.execute("CREATE TABLE IF NOT EXISTS shards ("
+                             "file TEXT PRIMARY KEY, "
+                             "partition TEXT NOT NULL, "
+                             "rows INTEGER, "
+                             "bytes INTEGER, "
+                             "schema TEXT, "
+                             "status TEXT NOT NULL, "
+                             "added REAL NOT NULL, "
+                             "updated REAL NOT NULL)")
+            self.con.execute("CREATE INDEX IF NOT EXISTS ix_shards_status ON shards (status)")
+            self.con.commit()
+        return self.con
+
+    def register(self, file: str, rows: Optional[int], size: Optional[int], schema: Optional[str]) -> None:
+        """
+        Registers a shard that has been written
+
+        Args:
+            file: The path of the shard relative to the directory
+            rows: The number of rows in the shard
+            size: The size of the shard in bytes
+            schema: The fingerprint of the schema of the shard
+
+        Returns:
+            None
+        """
+        now = time.time()
+        with self.lock:
+            con = self.connect()
+            con.execute("INSERT OR IGNORE INTO shards VALUES (?, ?, ?, ?, ?, 'new', ?, ?)",
+                        (file, os.path.dirname(file), rows, size, schema, now, now))
+            con.commit()
+
+    def register_file(self, path: str) -> None:
+        """
+        Registers a shard that has been written, reading its row count and schema from its footer if it is a
+        .parquet file
+
+        Args:
+            path: The path to the shard
+
+        Returns:
+            None
+        """
+        rows, schema = None, None
+        if path.endswith(".parquet"):
+            try:
+                metadata = pq.read_metadata(path)
+                rows = metadata.num_rows
+                schema = ShardManifest.schema_version(metadata.schema.to_arrow_schema())
+            except Exception as e:
+                logger = get_logger()
+                logger.exception(e)
+        self.register(file=os.path.relpath(path, self.path), rows=rows, size=os.path.getsize(path), schema=schema)
+
+    def pending(self) -> Dict[str, List[dict]]:
+        """
+        Finds the shards that have not yet been moved or deleted, excluding shards marked as corrupt
+
+        Returns:
+            A dictionary mapping each partition to its shards, oldest first
+        """
+        res = OrderedDict()
+        with self.lock:
+            con = self.connect()
+            rows = con.execute("SELECT file, partition, rows, bytes, schema, status FROM shards "
+                               "WHERE status != 'corrupt' ORDER BY partition, file").fetchall()
+        for file, partition, n, size, schema, status in rows:
+            res.setdefault(partition, []).append({"file": file,
+                                                  "rows": n,
+                                                  "bytes": size,
+                                                  "schema": schema,
+                                                  "status": status})
+        return res
+
+    def mark(self, files: List[str], status: str) -> None:
+        """
+        Sets the upload status of shards
+
+        Args:
+            files: The paths of the shards relative to the directory
+            status: The upload status, either ``"new"``, ``"uploading"``, ``"uploaded"`` or ``"corrupt"``
+
+        Returns:
+            None
+        """
+        if len(files) == 0:
+            return
+        now = time.time()
+        with self.lock:
+            con = self.connect()
+            con.executemany("UPDATE shards SET status = ?, updated = ? WHERE file = ?",
+                            [(status, now, file) for file in files])
+            con.commit()
+
+    def remove(self, files: List[str]) -> None:
+        """
+        Removes shards that have been moved or deleted from the manifest
+
+        Args:
+            files: The paths of the shards relative to the directory
+
+        Returns:
+            None
+        """
+        if len(files) == 0:
+            return
+        with self.lock:
+            con = self.connect()
+            con.executemany("DELETE FROM shards WHERE file = ?", [(file, ) for file in files])
+            con.commit()
+
+    def reconcile(self, index: PartitionIndex) -> int:
+        """
+        Registers shards present in the directory that are missing from the manifest, and removes shards from the
+        manifest that are no longer present in the directory
+
+        Args:
+            index: The PartitionIndex of the directory
+
+        Returns:
+            The number of shards registered
+        """
+        with self.lock:
+            con = self.connect()
+            known = {file for (file, ) in con.execute("SELECT file FROM shards")}
+        present = set()
+        count = 0
+        for rel in index.scan():
+            with os.scandir(os.path.join(self.path, rel)) as it:
+                files = [entry.name for entry in it if not entry.name.startswith(".") and entry.is_file()]
+            for fname in files:
+                file = os.path.join(rel, fname)
+                present.add(file)
+                if file not in known:
+                    self.register_file(os.path.join(self.path, file))
+                    count += 1
+        self.remove([file for file in known if file not in present])
+        return count
+
+    def close(self) -> None:
+        """
+        Closes the manifest file
+
+        Returns:
+            None
+        """
+        with self.lock:
+            if self.con is not None:
+                self.con.close()
+            self.con = None
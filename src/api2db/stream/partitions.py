@@ -0,0 +1,167 @@
+# -*- coding: utf-8 -*-
+"""
+Contains the partition_df function and the PartitionIndex class
+===============================================================
+
+NOTE:
+
+    Streams and stores may partition the files in a directory Hive-style, with one nested directory per partition key
+
+    ::
+
+        STORE/collector_name/parquet/
+        |                           |- date=2026-10-17/
+        |                                             |- hour=13/
+        |                                             |         |- 1634482800000.parquet
+        |                                             |         |- 1634482810000.parquet
+        |                                             |- hour=14/
+        |                                                       |- 1634486400000.parquet
+
+    The partition keys ``"date"`` and ``"hour"`` partition data by the UTC time it was ingested. Any other partition key
+    is the name of a column, and data is partitioned by the value of that column. Partition columns are kept in the
+    stored files, so files can be read without knowing how they were partitioned.
+
+    A :py:class:`PartitionIndex` finds the partitions of a directory that contain files while only listing the
+    directories that have changed since they were last scanned.
+"""
+from urllib.parse import quote
+import pandas as pd
+import os
+import time
+from typing import Iterator, List, Optional, Tuple
+
+
+NULL_PARTITION = "__HIVE_DEFAULT_PARTITION__"
+"""str: The partition value used for null column values"""
+
+
+def partition_value(value) -> str:
+    """
+    Formats a column value so that it can be used as a directory name
+
+    Args:
+        value: The value of the column
+
+    Returns:
+        The formatted value
+    """
+    if value is None or value is pd.NA or (isinstance(value, float) and value != value):
+        return NULL_PARTITION
+    return quote(str(value), safe="")
+
+
+def partition_df(df: pd.DataFrame,
+                 partition_by: List[str],
+                 ts: Optional[float]=None) -> List[Tuple[str, pd.DataFrame]]:
+    """
+    Splits a DataFrame into its partitions
+
+    Args:
+        df: The DataFrame to split
+        partition_by: The partition keys, in the order of nesting. ``"date"`` and ``"hour"`` partition by ingest time,
+                      any other key is a column name
+        ts: The ingest time, defaults to the current time
+
+    Returns:
+        A list of (relative partition path, DataFrame) for each non-empty partition
+    """
+    if len(df) == 0:
+        return []
+    ts = time.time() if ts is None else ts
+    columns = [key for key in partition_by if key not in ("date", "hour")]
+    if len(columns) == 0:
+        groups = [((), df)]
+    else:
+        groups = []
+        for values, group in df.groupby(columns, sort=False, dropna=False):
+            groups.append((values if isinstance(values, tuple) else (values, ), group))
+    res = []
+    for values, group in groups:
+        values = dict(zip(columns, values))
+        parts = []
+        for key in partition_by:
+            if key == "date":
+                parts.append(f"date={time.strftime('%Y-%m-%d', time.gmtime(ts))}")
+            elif key == "hour":
+                parts.append(f"hour={time.strftime('%H', time.gmtime(ts))}")
+            else:
+                parts.append(f"{key}={partition_value(values[key])}")
+        res.append((os.path.join(*parts) if len(parts) != 0 else "", group))
+    return res
+
+
+class PartitionIndex(object):
+    """Finds the partitions of a directory that contain files, only listing the directories that have changed"""
+
+    def __init__(self, path: str):
+        """
+        Creates a PartitionIndex object
+
+        Args:
+            path: The root directory of the partitions
+        """
+        self.path = path
+        self.cache = {}
+        """dict: Maps the relative path of each scanned directory to (mtime_ns, partition subdirectories, has_files)"""
+
+    def scan(self) -> List[str]:
+        """
+        Finds the partitions containing files. The root directory is included as ``""`` if it contains files
+
+        Returns:
+            The relative paths of the partitions containing files
+        """
+        return list(self.walk(""))
+
+    def walk(self, rel: str) -> Iterator[str]:
+        """
+        Recursively finds the partitions containing files below a directory
+
+        Args:
+            rel: The relative path of the directory
+
+        Returns:
+            An iterator of the relative paths of the partitions containing files
+        """
+        full = os.path.join(self.path, rel)
+        try:
+            mtime = os.stat(full).st_mtime_ns
+        except OSError:
+            self.forget(rel)
+            return
+        cached = self.cache.get(rel)
+        # A directory modified within the resolution of its timestamp may change again without its mtime changing
+        if cached is not None and cached[0] == mtime and int(time.time() * 1e9) - mtime > 2000000000:
+            subdirs, has_files = cached[1], cached[2]
+        else:
+            subdirs, has_files = [], False
+            with os.scandir(full) as it:
+                for entry in it:
+                    if entry.name.startswith("."):
+                        continue
+                    if entry.is_dir() and "=" in entry.name:
+                        subdirs.append(entry.name)
+                    elif entry.is_file():
+                        has_files = True
+            for name in (cached[1] if cached is not None else []):
+                if name not in subdirs:
+                    self.forget(os.path.join(rel, name))
+            self.cache[rel] = (mtime, sorted(subdirs), has_files)
+        if has_files:
+            yield rel
+        for name in sorted(subdirs):
+            yield from self.walk(os.path.join(rel, name))
+
+    def forget(self, rel: str) -> None:
+        """
+        Removes a directory and the directories below it from the cache
+
+        Args:
+            rel: The relative path of the directory
+
+        Returns:
+            None
+        """
+        prefix = os.path.join(rel, "")
+        for key in [key for key in self.cache if key == rel or key.startswith(prefix)]:
+            self.cache.pop(key)
@@ -0,0 +1,147 @@
+# -*- coding: utf-8 -*-
+"""
+Contains the RetryPolicy and CircuitBreaker classes
+===================================================
+
+Summary of Retry Usage:
+-----------------------
+
+Every Stream owns a RetryPolicy and a CircuitBreaker. When a sink fails to accept a batch, the batch is placed into
+the streams retry lane and attempted again after an exponentially growing, jittered delay. Once a sink has failed
+``failure_threshold`` times in a row the breaker opens, and batches are sent directly to the retry lane without
+contacting the sink until ``reset_timeout`` seconds have passed. A single probe batch is then allowed through, closing
+the breaker if it succeeds, or re-opening it with a doubled timeout if it fails.
+
+::
+
+    stream = Stream2Sql(...)
+    stream.retry_policy = RetryPolicy(base=2.0, cap=120.0, max_attempts=8)
+    stream.breaker = CircuitBreaker(failure_threshold=3, reset_timeout=60.0)
+"""
+from threading import Lock as ThreadLock
+import random
+import time
+
+
+class RetryPolicy(object):
+    """Computes exponential backoff delays with full jitter"""
+
+    def __init__(self, base: float=1.0, cap: float=300.0, max_attempts: int=5, jitter: bool=True):
+        """
+        Creates a RetryPolicy object
+
+        Args:
+            base: The delay in seconds before the first retry
+            cap: The maximum delay in seconds between two attempts
+            max_attempts: The number of retries before a batch is stored locally in
+                          STORE/upload_failed/**collector_name**/**stream_type**/
+            jitter: When True the delay is drawn uniformly from ``[0, delay]`` so that sinks recovering from an outage
+                    are not hit by every stream at once
+        """
+        self.base = base
+        self.cap = cap
+        self.max_attempts = max_attempts
+        self.jitter = jitter
+
+    def delay(self, attempt: int) -> float:
+        """
+        Yields the number of seconds to wait before performing an attempt
+
+        Args:
+            attempt: The number of attempts that have already failed
+
+        Returns:
+            The delay in seconds
+        """
+        delay = min(self.cap, self.base * 2 ** max(attempt - 1, 0))
+        if self.jitter:
+            delay = random.uniform(0, delay)
+        return delay
+
+
+class CircuitBreaker(object):
+    """Stops a stream from contacting a sink that is known to be down"""
+
+    CLOSED = "closed"
+    """str: Requests flow to the sink"""
+    OPEN = "open"
+    """str: Requests are rejected without contacting the sink"""
+    HALF_OPEN = "half_open"
+    """str: A single probe request is in flight"""
+
+    def __init__(self, failure_threshold: int=5, reset_timeout: float=30.0, max_reset_timeout: float=600.0):
+        """
+        Creates a CircuitBreaker object
+
+        Args:
+            failure_threshold: The number of consecutive failures that opens the breaker
+            reset_timeout: The number of seconds the breaker stays open before a probe request is allowed
+            max_reset_timeout: The upper bound of the reset timeout, which doubles every time a probe fails
+        """
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.max_reset_timeout = max_reset_timeout
+        self.state = CircuitBreaker.CLOSED
+        """str: The current state of the breaker"""
+        self.failures = 0
+        """int: The number of consecutive failures"""
+        self.timeout = reset_timeout
+        """float: The current reset timeout"""
+        self.opened_at = 0.0
+        """float: The time the breaker was last opened"""
+        self.lock = ThreadLock()
+
+    def allow(self) -> bool:
+        """
+        Determines if a request should be sent to the sink
+
+        Returns:
+            True if the request should be attempted otherwise False
+        """
+        with self.lock:
+            if self.state == CircuitBreaker.CLOSED:
+                return True
+            if self.state == CircuitBreaker.OPEN and time.time() >= self.opened_at + self.timeout:
+                self.state = CircuitBreaker.HALF_OPEN
+                return True
+            return False
+
+    def retry_at(self) -> float:
+        """
+        Yields the time at which the breaker will next allow a request
+
+        Returns:
+            A timestamp in seconds
+        """
+        if self.state == CircuitBreaker.CLOSED:
+            return time.time()
+        return self.opened_at + self.timeout
+
+    def record_success(self) -> None:
+        """
+        Records a successful request, closing the breaker
+
+        Returns:
+            None
+        """
+        with self.lock:
+            self.state = CircuitBreaker.CLOSED
+            self.failures = 0
+            self.timeout = self.reset_timeout
+
+    def record_failure(self) -> None:
+        """
+        Records a failed request, opening the breaker if the failure threshold is reached or the probe failed
+
+        Returns:
+            None
+        """
+        with self.lock:
+            self.failures += 1
+            if self.state == CircuitBreaker.HALF_OPEN:
+                self.timeout = min(self.timeout * 2, self.max_reset_timeout)
+                self.state = CircuitBreaker.OPEN
+                self.opened_at = time.time()
+            elif self.failures >= self.failure_threshold:
+                self.state = CircuitBreaker.OPEN
+                self.opened_at = time.time()
@@ -0,0 +1,160 @@
+# -*- coding: utf-8 -*-
+"""
+Contains the RollingParquetWriter class
+=======================================
+
+NOTE:
+
+    The RollingParquetWriter keeps a single parquet file open and appends each incoming batch to it as a row group.
+    While a file is being written it is named ``.timestamp_ms.parquet.inprogress``, and is hidden from anything that
+    composes the directory. Once the file reaches ``max_bytes`` bytes, ``max_rows`` rows, or has been open for
+    ``max_seconds`` seconds its footer is written and it is atomically renamed to ``timestamp_ms.parquet``, so readers
+    only ever see complete files.
+
+    A file left in progress by a process that crashed has no footer, so its row groups cannot be read. Such files are
+    removed by the next writer for the same directory, and the rows written to them are lost. Enable the write-ahead log
+    of the collector, with ``wal=True``, for those rows to be replayed instead.
+"""
+from ..app.log import get_logger
+import pyarrow as pa
+import pyarrow.parquet as pq
+import pandas as pd
+import os
+import time
+from typing import Optional
+
+
+class RollingParquetWriter(object):
+    """Appends batches to a parquet file as row groups, rotating the file by size, row count or age"""
+
+    def __init__(self, path: str, max_bytes: int=134217728, max_rows: int=1000000, max_seconds: int=300):
+        """
+        Creates a RollingParquetWriter object and removes files left in progress by a previous process
+
+        Args:
+            path: The directory to write the files to
+            max_bytes: The size in bytes at which a file is finalized
+            max_rows: The number of rows at which a file is finalized
+            max_seconds: The number of seconds after which an open file is finalized
+        """
+        self.path = path
+        self.max_bytes = max_bytes
+        self.max_rows = max_rows
+        self.max_seconds = max_seconds
+        self.writer = None
+        """Optional[pyarrow.parquet.ParquetWriter]: The writer of the file currently open"""
+        self.schema = None
+        """Optional[pyarrow.Schema]: The schema of the file currently open"""
+        self.tmp_path = None
+        """Optional[str]: The path of the file currently open"""
+        self.final_path = None
+        """Optional[str]: The path the file currently open will be renamed to once it is finalized"""
+        self.rows = 0
+        """int: The number of rows in the file currently open"""
+        self.opened_at = 0.0
+        """float: The time the file currently open was opened"""
+        self.last_ts = 0
+        self.clear_in_progress()
+
+    def clear_in_progress(self) -> None:
+        """
+        Removes files left in progress by a process that did not finalize them. Files without a footer cannot be read
+
+        Returns:
+            None
+        """
+        logger = get_logger()
+        if not os.path.isdir(self.path):
+            return
+        for fname in os.listdir(self.path):
+            if fname.endswith(".inprogress"):
+                logger.error(f"removing unfinalized file {os.path.join(self.path, fname)}, rows written to it are "
+                             f"lost unless the collector has a write-ahead log")
+                try:
+                    os.remove(os.path.join(self.path, fname))
+                except Exception as e:
+                    logger.exception(e)
+
+    def is_open(self) -> bool:
+        """
+        Returns:
+            True if a file is currently open otherwise False
+        """
+        return self.writer is not None
+
+    def due(self) -> bool:
+        """
+        Determines if the file currently open should be finalized
+
+        Returns:
+            True if the file should be finalized otherwise False
+        """
+        if self.writer is None:
+            return False
+        return (self.rows >= self.max_rows or
+                os.path.getsize(self.tmp_path) >= self.max_bytes or
+                time.time() - self.opened_at >= self.max_seconds)
+
+    def open(self, schema: pa.Schema) -> None:
+        """
+        Opens a new file
+
+        Args:
+            schema: The schema of the file
+
+        Returns:
+            None
+        """
+        if not os.path.isdir(self.path):
+            os.makedirs(self.path)
+        # File names must be unique even if files are rotated within the same millisecond
+        ts = max(int(time.time() * 1000.0), self.last_ts + 1)
+        self.last_ts = ts
+        self.final_path = os.path.join(self.path, f"{ts}.parquet")
+        self.tmp_path = os.path.join(self.path, f".{ts}.parquet.inprogress")
+        self.writer = pq.ParquetWriter(self.tmp_path, schema)
+        self.schema = schema
+        self.rows = 0
+        self.opened_at = time.time()
+
+    def write(self, df: pd.DataFrame) -> Optional[str]:
+        """
+        Appends a batch to the file currently open as a row group, opening a new file if none is open or if the
+        schema of the batch differs from the schema of the file
+
+        The file is not finalized after writing, even if it is due. Call ``due`` and ``rotate`` to finalize it.
+
+        Args:
+            df: The batch to write
+
+        Returns:
+            The path of the file finalized before writing the batch because the schema changed, otherwise None
+        """
+        table = pa.Table.from_pandas(df, preserve_index=False)
+        path = None
+        if self.writer is not None and not self.schema.equals(table.schema):
+            path = self.rotate()
+        if self.writer is None:
+            self.open(table.schema)
+        self.writer.write_table(table)
+        self.rows += len(df)
+        return path
+
+    def rotate(self) -> Optional[str]:
+        """
+        Finalizes the file currently open and atomically renames it so that it becomes visible
+
+        Returns:
+            The path of the finalized file, or None if no file was open
+        """
+        if self.writer is None:
+            return None
+        self.writer.close()
+        os.replace(self.tmp_path, self.final_path)
+        path = self.final_path
+        self.writer = None
+        self.schema = None
+        self.tmp_path = None
+        self.final_path = None
+        self.rows = 0
+        return path
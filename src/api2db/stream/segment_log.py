@@ -0,0 +1,279 @@
+# -*- coding: utf-8 -*-
+"""
+Contains the SegmentLog class
+=============================
+
+NOTE:
+
+    The SegmentLog is an optional write-ahead log that sits between a collector and its streams. It is enabled by
+    passing ``wal=True`` to a :py:class:`api2db.ingest.collector.Collector`.
+
+    Each batch of data extracted by the collector is appended to the log exactly once, and is identified by its
+    offset. Each stream of the collector keeps its own committed offset, which only moves forward once every batch up
+    to it has either been uploaded or stored locally in STORE/upload_failed/. Should the collector process crash or
+    be restarted, every stream resumes from its committed offset, giving at-least-once delivery without re-polling
+    the API.
+
+    The log is stored in the following directory structure
+
+    ::
+
+        STORE/wal/collector_name/
+        |                       |- 00000000000000000000.arrow
+        |                       |- 00000000000000001734.arrow
+        |                       |- offsets/
+        |                                 |- sql.postgresql.json
+        |                                 |- local.parquet.json
+
+    Each segment is an Arrow IPC stream named after the offset of its first batch. A new segment is started when the
+    current segment exceeds ``segment_bytes``, when the schema of the data changes, or when the process restarts.
+    Segments are deleted once every stream has committed past them.
+"""
+from ..app.log import get_logger
+from threading import Lock as ThreadLock
+import pyarrow as pa
+import pandas as pd
+import json
+import os
+from typing import Iterator, List, Optional, Tuple
+
+
+class SegmentLog(object):
+    """Append-only log of the batches extracted by a collector"""
+
+    def __init__(self, name: str, path: Optional[str]=None, segment_bytes: int=67108864, fsync: bool=False):
+        """
+        Creates a SegmentLog object and recovers the next offset from existing segments
+
+        Args:
+            name: The name of the collector the log is associated with
+            path: The directory to store the log in, defaults to STORE/wal/**collector_name**/
+            segment_bytes: The size in bytes a segment may reach before a new segment is started
+            fsync: When True each append is synced to disk, surviving operating system crashes as well as process
+                   crashes at the cost of write latency
+        """
+        self.name = name
+        self.path = os.path.join("STORE", "wal", name) if path is None else path
+        self.offsets_path = os.path.join(self.path, "offsets")
+        self.segment_bytes = segment_bytes
+        self.fsync = fsync
+        self.keys = set()
+        """set: The keys of the streams reading from the log"""
+        self.lock = ThreadLock()
+        self.sink = None
+        """Optional[pyarrow.OSFile]: The file of the segment currently being written"""
+        self.writer = None
+        """Optional[pyarrow.ipc.RecordBatchStreamWriter]: The writer of the segment currently being written"""
+        self.writer_schema = None
+        """Optional[pyarrow.Schema]: The schema of the segment currently being written"""
+        if not os.path.isdir(self.offsets_path):
+            os.makedirs(self.offsets_path)
+        self.next_offset = self.recover()
+        """int: The offset the next appended batch will be given"""
+
+    def segments(self) -> List[Tuple[int, str]]:
+        """
+        Lists the segments of the log
+
+        Returns:
+            A list of (first_offset, path) for each segment, ordered by offset
+        """
+        res = []
+        for fname in os.listdir(self.path):
+            if fname.endswith(".arrow"):
+                res.append((int(fname.split(".")[0]), os.path.join(self.path, fname)))
+        return sorted(res)
+
+    @staticmethod
+    def read_segment(path: str) -> Iterator[pa.RecordBatch]:
+        """
+        Reads the batches of a segment, stopping at a truncated tail left by a crash
+
+        Args:
+            path: The path to the segment
+
+        Returns:
+            An iterator of the batches in the segment
+        """
+        try:
+            with pa.OSFile(path, "rb") as f:
+                reader = pa.ipc.open_stream(f)
+                while True:
+                    try:
+                        yield reader.read_next_batch()
+                    except StopIteration:
+                        return
+        except (pa.ArrowInvalid, OSError):
+            return
+
+    def recover(self) -> int:
+        """
+        Determines the next offset from the last segment of the log
+
+        Returns:
+            The offset that follows the last batch in the log
+        """
+        segments = self.segments()
+        if len(segments) == 0:
+            return max([self.committed(key[:-5]) for key in os.listdir(self.offsets_path) if key.endswith(".json")],
+                       default=-1) + 1
+        first, path = segments[-1]
+        return first + sum(1 for _ in SegmentLog.read_segment(path))
+
+    def register(self, key: str) -> Tuple[int, int]:
+        """
+        Registers a stream as a reader of the log
+
+        Args:
+            key: The key the stream commits its offset with
+
+        Returns:
+            The committed offset of the stream and the next offset to be appended. Batches between the two must be
+            replayed from the log
+        """
+        with self.lock:
+            self.keys.add(key)
+            return self.committed(key), self.next_offset
+
+    def append(self, df: pd.DataFrame) -> int:
+        """
+        Appends a batch to the log
+
+        Args:
+            df: The batch to append
+
+        Returns:
+            The offset of the batch
+        """
+        batch = pa.RecordBatch.from_pandas(df, preserve_index=False)
+        with self.lock:
+            if (self.writer is None or
+                    not self.writer_schema.equals(batch.schema) or
+                    self.sink.tell() >= self.segment_bytes):
+                self.roll(batch.schema)
+            self.writer.write_batch(batch)
+            self.sink.flush()
+            if self.fsync:
+                os.fsync(self.sink.fileno())
+            offset = self.next_offset
+            self.next_offset += 1
+        return offset
+
+    def roll(self, schema: pa.Schema) -> None:
+        """
+        Closes the current segment and starts a new one. Must be called while holding the lock
+
+        Args:
+            schema: The schema of the batches in the new segment
+
+        Returns:
+            None
+        """
+        self.close_segment()
+        self.trim()
+        path = os.path.join(self.path, f"{self.next_offset:020d}.arrow")
+        self.sink = pa.OSFile(path, "wb")
+        self.writer = pa.ipc.new_stream(self.sink, schema)
+        self.writer_schema = schema
+
+    def close_segment(self) -> None:
+        """
+        Closes the segment currently being written
+
+        Returns:
+            None
+        """
+        if self.writer is not None:
+            self.writer.close()
+            self.sink.close()
+        self.writer = None
+        self.sink = None
+
+    def close(self) -> None:
+        """
+        Closes the log
+
+        Returns:
+            None
+        """
+        with self.lock:
+            self.close_segment()
+
+    def read(self, start: int, end: int) -> Iterator[Tuple[int, pd.DataFrame]]:
+        """
+        Reads batches from the log
+
+        Args:
+            start: The offset of the first batch to read
+            end: The offset to stop reading at (exclusive)
+
+        Returns:
+            An iterator of (offset, batch)
+        """
+        segments = self.segments()
+        for i, (first, path) in enumerate(segments):
+            if first >= end:
+                return
+            # Skip segments that end before the start offset
+            if i + 1 < len(segments) and segments[i + 1][0] <= start:
+                continue
+            for j, batch in enumerate(SegmentLog.read_segment(path)):
+                offset = first + j
+                if offset >= end:
+                    return
+                if offset >= start:
+                    yield offset, batch.to_pandas()
+
+    def committed(self, key: str) -> int:
+        """
+        Loads the committed offset of a stream
+
+        Args:
+            key: The key the stream commits its offset with
+
+        Returns:
+            The last offset committed by the stream, or -1 if the stream has not committed an offset
+        """
+        path = os.path.join(self.offsets_path, f"{key}.json")
+        try:
+            with open(path, "r") as f:
+                return json.load(f)["offset"]
+        except (OSError, ValueError, KeyError):
+            return -1
+
+    def commit(self, key: str, offset: int) -> None:
+        """
+        Commits the offset of a stream. Every batch up to and including ``offset`` has been handled by the stream
+
+        Args:
+            key: The key the stream commits its offset with
+            offset: The offset to commit
+
+        Returns:
+            None
+        """
+        path = os.path.join(self.offsets_path, f"{key}.json")
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({"offset": offset}, f)
+        os.replace(tmp_path, path)
+
+    def trim(self) -> None:
+        """
+        Deletes segments that every registered stream has committed past. Must be called while holding the lock
+
+        Returns:
+            None
+        """
+        logger = get_logger()
+        if len(self.keys) == 0:
+            return
+        low = min(self.committed(key) for key in self.keys)
+        segments = self.segments()
+        for (first, path), (next_first, _) in zip(segments, segments[1:]):
+            if next_first - 1 > low:
+                return
+            try:
+                os.remove(path)
+            except Exception as e:
+                logger.exception(e)
@@ -4,13 +4,17 @@ Contains the Stream class
 =========================
 """
 from .file_converter import FileConverter
+from .retry import RetryPolicy, CircuitBreaker
+from .failure_journal import FailureJournal
+from .segment_log import SegmentLog
 from ..app.log import get_logger
 from threading import Thread
 from threading import Lock as ThreadLock
 from queue import Queue as ThreadQueue
 import pandas as pd
+import heapq
+import itertools
 import time
-import os
 from typing import Optional
 
 
@@ -43,21 +47,51 @@ class Stream(FileConverter):
                 * `fmt="pickle"` stores the DataFrame using pickle format
                 * `fmt="csv"` stores the DataFrame using csv format
 
-            chunk_size: The size of chunks to send to the stream target. I.e. Insert data in chunks of chunk_size rows
+            chunk_size: The size of chunks to send to the stream target. I.e. Insert data in chunks of chunk_size rows.
+                        Only supported by stores
             stream_type: The type of the stream (Primarily used for logging)
             store: This flag indicates whether or not the stream is being called by a Store object
 
         Raises:
-            NotImplementedError: chunk_storage is not yet implemented.
+            NotImplementedError: Chunk storage is only implemented for stores
         """
         super().__init__(name=name, dtypes=dtypes, path=path, fmt=fmt)
-        if chunk_size != 0:
-            raise NotImplementedError("Chunk storage not yet implemented")
-        # FIXME: Implement support for sharded uploads
-        self.chunk_size = 0
+        if chunk_size != 0 and not store:
+            raise NotImplementedError("Chunk storage is only implemented for stores")
+        self.chunk_size = chunk_size
         self.stream_type = stream_type
         self.is_store_instance = store
         """bool: True if the super-class has base-class Store otherwise False"""
+        self.retry_policy = RetryPolicy()
+        """api2db.stream.retry.RetryPolicy: Dictates the delay between attempts to upload a failed batch"""
+        self.breaker = CircuitBreaker()
+        """api2db.stream.retry.CircuitBreaker: Stops the stream from contacting its sink while the sink is down"""
+        self.retry_lane = []
+        """list: Heap of (due, sequence, attempt, data, offset) for batches waiting to be retried"""
+        self.retry_lane_size = 100
+        """int: The maximum number of batches held in the retry lane before batches are stored locally"""
+        self.retry_seq = itertools.count()
+        self.retry_lock = ThreadLock()
+        self.journal = FailureJournal.get(name, stream_type)
+        """api2db.stream.failure_journal.FailureJournal: Indexes the batches that failed to upload"""
+        self.replay_rows = 100000
+        """int: The maximum number of previously failed rows to replay at a time"""
+        self.replay_seconds = 10
+        """int: The minimum number of seconds between replays of previously failed rows"""
+        self.replay_at = 0.0
+        self.replay_thread = None
+        self.insert_lock = ThreadLock()
+        """threading.Lock: Serializes inserts of fresh data and of replayed data, which run in separate threads"""
+        self.wal = None
+        """Optional[api2db.stream.segment_log.SegmentLog]: The write-ahead log of the collector if enabled"""
+        self.wal_key = None
+        """Optional[str]: The key the stream commits its write-ahead log offset with"""
+        self.wal_committed = -1
+        """int: The last write-ahead log offset committed by the stream"""
+        self.wal_end = 0
+        """int: The offset the write-ahead log was at when the stream attached to it"""
+        self.wal_acked = set()
+        self.wal_lock = ThreadLock()
         # If the superclass is a Store instance, do not create a lock/queue
         if store:
             return
@@ -78,50 +112,67 @@ class Stream(FileConverter):
 
     def check_failures(self) -> None:
         """
-        Checks to see if previous uploads have failed and if so, loads the previous upload data and attempts to upload
-        it again.
+        Checks to see if previous uploads have failed and if so, loads a bounded chunk of the previous upload data and
+        attempts to upload it again.
 
-        This method searches the directory path
+        Failed uploads are indexed by the streams :py:class:`api2db.stream.failure_journal.FailureJournal`, which
+        stores them in
 
             STORE/upload_failed/**collector_name**/**stream_type**/
 
-        This path is the target location for failed uploads. If an upload fails 5 times in a row, it is stored in this
+        This path is the target location for failed uploads. If an upload exhausts its retries, it is stored in this
         location with the filename being the timestamp it is stored.
 
+        Replay is rate-limited. At most ``replay_rows`` rows are replayed every ``replay_seconds`` seconds, oldest
+        first, and only while the circuit breaker is closed. Each batch is uploaded on its own and removed from the
+        journal once it has been uploaded.
+
+        Replay runs in its own thread, started by ``tick``, so that fresh data keeps being streamed while previously
+        failed rows are replayed. Both threads share the circuit breaker.
+
         Returns:
             None
         """
+        now = time.time()
+        if now < self.replay_at:
+            return
+        self.replay_at = now + self.replay_seconds
         # If the dtypes do not exist return
+        self.dtypes = self.build_dtypes()
         if self.dtypes is None:
             return
-        # If the upload_failed path does not exist return
-        if not os.path.isdir(f"STORE/upload_failed/{self.name}/{self.stream_type}/"):
+        # Replay only while the sink is known to be up
+        if self.breaker.state != CircuitBreaker.CLOSED:
             return
-        # Get the list of failed uploads
-        failed_list = os.listdir(f"STORE/upload_failed/{self.name}/{self.stream_type}/")
+        entries = self.journal.claim(max_rows=self.replay_rows)
         # If there are no failed uploads return
-        if len(failed_list) == 0:
+        if len(entries) == 0:
             return
         logger = get_logger()
-        logger.info((f"uploading {len(failed_list)} failed upload files found in "
-                     "STORE/upload_failed/{self.name}/{self.stream_type}/")
-                    )
-        # Compose all the failed uploads into a single DataFrame
-        df = self.static_compose_df_from_dir(path=f"STORE/upload_failed/{self.name}/{self.stream_type}/",
-                                             fmt="parquet")
-        # If the DataFrame is None return
-        if df is None:
-            return
-        # Attempt to case the DataFrame to its expected types
-        try:
-            df = df.astype(self.dtypes)
-        except Exception as e:
-            logger.exception(e)
-            return
-        if self.is_store_instance:
-            self.stream(df)
-        else:
-            self.q.put(df)
+        logger.info(f"uploading {len(entries)} failed upload files found in {self.journal.path}")
+        for i, entry in enumerate(entries):
+            df = self.journal.load_df(entry)
+            # Attempt to cast the DataFrame to its expected types
+            try:
+                df = df.astype(self.dtypes)
+            except Exception as e:
+                logger.exception(e)
+                logger.error(f"failed upload {entry['file']} could not be loaded... marking as corrupt")
+                self.journal.complete(entry, keep=True)
+                continue
+            if not self.breaker.allow():
+                self.journal.release(entries[i:])
+                return
+            try:
+                with self.insert_lock:
+                    self.insert(df)
+            except Exception as e:
+                logger.exception(e)
+                self.breaker.record_failure()
+                self.journal.release(entries[i:])
+                return
+            self.breaker.record_success()
+            self.journal.complete(entry)
 
     def stream_start(self) -> None:
         """
@@ -134,6 +185,8 @@ class Stream(FileConverter):
         logger.info(f"stream starting -> ({self.stream_type})")
         # Acquire the stream lock on initial startup
         self.lock.acquire()
+        # Push any data left over from before a crash or restart to its stream target
+        self.replay_wal()
         # Set the running flag to true
         running = True
         while running:
@@ -148,20 +201,253 @@ class Stream(FileConverter):
             # Get all data from the queue
             while not self.q.empty():
                 data = self.q.get()
+                # Data arrives as (offset, data) when the collector has a write-ahead log
+                offset, data = data if isinstance(data, tuple) else (None, data)
                 if data is not None:
                     # Push all data to its stream target
-                    self.stream(data)
+                    self.stream(data, offset)
             else:
+                # Retry any failed batches that are due, then wait for new data
+                self.tick()
                 time.sleep(1)
+        self.stop()
+
+    def stop(self) -> None:
+        """
+        Performs cleanup when the stream listener stops
+
+        Returns:
+            None
+        """
+        # Batches waiting to be retried would be lost with this instance, so store them locally
+        self.flush_retries()
 
-    def stream(self, data: pd.DataFrame) -> AttributeError:
+    def tick(self) -> None:
         """
-        Overridden by supers, a Stream object is NEVER directly used to stream data. It is ALWAYS inherited from
+        Performs periodic work while the stream is idle. Called by the stream listener between polls of the queue
+
+        Returns:
+            None
+        """
+        self.retry_pending()
+        # Replay previously failed uploads in the background, so that fresh data is not held up behind them
+        if time.time() >= self.replay_at and (self.replay_thread is None or not self.replay_thread.is_alive()):
+            self.replay_thread = Thread(target=self.check_failures, daemon=True)
+            self.replay_thread.start()
+
+    def stream(self, data: pd.DataFrame, offset: Optional[int]=None) -> None:
+        """
+        Attempts to store the incoming data into the stream target
+
+        Subclasses that write to an external sink implement ``insert``, and inherit the retry behaviour provided by
+        ``deliver``.
 
         Args:
             data: The data to stream
+            offset: The write-ahead log offset of the data, if the collector has a write-ahead log
+
+        Returns:
+            None
+        """
+        self.deliver(data, offset=offset)
+
+    def insert(self, data: pd.DataFrame) -> AttributeError:
+        """
+        Overridden by supers, a Stream object is NEVER directly used to insert data. It is ALWAYS inherited from
+
+        Args:
+            data: The data to insert
 
         Raises:
-            AttributeError: `Stream` does not have the ability to stream data. It must be subclassed.
+            AttributeError: `Stream` does not have the ability to insert data. It must be subclassed.
+        """
+        raise AttributeError("'Stream' object has no attribute 'insert'")
+
+    def deliver(self, data: pd.DataFrame, attempt: int=0, offset: Optional[int]=None) -> bool:
+        """
+        Attempts to insert the data into the stream target, deferring it to the retry lane upon failure
+
+        **Workflow**
+
+            1. If the circuit breaker is open, defer the data without contacting the sink
+            2. Attempt to insert the data
+            3. If the data cannot be inserted, record the failure and defer the data
+
+        Previously failed uploads are replayed separately by ``check_failures``, in its own thread.
+
+        Args:
+            data: The data to deliver
+            attempt: The number of attempts that have already failed for the data
+            offset: The write-ahead log offset of the data, acknowledged once the data is inserted or stored locally
+
+        Returns:
+            True if the data was inserted otherwise False
+        """
+        logger = get_logger()
+        if not self.breaker.allow():
+            delay = max(self.breaker.retry_at() - time.time(), self.retry_policy.delay(attempt))
+            return self.defer(data, attempt, delay=delay, offset=offset)
+        try:
+            with self.insert_lock:
+                self.insert(data)
+        except Exception as e:
+            logger.exception(e)
+            self.breaker.record_failure()
+            return self.defer(data, attempt + 1, offset=offset)
+        self.breaker.record_success()
+        self.ack(offset)
+        return True
+
+    def defer(self,
+              data: pd.DataFrame,
+              attempt: int,
+              delay: Optional[float]=None,
+              offset: Optional[int]=None
+              ) -> bool:
+        """
+        Places data into the retry lane to be attempted again after a backoff delay
+
+        Data is stored locally instead when its retries are exhausted, or when the retry lane is full. Streams that
+        belong to a Store wait out the delay and attempt the data again straight away, since Stores do not run a stream
+        listener to drain their retry lane
+
+        Args:
+            data: The data to defer
+            attempt: The number of attempts that have already failed for the data
+            delay: The number of seconds to wait before the next attempt, dictated by the retry policy if None
+            offset: The write-ahead log offset of the data
+
+        Returns:
+            True if the data was inserted by a Store's immediate retry, otherwise False
         """
-        raise AttributeError("'Stream' object has no attribute 'stream'")
+        logger = get_logger()
+        if attempt > self.retry_policy.max_attempts:
+            self.store_failure(data, offset)
+            return False
+        if self.is_store_instance:
+            if delay is None:
+                delay = self.retry_policy.delay(attempt)
+            logger.warning(f"failed to upload {len(data)} rows to ({self.stream_type}) "
+                           f"will retry in {delay:.1f} seconds [attempt {attempt}/{self.retry_policy.max_attempts}]")
+            time.sleep(delay)
+            return self.deliver(data, attempt, offset)
+        with self.retry_lock:
+            if len(self.retry_lane) >= self.retry_lane_size:
+                lane_full = True
+            else:
+                lane_full = False
+                if delay is None:
+                    delay = self.retry_policy.delay(attempt)
+                heapq.heappush(self.retry_lane, (time.time() + delay, next(self.retry_seq), attempt, data, offset))
+        if lane_full:
+            logger.warning(f"retry lane full for ({self.stream_type})")
+            self.store_failure(data, offset)
+        elif attempt != 0:
+            logger.warning(f"failed to upload {len(data)} rows to ({self.stream_type}) "
+                           f"will retry in {delay:.1f} seconds [attempt {attempt}/{self.retry_policy.max_attempts}]")
+        return False
+
+    def retry_pending(self) -> None:
+        """
+        Attempts to deliver every batch in the retry lane that is due
+
+        Returns:
+            None
+        """
+        now = time.time()
+        # Bound the pass so that batches deferred again during the pass are not retried until the next pass
+        for _ in range(len(self.retry_lane)):
+            with self.retry_lock:
+                if len(self.retry_lane) == 0 or self.retry_lane[0][0] > now:
+                    return
+                _, _, attempt, data, offset = heapq.heappop(self.retry_lane)
+            self.deliver(data, attempt, offset)
+
+    def flush_retries(self) -> None:
+        """
+        Stores every batch in the retry lane locally to be uploaded when the connection is re-established
+
+        Returns:
+            None
+        """
+        with self.retry_lock:
+            lane = self.retry_lane
+            self.retry_lane = []
+        for _, _, _, data, offset in lane:
+            self.store_failure(data, offset)
+
+    def store_failure(self, data: pd.DataFrame, offset: Optional[int]=None) -> None:
+        """
+        Stores data that could not be uploaded locally
+
+        Failed uploads will be stored in
+
+            * STORE/upload_failed/**collector_name**/**stream_type**/date=**YYYY-MM-DD**/**timestamp_ns**.parquet
+
+        Args:
+            data: The data that could not be uploaded
+            offset: The write-ahead log offset of the data, acknowledged once the data is stored locally
+
+        Returns:
+            None
+        """
+        logger = get_logger()
+        logger.error((f"failed to upload {len(data)} rows to ({self.stream_type})\n"
+                      f"storing locally to upload when connection is re-established")
+                     )
+        if self.journal.record(data):
+            self.ack(offset)
+
+    def attach_wal(self, wal: SegmentLog, key: str) -> None:
+        """
+        Attaches the stream to the write-ahead log of its collector
+
+        Args:
+            wal: The write-ahead log
+            key: The key the stream commits its offset with. Must be unique among the streams of the collector
+
+        Returns:
+            None
+        """
+        self.wal = wal
+        self.wal_key = key
+        self.wal_committed, self.wal_end = wal.register(key)
+
+    def replay_wal(self) -> None:
+        """
+        Streams every batch in the write-ahead log that the stream had not committed when it attached to the log.
+        I.e. Batches that were waiting in the queue or being retried when the collector crashed or was restarted
+
+        Returns:
+            None
+        """
+        if self.wal is None or self.wal_committed + 1 >= self.wal_end:
+            return
+        logger = get_logger()
+        logger.info(f"replaying write-ahead log offsets [{self.wal_committed + 1}, {self.wal_end}) "
+                    f"-> ({self.stream_type})")
+        for offset, data in self.wal.read(self.wal_committed + 1, self.wal_end):
+            self.stream(data, offset)
+
+    def ack(self, offset: Optional[int]) -> None:
+        """
+        Acknowledges that the data at a write-ahead log offset has been uploaded or stored locally, and commits the
+        highest offset below which every batch has been acknowledged
+
+        Args:
+            offset: The write-ahead log offset of the data
+
+        Returns:
+            None
+        """
+        if offset is None or self.wal is None:
+            return
+        with self.wal_lock:
+            self.wal_acked.add(offset)
+            committed = self.wal_committed
+            while committed + 1 in self.wal_acked:
+                committed += 1
+                self.wal_acked.remove(committed)
+            if committed != self.wal_committed:
+                self.wal_committed = committed
+                self.wal.commit(self.wal_key, committed)
@@ -10,7 +10,6 @@ from google.oauth2 import service_account
 from google.api_core.exceptions import Conflict, NotFound
 from google.cloud.bigquery import SchemaField
 import pandas as pd
-import time
 from typing import Union, List
 
 
@@ -119,7 +118,7 @@ class Stream2Bigquery(Stream):
         logger.warning(f"connection failed {self.pid}.{self.did}.{self.tid}... retrying")
         return False
 
-    def stream(self, data: pd.DataFrame, retry_depth: int=5) -> None:
+    def insert(self, data: pd.DataFrame) -> None:
         """
         Attempts to store the incoming data into bigquery
 
@@ -127,20 +126,15 @@ class Stream2Bigquery(Stream):
 
             1. If authentication has not been performed, call `self.connect()`
             2. Attempt to store the DataFrame to bigquery
+            3. If the DataFrame cannot be successfully stored set the connection to False and re-raise the exception
 
-                * If successful, check to see if any previous uploads have failed and attempt to store those as well
+        Retries and local storage of failed uploads are handled by
+        :py:meth:`api2db.stream.stream.Stream.deliver`. Failed uploads will be stored in
 
-            3. If the DataFrame cannot be successfully stored set the connection to False
-            4. If the retry_depth is not 0 perform a recursive call attempting to store the data again
-            5. If the retry_depth has reached zero, log an exception and store the DataFrame locally
-
-        Failed uploads will be stored in
-
-            * STORE/upload_failed/**collector_name**/bigquery/**timestamp_ns**.parquet
+            * STORE/upload_failed/**collector_name**/bigquery/date=**YYYY-MM-DD**/**timestamp_ns**.parquet
 
         Args:
             data: The DataFrame that should be stored to bigquery
-            retry_depth: Used for a recursive call counter should the DataFrame fail to be stored
 
         Returns:
             None
@@ -158,24 +152,10 @@ class Stream2Bigquery(Stream):
                         table_schema=self.bq_schema,
                         if_exists="append")
             logger.debug(f"{len(data)} rows inserted into {self.pid}.{self.did}.{self.tid}")
-            # Knowing that data was successfully uploaded, check to see if any previous uploads failed and attempt them
-            self.check_failures()
-        # If storage fails, call recursively 5 times, before storing data locally to be uploaded upon reconnection
-        except Exception as e:
-            logger.exception(e)
+        # If storage fails, force the connection to be re-established on the next attempt
+        except Exception:
             self.connected = False
-            if retry_depth != 0:
-                logger.warning(f"failed to upload {len(data)} rows to {self.pid}.{self.did}.{self.tid} "
-                               f"will retry {retry_depth} more times")
-                self.stream(data, retry_depth - 1)
-            else:
-                e_str = (f"failed to upload {len(data)} rows to {self.pid}.{self.did}.{self.tid}\n"
-                         f"storing locally to upload when connection is re-established"
-                         )
-                logger.error(e_str)
-                ts = int(time.time() * 1000)
-                failure_path = f"STORE/upload_failed/{self.name}/{self.stream_type}/{ts}.parquet"
-                self.static_store_df(df=data, path=failure_path, fmt="parquet")
+            raise
 
     def build_schema(self) -> Union[List[SchemaField], None]:
         """
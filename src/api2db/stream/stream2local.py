@@ -4,11 +4,15 @@ Contains the Stream2Local class
 ==================================
 """
 from .stream import Stream
+from .rolling_writer import RollingParquetWriter
+from .delta_log import DeltaLog
+from .partitions import partition_df
+from .manifest import ShardManifest
 from ..app.log import get_logger
 import os
 import time
 import pandas as pd
-from typing import Optional, List
+from typing import Optional, List, Tuple
 
 
 class Stream2Local(Stream):
@@ -19,7 +23,15 @@ class Stream2Local(Stream):
                  path: Optional[str]=None,
                  mode: str="shard",
                  fmt: str="parquet",
-                 drop_duplicate_keys: Optional[List[str]]=None):
+                 drop_duplicate_keys: Optional[List[str]]=None,
+                 partition_by: Optional[List[str]]=None,
+                 manifest: bool=False,
+                 roll: bool=False,
+                 roll_bytes: int=134217728,
+                 roll_rows: int=1000000,
+                 roll_seconds: int=300,
+                 compact_deltas: int=100,
+                 compact_bytes: int=67108864):
         """
         Creates a Stream2Local object and attempts to build its dtypes
 
@@ -30,7 +42,9 @@ class Stream2Local(Stream):
 
                 * `mode="shard"` (default) will store each incoming file independently in the specified `path`
                   In shard mode the file will be named **timestamp_ns**.fmt
-                * `mode="update"` will update the file located at the specified `path` with the new data
+                * `mode="update"` will update the file located at the specified `path` with the new data.
+                  Each batch is written as a delta which is merged into the file in the background.
+                  :py:class:`See documentation for the DeltaLog <api2db.stream.delta_log.DeltaLog>`
                 * `mode="replace"` will replace the file located at the specified `path` with the new data
 
             fmt:
@@ -44,6 +58,34 @@ class Stream2Local(Stream):
                 * `drop_duplicate_keys=None` -> DataFrame.drop_duplicates() performed before storage
                 * `drop_duplicate_keys=["uuid"]` -> DataFrame.drop_duplicates(subset=drop_duplicate_keys) performed
                   before storage
+
+            partition_by: Only used when `mode="shard"`. Partitions the files in the directory Hive-style
+                * `partition_by=None` (default) -> every file is stored directly in the directory
+                * `partition_by=["date", "hour"]` -> files are stored in `path/date=YYYY-MM-DD/hour=HH/` by the UTC
+                  time they were ingested
+                * `partition_by=["date", "region"]` -> files are stored in `path/date=YYYY-MM-DD/region=value/`
+                  splitting each batch by the value of its `region` column
+
+                :py:mod:`See documentation for partitions <api2db.stream.partitions>`
+
+            manifest: Only used when `mode="shard"`. When True each file is registered in the manifest of the directory
+                      once it has been written, so that a Store with `manifest=True` does not need to list the
+                      directory. :py:class:`See documentation for the ShardManifest
+                      <api2db.stream.manifest.ShardManifest>`
+
+            roll: Only used when `mode="shard"` and `fmt="parquet"`. When True, rather than storing each incoming
+                  batch as its own file, a single file is kept open and each batch is appended to it as a row group.
+                  A file that is still open when the collector crashes has no footer and cannot be read, so it is
+                  removed on restart. Up to `roll_seconds` or `roll_bytes` of data is then lost, unless the collector
+                  has ``wal=True``, in which case the batches of the open file are replayed from the write-ahead log.
+                  :py:class:`See documentation for the RollingParquetWriter
+                  <api2db.stream.rolling_writer.RollingParquetWriter>`
+            roll_bytes: The size in bytes at which a rolling file is finalized
+            roll_rows: The number of rows at which a rolling file is finalized
+            roll_seconds: The number of seconds after which a rolling file is finalized
+            compact_deltas: Only used when `mode="update"`. The number of deltas at which they are merged into the file
+            compact_bytes: Only used when `mode="update"`. The total size in bytes of the deltas at which they are
+                           merged into the file
         """
         if path is None and mode == "shard":
             path = os.path.join("STORE/", f"{name}/", f"{fmt}/")
@@ -52,73 +94,292 @@ class Stream2Local(Stream):
         super().__init__(name=name, path=path, fmt=fmt, stream_type=f"local.{fmt}")
         self.mode = mode
         self.drop_duplicate_keys = drop_duplicate_keys
+        self.partition_by = partition_by if mode == "shard" else None
+        self.manifest = ShardManifest(self.path) if manifest and mode == "shard" else None
+        """Optional[api2db.stream.manifest.ShardManifest]: The manifest files are registered in"""
+        self.roll = roll and mode == "shard" and fmt == "parquet"
+        """bool: True if incoming batches are appended to rolling files"""
+        self.roll_warned = False
+        self.roll_bytes = roll_bytes
+        self.roll_rows = roll_rows
+        self.roll_seconds = roll_seconds
+        self.writers = {}
+        """dict: Maps the relative path of each partition to the RollingParquetWriter used when rolling its files"""
+        self.roll_offsets = {}
+        """dict: Maps the relative path of each partition to the write-ahead log offsets in its open rolling file"""
+        self.roll_pending = {}
+        """dict: Maps each write-ahead log offset to the number of open rolling files containing its batch"""
+        self.deltas = None
+        """Optional[api2db.stream.delta_log.DeltaLog]: The delta log used when updating the file"""
+        if mode in ("update", "replace"):
+            self.deltas = DeltaLog(path=self.path,
+                                   fmt=fmt,
+                                   keys=drop_duplicate_keys,
+                                   compact_deltas=compact_deltas,
+                                   compact_bytes=compact_bytes)
 
-    def stream(self, data: pd.DataFrame) -> None:
+    def stream(self, data: pd.DataFrame, offset: Optional[int]=None) -> None:
         """
         Stores the incoming data into its stream target using the specified `mode`
 
+        Args:
+            data: The data to be stored
+            offset: The write-ahead log offset of the data, if the collector has a write-ahead log
+
+        Returns:
+            None
+        """
+        if self.mode == "shard" and self.roll:
+            self.stream_roll(data, offset)
+            return
+        # The offset is only acknowledged once the data has been written, or stored locally to be written later
+        self.deliver(data, offset=offset)
+
+    def insert(self, data: pd.DataFrame) -> None:
+        """
+        Overrides super class method
+
+        Stores the data using the specified `mode`
+
         Args:
             data: The data to be stored
 
         Returns:
             None
+
+        Raises:
+            IOError if the data could not be stored
         """
+        stored = False
         if self.mode == "shard":
-            self.stream_shard(data)
+            stored = self.stream_shard(data)
         elif self.mode == "update":
-            self.stream_update(data)
+            stored = self.stream_update(data)
         elif self.mode == "replace":
-            self.stream_replace(data)
+            stored = self.stream_replace(data)
+        if not stored:
+            raise IOError(f"failed to store {len(data)} rows to {self.path}")
+
+    def partitions(self, data: pd.DataFrame) -> List[Tuple[str, pd.DataFrame]]:
+        """
+        Splits the incoming data into the partitions of the specified directory path
+
+        Args:
+            data: The data to split
 
-    def stream_shard(self, data: pd.DataFrame) -> None:
+        Returns:
+            A list of (relative partition path, data) for each partition, or a single entry for the directory itself if
+            the stream is not partitioned
+        """
+        if self.partition_by is None:
+            return [("", data)]
+        return partition_df(data, self.partition_by)
+
+    def stream_shard(self, data: pd.DataFrame) -> bool:
         """
         Stores the incoming data to the specified directory path using the file naming schema **timestamp_ns**.fmt
 
         Args:
             data: The data to store to the file
 
+        Returns:
+            True if the data was stored in every partition otherwise False
+        """
+        logger = get_logger()
+        if self.fmt is None:
+            return False
+        logger.debug(f"storing {len(data)} rows to {self.path}")
+        data = data.drop_duplicates(subset=self.drop_duplicate_keys)
+        ts = int(time.time()*1000.0)
+        for rel, part in self.partitions(data):
+            dir_path = os.path.join(self.path, rel)
+            if not os.path.isdir(dir_path):
+                try:
+                    os.makedirs(dir_path)
+                except Exception as e:
+                    logger.exception(e)
+            if not os.path.isdir(dir_path):
+                return False
+            fname = f"{ts}.{self.fmt}"
+            stored = self.static_store_df(df=part, path=os.path.join(dir_path, fname), fmt=self.fmt)
+            if not stored:
+                return False
+            if stored and self.manifest is not None:
+                try:
+                    self.manifest.register(file=os.path.join(rel, fname),
+                                           rows=len(part),
+                                           size=os.path.getsize(os.path.join(dir_path, fname)),
+                                           schema=ShardManifest.df_schema_version(part))
+                except Exception as e:
+                    logger.exception(e)
+        return True
+
+    def stream_roll(self, data: pd.DataFrame, offset: Optional[int]=None) -> None:
+        """
+        Appends the incoming data to the rolling file currently open in the specified directory path, or in each
+        partition of the data
+
+        The write-ahead log offset of the data is only acknowledged once every file containing the data has been
+        finalized. Parts of the data that cannot be appended are stored locally and written again later as shards
+
+        Args:
+            data: The data to append to the file
+            offset: The write-ahead log offset of the data
+
         Returns:
             None
         """
         logger = get_logger()
-        if not os.path.isdir(self.path):
+        if self.wal is None and not self.roll_warned:
+            self.roll_warned = True
+            logger.warning(f"rolling files without a write-ahead log ({self.path}): rows in an open file are lost if "
+                           f"the collector crashes, set wal=True on the collector to replay them")
+        logger.debug(f"appending {len(data)} rows to {self.path}")
+        data = data.drop_duplicates(subset=self.drop_duplicate_keys)
+        parts = self.partitions(data)
+        if offset is not None:
+            self.roll_pending[offset] = len(parts)
+        for rel, part in parts:
+            appended = False
             try:
-                os.makedirs(self.path)
+                writer = self.writers.get(rel)
+                if writer is None:
+                    writer = RollingParquetWriter(path=os.path.join(self.path, rel),
+                                                  max_bytes=self.roll_bytes,
+                                                  max_rows=self.roll_rows,
+                                                  max_seconds=self.roll_seconds)
+                    self.writers[rel] = writer
+                path = writer.write(part)
+                if path is not None:
+                    # The schema changed, so the previous file was finalized before the data was written
+                    self.finalized(path)
+                    self.ack_roll(rel)
+                if offset is not None:
+                    self.roll_offsets.setdefault(rel, []).append(offset)
+                appended = True
+                if writer.due():
+                    self.rotate(rel)
             except Exception as e:
                 logger.exception(e)
-        if not os.path.isdir(self.path) or self.fmt is None:
+                if not appended:
+                    # Store the part locally to be written again later, so that the offset of the batch is still
+                    # acknowledged once the other parts have been finalized
+                    self.store_failure(part)
+                    if offset is not None:
+                        self.roll_pending[offset] -= 1
+        if offset is not None and self.roll_pending.get(offset) == 0:
+            self.roll_pending.pop(offset)
+            self.ack(offset)
+
+    def rotate(self, rel: str) -> None:
+        """
+        Finalizes the rolling file currently open in a partition. Partitions that are no longer written to are
+        forgotten once their file is finalized
+
+        Args:
+            rel: The relative path of the partition
+
+        Returns:
+            None
+        """
+        path = self.writers[rel].rotate()
+        if path is not None:
+            self.finalized(path)
+        self.ack_roll(rel)
+        if self.partition_by is not None:
+            self.writers.pop(rel)
+
+    def finalized(self, path: str) -> None:
+        """
+        Registers a rolling file that has been finalized in the manifest of the directory
+
+        Args:
+            path: The path to the finalized file
+
+        Returns:
+            None
+        """
+        if self.manifest is None:
             return
-        logger.debug(f"storing {len(data)} rows to {self.path}")
-        data = data.drop_duplicates(subset=self.drop_duplicate_keys)
-        self.static_store_df(df=data,
-                             path=os.path.join(self.path, f"{int(time.time()*1000.0)}.{self.fmt}"),
-                             fmt=self.fmt)
+        try:
+            self.manifest.register_file(path)
+        except Exception as e:
+            logger = get_logger()
+            logger.exception(e)
 
-    def stream_update(self, data: pd.DataFrame) -> None:
+    def ack_roll(self, rel: str) -> None:
         """
-        Updates the existing data at the specified file path and adds the incoming data
+        Acknowledges the write-ahead log offsets of the batches in a rolling file that has been finalized, once every
+        file containing each batch has been finalized
 
         Args:
-            data: The data to add to the file
+            rel: The relative path of the partition of the finalized file
 
         Returns:
             None
         """
+        for offset in self.roll_offsets.pop(rel, []):
+            self.roll_pending[offset] -= 1
+            if self.roll_pending[offset] == 0:
+                self.roll_pending.pop(offset)
+                self.ack(offset)
+
+    def tick(self) -> None:
+        """
+        Overrides super class method
+
+        Finalizes the rolling files currently open that are due, so that files are finalized while no data arrives
+
+        Returns:
+            None
+        """
+        super().tick()
+        for rel in [rel for rel, writer in self.writers.items() if writer.due()]:
+            self.rotate(rel)
+
+    def stop(self) -> None:
+        """
+        Overrides super class method
+
+        Finalizes the rolling files currently open
+
+        Returns:
+            None
+        """
+        super().stop()
+        for rel in list(self.writers.keys()):
+            self.rotate(rel)
+        if self.deltas is not None:
+            self.deltas.wait()
+
+    def stream_update(self, data: pd.DataFrame) -> bool:
+        """
+        Adds the incoming data to the existing data at the specified file path
+
+        The data is written as a delta rather than rewriting the file. Once enough deltas have accumulated they are
+        merged into the file in the background, keeping the most recently written row for each set of
+        `drop_duplicate_keys`
+
+        Args:
+            data: The data to add to the file
+
+        Returns:
+            True if the data was written otherwise False
+        """
         logger = get_logger()
         self.dtypes = self.build_dtypes()
-        dir_path = os.path.split(self.path)[0]
-        if not os.path.isdir(dir_path):
-            os.makedirs(dir_path)
-        if self.dtypes is not None:
-            df = self.static_load_df(path=self.path, fmt=self.fmt, dtypes=self.dtypes)
-            logger.debug(f"adding {len(data)} rows to {self.path}")
-            if df is not None:
-                df = df.append(data).drop_duplicates(subset=self.drop_duplicate_keys)
-                self.static_store_df(df, path=self.path, fmt=self.fmt)
-            else:
-                self.static_store_df(data, path=self.path, fmt=self.fmt)
-
-    def stream_replace(self, data: pd.DataFrame) -> None:
+        if self.dtypes is None:
+            return False
+        logger.debug(f"adding {len(data)} rows to {self.path}")
+        data = data.drop_duplicates(subset=self.drop_duplicate_keys, keep="last")
+        self.deltas.dtypes = self.dtypes
+        if not self.deltas.append(data):
+            return False
+        if self.deltas.due():
+            self.deltas.compact_async()
+        return True
+
+    def stream_replace(self, data: pd.DataFrame) -> bool:
         """
         Replaces the existing data at the specified file path with the incoming data
 
@@ -126,9 +387,8 @@ class Stream2Local(Stream):
             data: The data to replace the file with
 
         Returns:
-            None
+            True if the file was replaced otherwise False
         """
-        if os.path.isfile(self.path):
-            os.remove(self.path)
+        self.deltas.clear()
         data = data.drop_duplicates(subset=self.drop_duplicate_keys)
-        self.static_store_df(data, path=self.path, fmt=self.fmt)
+        return self.static_replace_df(data, path=self.path, fmt=self.fmt)
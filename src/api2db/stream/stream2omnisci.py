@@ -33,7 +33,6 @@ except ModuleNotFoundError:
     # Issue Fix
     Connection = None
 import pandas as pd
-import time
 from typing import Optional, Union
 
 
@@ -171,6 +170,8 @@ class Stream2Omnisci(Stream):
             Modified DataFrame
         """
         if dtypes is not None:
+            # Copy so that the original batch is left intact should it need to be retried
+            data = data.copy()
             dtypes = dtypes.apply(lambda x: x.name).to_dict()
             name_dict = {}
             for k, v in dtypes.items():
@@ -180,7 +181,7 @@ class Stream2Omnisci(Stream):
             data = data.rename(columns=name_dict)
         return data
 
-    def stream(self, data, retry_depth=5):
+    def insert(self, data: pd.DataFrame) -> None:
         """
         Attempts to store the incoming data into omnisci
 
@@ -188,20 +189,15 @@ class Stream2Omnisci(Stream):
 
             1. If authentication has not been performed, call `self.connect()`
             2. Attempt to store the DataFrame to omnisci
+            3. If the DataFrame cannot be successfully stored set the con to None and re-raise the exception
 
-                * If successful, check to see if any previous uploads have failed and attempt to store those as well
+        Retries and local storage of failed uploads are handled by
+        :py:meth:`api2db.stream.stream.Stream.deliver`. Failed uploads will be stored in
 
-            3. If the DataFrame cannot be successfully stored set the con to None
-            4. If the retry_depth is not 0 perform a recursive call attempting to store the data again
-            5. If the retry_depth has reached zero, log an exception and store the DataFrame locally
-
-        Failed uploads will be stored in
-
-            * STORE/upload_failed/**collector_name**/omnisci/**timestamp_ns**.parquet
+            * STORE/upload_failed/**collector_name**/omnisci/date=**YYYY-MM-DD**/**timestamp_ns**.parquet
 
         Args:
             data: The DataFrame that should be stored to omnisci
-            retry_depth: Used for a recursive call counter should the DataFrame fail to be stored
 
         Returns:
             None
@@ -214,19 +210,6 @@ class Stream2Omnisci(Stream):
             df = Stream2Omnisci.cast_categorical(data, self.dtypes)
             self.con.load_table(f"{self.name}_stream", df)
             logger.debug(f"{len(data)} rows inserted into {self.log_str}")
-            self.check_failures()
-        except Exception as e:
-            logger.exception(e)
+        except Exception:
             self.con = None
-            if retry_depth != 0:
-                logger.warning(
-                    f"failed to upload {len(data)} rows to {self.log_str} will retry {retry_depth} more times"
-                )
-                self.stream(data, retry_depth - 1)
-            else:
-                logger.error((f"failed to upload {len(data)} rows to {self.log_str}\n"
-                              f"storing locally to upload when connection is re-established")
-                             )
-                ts = int(time.time() * 1000)
-                failure_path = f"STORE/upload_failed/{self.name}/{self.stream_type}/{ts}.parquet"
-                self.static_store_df(df=data, path=failure_path, fmt="parquet")
+            raise
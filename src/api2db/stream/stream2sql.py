@@ -6,10 +6,64 @@ Contains the Stream2Sql class
 from .stream import Stream
 from ..app.log import get_logger
 from ..app.auth_manager import auth_manage
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event, MetaData, Table, Column, Index
+from sqlalchemy import BigInteger, Integer, SmallInteger, Float, Boolean, DateTime, String, Text
+from sqlalchemy.engine import Engine
+from sqlalchemy.pool import StaticPool
+from sqlalchemy.types import TypeEngine
 from sqlalchemy_utils import database_exists, create_database
-import time
-from typing import Optional
+from threading import Lock as ThreadLock
+import pandas as pd
+import os
+from typing import Optional, List, Union, Tuple
+
+SQLITE_PRAGMAS = {
+    "journal_mode": "WAL",
+    "synchronous": "NORMAL",
+    "temp_store": "MEMORY",
+    "cache_size": -65536,
+    "mmap_size": 268435456,
+    "busy_timeout": 30000
+}
+"""dict: The pragmas applied to every SQLite connection. WAL lets readers run alongside the single writer"""
+
+_sqlite_engines = {}
+"""dict: Maps the absolute path of each SQLite file to its (engine, write lock) for the current process"""
+_sqlite_engines_lock = ThreadLock()
+
+
+def sqlite_engine(path: str) -> Tuple[Engine, ThreadLock]:
+    """
+    Retrieves the single writer engine for a SQLite file, creating it on first use
+
+    Every Stream2Sql/Store2Sql in the process that targets the same file shares one connection and one write lock,
+    so writers never contend for the SQLite file lock.
+
+    Args:
+        path: The path to the SQLite database file
+
+    Returns:
+        The engine connected to the file and the lock that must be held while writing to it
+    """
+    path = os.path.abspath(path)
+    with _sqlite_engines_lock:
+        if path not in _sqlite_engines:
+            dir_path = os.path.dirname(path)
+            if not os.path.isdir(dir_path):
+                os.makedirs(dir_path)
+            engine = create_engine(f"sqlite+pysqlite:///{path}",
+                                   poolclass=StaticPool,
+                                   connect_args={"check_same_thread": False, "timeout": 30})
+
+            @event.listens_for(engine, "connect")
+            def set_pragmas(dbapi_con, con_record):
+                cursor = dbapi_con.cursor()
+                for k, v in SQLITE_PRAGMAS.items():
+                    cursor.execute(f"PRAGMA {k}={v}")
+                cursor.close()
+
+            _sqlite_engines[path] = (engine, ThreadLock())
+        return _sqlite_engines[path]
 
 
 class Stream2Sql(Stream):
@@ -25,6 +79,10 @@ class Stream2Sql(Stream):
                  auth_path: Optional[str]=None,
                  port: str="",
                  if_exists: str="append",
+                 primary_keys: Optional[List[str]]=None,
+                 indexes: Optional[List[Union[str, List[str]]]]=None,
+                 partition_by: Optional[str]=None,
+                 string_length: Optional[int]=None,
                  chunk_size: int=0,
                  store: bool=False
                  ):
@@ -33,8 +91,8 @@ class Stream2Sql(Stream):
 
         If dtypes can successfully be created I.e. Data arrives from the API for the first time the following occurs:
 
-            * Auto-generates the table schema
-            * Creates the table in the database if it does not exist
+            * Auto-generates the table schema from the collectors dtypes
+            * Creates the table in the database if it does not exist, including its primary key and secondary indexes
 
         **Authentication Methods:**
 
@@ -53,6 +111,9 @@ class Stream2Sql(Stream):
                 * `dialect="mysql"` -> Use this to connect to a mysql database
                 * `dialect="mariadb"` -> Use this to connect to a mariadb database
                 * `dialect="postgresql"` -> Use this to connect to a postgresql database
+                * `dialect="sqlite"` -> Use this to store to a local SQLite file, ``db_name`` is the path to the
+                  file. I.e. ``db_name="STORE/collector_name.sqlite"``. The file is opened in WAL mode with a single
+                  writer connection per file, and each batch is inserted as a single transaction
                 * `dialect="amazon_aurora"` -> COMING SOON
                 * `dialect="oracle"` -> COMING SOON
                 * `dialect="microsoft_sql"` -> COMING SOON
@@ -62,6 +123,7 @@ class Stream2Sql(Stream):
             password: The password to authenticate with the database
             host: The host of the database
             auth_path: The path to the authentication credentials.
+                       Not required when `dialect="sqlite"`
             port: The port used when establishing a connection to the database
             if_exists:
 
@@ -69,6 +131,18 @@ class Stream2Sql(Stream):
                 * `if_exists="replace"` Replaces the table with the new data
                 * `if_exists="fail"` Fails to upload the new data if the table exists
 
+            primary_keys: The columns that make up the primary key of the table. I.e. ``primary_keys=["uuid"]``
+            indexes: The secondary indexes to create on the table. Each item is either a single column name or a list
+                     of column names for a composite index. I.e. ``indexes=["request_millis", ["lat", "lon"]]``
+            partition_by: A partitioning hint passed through to the dialect when the table is created.
+                          I.e. ``partition_by="RANGE (request_millis)"``
+
+                          * postgresql -> Creates a declarative partitioned table. Partitions must be attached
+                            separately, and the ``primary_keys`` must include the partition columns
+                          * mysql/mariadb -> Used as the ``PARTITION BY`` clause of the table
+
+            string_length: When provided, `string` columns are created as ``VARCHAR(string_length)`` rather than
+                           ``TEXT``. `string` columns used in a primary key or index always use ``VARCHAR``
             chunk_size: CURRENTLY NOT SUPPORTED
             store: True if the super class is a Store object, otherwise False
 
@@ -81,7 +155,11 @@ class Stream2Sql(Stream):
                          stream_type=f"sql.{dialect}",
                          store=store
                          )
-        if auth_path is not None:
+        if dialect == "sqlite":
+            self.username = username
+            self.password = password
+            self.host = host
+        elif auth_path is not None:
             auth = auth_manage(auth_path)
             if auth is None:
                 raise ValueError("Authentication file invalid")
@@ -101,6 +179,12 @@ class Stream2Sql(Stream):
         self.dialect = dialect
         self.port = port
         self.if_exists = if_exists
+        self.primary_keys = [] if primary_keys is None else primary_keys
+        self.indexes = [] if indexes is None else [[i] if isinstance(i, str) else list(i) for i in indexes]
+        self.partition_by = partition_by
+        self.string_length = string_length
+        self.table = None
+        """Optional[sqlalchemy.Table]: The table the stream inserts into, built from the dtypes"""
         self.driver = None
         """str: The driver to use when connecting with SQLAlchemy"""
         self.engine_str = None
@@ -111,6 +195,8 @@ class Stream2Sql(Stream):
         """sqlalchemy.engine.Engine: The connection to the database"""
         self.connected = False
         """bool: True if connection is established otherwise False"""
+        self.write_lock = ThreadLock()
+        """threading.Lock: Held while writing, shared by all writers of the same file when using SQLite"""
         self.load()
 
     def load(self) -> None:
@@ -131,6 +217,8 @@ class Stream2Sql(Stream):
             self.driver = "mariadbconnector"
         elif self.dialect == "postgresql":
             self.driver = "psycopg2"
+        elif self.dialect == "sqlite":
+            self.driver = "pysqlite"
         elif self.dialect == "amazon_aurora":
             raise NotImplementedError("Support for amazon_aurora has not been implemented in api2db yet")
         elif self.dialect == "oracle":
@@ -139,6 +227,10 @@ class Stream2Sql(Stream):
             raise NotImplementedError("Support for microsoft_sql has not been implemented in api2db yet")
         if self.driver is None:
             return
+        if self.dialect == "sqlite":
+            self.engine_str = f"{self.dialect}+{self.driver}:///{os.path.abspath(self.db_name)}"
+            self.log_str = f"{self.dialect}://{self.db_name}"
+            return
         self.engine_str = (f"{self.dialect}+"
                            f"{self.driver}://"
                            f"{self.username}:"
@@ -159,6 +251,11 @@ class Stream2Sql(Stream):
         """
         logger = get_logger()
         try:
+            if self.dialect == "sqlite":
+                self.con, self.write_lock = sqlite_engine(self.db_name)
+                self.create_table()
+                logger.info(f"connection established {self.log_str}")
+                return True
             self.con = create_engine(self.engine_str)
             if not database_exists(self.con.url):
                 logger.info(f"database not found {self.log_str}... creating database")
@@ -167,6 +264,7 @@ class Stream2Sql(Stream):
                 logger.info(f"loading database {self.log_str}")
 
                 self.con.connect()
+            self.create_table()
             logger.info(f"connection established {self.log_str}")
             return True
         except Exception as e:
@@ -174,7 +272,94 @@ class Stream2Sql(Stream):
             logger.warning(f"connection failed {self.log_str}... retrying")
             return False
 
-    def stream(self, data, retry_depth=5):
+    @staticmethod
+    def sql_type(dtype: str, keyed: bool=False, string_length: Optional[int]=None) -> Union[TypeEngine, None]:
+        """
+        Yields the SQLAlchemy column type for a pandas dtype
+
+        Args:
+            dtype: The name of the pandas dtype. I.e. `"Int64"`
+            keyed: True if the column is part of a primary key or index
+            string_length: The length of `string` columns, if None `string` columns are created as ``TEXT``
+
+        Returns:
+            The SQLAlchemy type if the dtype is supported otherwise None
+        """
+        if dtype in ("string", "object"):
+            if string_length is not None:
+                return String(string_length)
+            return String(255) if keyed else Text()
+        elif dtype in ("bool", "boolean"):
+            return Boolean()
+        elif dtype in ("Int64", "int64", "UInt32", "uint32"):
+            return BigInteger()
+        elif dtype in ("Int32", "int32", "UInt16", "uint16"):
+            return Integer()
+        elif dtype in ("Int16", "int16", "Int8", "int8", "UInt8", "uint8"):
+            return SmallInteger()
+        elif dtype in ("Float64", "float64"):
+            return Float(precision=53)
+        elif dtype in ("Float32", "float32"):
+            return Float(precision=24)
+        elif dtype.startswith("datetime64"):
+            return DateTime(timezone="," in dtype)
+        return None
+
+    def build_table(self) -> Union[Table, None]:
+        """
+        Attempts to build the table that will be used for table creation
+
+        Iterates through the dtypes items and generates the appropriate Columns, then declares the primary key,
+        secondary indexes and partitioning hints
+
+        Returns:
+            The table generated if successful otherwise None
+        """
+        logger = get_logger()
+        self.dtypes = self.build_dtypes()
+        if self.dtypes is None:
+            return None
+        dtypes = self.dtypes.apply(lambda x: x.name).to_dict()
+        keyed = set(self.primary_keys).union(*self.indexes)
+        columns = []
+        for key, value in dtypes.items():
+            sql_type = Stream2Sql.sql_type(value, keyed=key in keyed, string_length=self.string_length)
+            if sql_type is None:
+                logger.warning(f"unsupported dtype {value} for column {key}... storing as TEXT")
+                sql_type = Text()
+            columns.append(Column(key,
+                                  sql_type,
+                                  primary_key=key in self.primary_keys,
+                                  autoincrement=False,
+                                  nullable=key not in self.primary_keys))
+        indexes = [Index(f"ix_{self.name}_{'_'.join(cols)}", *cols) for cols in self.indexes]
+        kwargs = {}
+        if self.partition_by is not None and self.dialect in ("postgresql", "mysql", "mariadb"):
+            kwargs[f"{self.dialect}_partition_by"] = self.partition_by
+        return Table(self.name, MetaData(), *columns, *indexes, **kwargs)
+
+    def create_table(self) -> None:
+        """
+        Creates the table and its indexes in the database if they do not exist
+
+        When ``if_exists="fail"`` the table is left to be created by the first insert, so that inserting into an
+        existing table still fails.
+
+        Returns:
+            None
+        """
+        logger = get_logger()
+        if self.if_exists == "fail":
+            return
+        if self.table is None:
+            self.table = self.build_table()
+        if self.table is None:
+            return
+        logger.info(f"creating table {self.name} if not exists {self.log_str}")
+        with self.write_lock:
+            self.table.create(self.con, checkfirst=True)
+
+    def insert(self, data: pd.DataFrame) -> None:
         """
         Attempts to store the incoming data into the SQL database
 
@@ -182,20 +367,15 @@ class Stream2Sql(Stream):
 
             1. If authentication has not been performed, call `self.connect()`
             2. Attempt to store the DataFrame to the database
+            3. If the DataFrame cannot be successfully stored set the connected to False and re-raise the exception
 
-                * If successful, check to see if any previous uploads have failed and attempt to store those as well
+        Retries and local storage of failed uploads are handled by
+        :py:meth:`api2db.stream.stream.Stream.deliver`. Failed uploads will be stored in
 
-            3. If the DataFrame cannot be successfully stored set the connected to False
-            4. If the retry_depth is not 0 perform a recursive call attempting to store the data again
-            5. If the retry_depth has reached zero, log an exception and store the DataFrame locally
-
-        Failed uploads will be stored in
-
-            * STORE/upload_failed/**collector_name**/sql.**dialect**/**timestamp_ns**.parquet
+            * STORE/upload_failed/**collector_name**/sql.**dialect**/date=**YYYY-MM-DD**/**timestamp_ns**.parquet
 
         Args:
             data: The DataFrame that should be stored to the database
-            retry_depth: Used for a recursive call counter should the DataFrame fail to be stored
 
         Returns:
             None
@@ -205,21 +385,19 @@ class Stream2Sql(Stream):
             logger.info(f"establishing connection to {self.log_str}")
             self.connected = self.connect()
         try:
-            data.to_sql(name=f"{self.name}", con=self.con, if_exists=self.if_exists, index=False)
+            if self.table is None:
+                self.create_table()
+            with self.write_lock:
+                if self.table is None:
+                    data.to_sql(name=f"{self.name}", con=self.con, if_exists=self.if_exists, index=False)
+                else:
+                    # The table schema is managed by the stream, so replacing only replaces the rows
+                    # Each batch is written as a single transaction
+                    with self.con.begin() as con:
+                        if self.if_exists == "replace":
+                            con.execute(self.table.delete())
+                        data.to_sql(name=f"{self.name}", con=con, if_exists="append", index=False)
             logger.debug(f"{len(data)} rows inserted into {self.log_str}")
-            self.check_failures()
-        except Exception as e:
-            logger.exception(e)
+        except Exception:
             self.connected = False
-            if retry_depth != 0:
-                logger.warning(
-                    f"failed to upload {len(data)} rows to {self.log_str} will retry {retry_depth} more times"
-                )
-                self.stream(data, retry_depth - 1)
-            else:
-                logger.error((f"failed to upload {len(data)} rows to {self.log_str}\n"
-                              f"storing locally to upload when connection is re-established")
-                             )
-                ts = int(time.time() * 1000)
-                failure_path = f"STORE/upload_failed/{self.name}/{self.stream_type}/{ts}.parquet"
-                self.static_store_df(df=data, path=failure_path, fmt="parquet")
+            raise
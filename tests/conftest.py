@@ -0,0 +1,50 @@
+# -*- coding: utf-8 -*-
+"""
+Shared fixtures for the tests
+=============================
+
+The import targets are tested against stand-in HTTP servers started on a free local port, so no test depends on an
+external API.
+"""
+from http.server import ThreadingHTTPServer
+from threading import Thread
+import pytest
+
+
+class Server(ThreadingHTTPServer):
+    """A stand-in server that does not report clients that disconnect, I.e. after a timeout, as errors"""
+
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        pass
+
+
+@pytest.fixture
+def serve():
+    """
+    Starts stand-in HTTP servers for the duration of a test
+
+    Returns:
+        A function that starts a server with the given request handler class, and returns its base URL
+    """
+    servers = []
+
+    def start(handler):
+        server = Server(("127.0.0.1", 0), handler)
+        Thread(target=server.serve_forever, daemon=True).start()
+        servers.append(server)
+        return f"http://127.0.0.1:{server.server_address[1]}"
+
+    yield start
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+
+
+@pytest.fixture(autouse=True)
+def workdir(tmp_path, monkeypatch):
+    """Runs each test in its own directory, since collectors write to the CACHE/ and STORE/ directories"""
+    (tmp_path / "CACHE").mkdir()
+    monkeypatch.chdir(tmp_path)
+    return tmp_path
@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+"""
+Tests for api2db.ingest.collector_state
+=======================================
+"""
+from api2db.app.api2db import Api2Db
+from api2db.app.pipeline import Pipeline
+from api2db.ingest import ApiForm, Feature, ListExtract
+from api2db.ingest.collector_state import CollectorState
+from api2db.ingest.import_runner import ImportRunner
+from queue import Queue as ThreadQueue
+import pytest
+import time
+
+
+def form():
+    return ApiForm(name="paged",
+                   pre_process=[ListExtract(lam=lambda x: x["data"])],
+                   data_features=[Feature(key="id", lam=lambda x: x["id"], dtype=int)])
+
+
+def paged(state, delay, stage_first):
+    """
+    Creates a generator import target that waits ``delay`` seconds before yielding each page after the first, and
+    stages its cursor either before or after waiting
+    """
+    def import_target():
+        for page in range(state.get("cursor", 0), 2):
+            if stage_first:
+                state.set("cursor", page + 1)
+            if page != 0:
+                time.sleep(delay)
+            if not stage_first:
+                state.set("cursor", page + 1)
+            yield {"data": [{"id": page}]}
+    return import_target
+
+
+def collect(state, delay, timeout, stage_first=True):
+    q = ThreadQueue()
+    Api2Db.collect(paged(state, delay, stage_first),
+                   [Pipeline(name="paged", api_form=form, stream_qs=[q])],
+                   runner=ImportRunner("paged", timeout=timeout),
+                   state=state)
+    return q.qsize()
+
+
+def test_state_is_committed_once_the_import_completes():
+    state = CollectorState("paged")
+    assert collect(state, delay=0.0, timeout=5.0) == 2
+    assert state.get("cursor") == 2
+
+
+@pytest.mark.parametrize("stage_first", [True, False])
+def test_state_of_a_truncated_import_is_not_committed(stage_first):
+    state = CollectorState("paged")
+    # The first page is collected, but the import is truncated before the second page
+    assert collect(state, delay=0.5, timeout=0.3, stage_first=stage_first) == 1
+    assert state.get("cursor") is None
+    assert len(state.staged) == 0
+    # The next import starts again from the first page
+    assert collect(state, delay=0.0, timeout=5.0) == 2
+    assert state.get("cursor") == 2
@@ -0,0 +1,147 @@
+# -*- coding: utf-8 -*-
+"""
+Tests for api2db.ingest.http_import
+===================================
+"""
+from api2db.app.api2db import Api2Db
+from api2db.app.pipeline import Pipeline
+from api2db.ingest import ApiForm, Feature, ListExtract
+from api2db.ingest.http_import import HttpImport, get_session, http_get
+from api2db.ingest.import_runner import CancelToken, use_token
+from http.server import BaseHTTPRequestHandler
+from queue import Queue as ThreadQueue
+import requests
+import pytest
+import gzip
+import json
+import time
+
+
+class Handler(BaseHTTPRequestHandler):
+    """Answers every request with a JSON document, recording the headers and client address of each request"""
+
+    protocol_version = "HTTP/1.1"
+    requests = []
+    body = {"data": [{"id": 1}]}
+    etag = None
+    last_modified = None
+    compress = False
+    delay = 0.0
+
+    def do_GET(self):
+        type(self).requests.append((dict(self.headers), self.client_address))
+        if self.delay:
+            time.sleep(self.delay)
+        if (self.etag is not None and self.headers.get("If-None-Match") == self.etag) or \
+                (self.last_modified is not None and self.headers.get("If-Modified-Since") == self.last_modified):
+            self.send_response(304)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        body = json.dumps(self.body).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        if self.etag is not None:
+            self.send_header("ETag", self.etag)
+        if self.last_modified is not None:
+            self.send_header("Last-Modified", self.last_modified)
+        if self.compress:
+            body = gzip.compress(body)
+            self.send_header("Content-Encoding", "gzip")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def handler(**attrs):
+    """Creates a Handler subclass with its own request log"""
+    return type("TestHandler", (Handler, ), dict(requests=[], **attrs))
+
+
+def test_etag_not_modified_returns_none(serve):
+    h = handler(etag='"v1"')
+    url = serve(h) + "/etag"
+    import_target = HttpImport(url)
+    assert import_target() == [Handler.body]
+    assert import_target() is None
+    assert h.requests[1][0].get("If-None-Match") == '"v1"'
+
+
+def test_last_modified_not_modified_returns_none(serve):
+    h = handler(last_modified="Wed, 21 Oct 2015 07:28:00 GMT")
+    url = serve(h) + "/last_modified"
+    assert http_get(url) is not None
+    assert http_get(url) is None
+    assert h.requests[1][0].get("If-Modified-Since") == "Wed, 21 Oct 2015 07:28:00 GMT"
+
+
+def test_unconditional_requests_send_no_validators(serve):
+    h = handler(etag='"v1"')
+    url = serve(h) + "/unconditional"
+    import_target = HttpImport(url, conditional=False)
+    assert import_target() == [Handler.body]
+    assert import_target() == [Handler.body]
+    assert "If-None-Match" not in h.requests[1][0]
+
+
+def test_gzip_responses_are_decoded(serve):
+    h = handler(compress=True)
+    url = serve(h) + "/gzip"
+    assert HttpImport(url)() == [Handler.body]
+    assert "gzip" in h.requests[0][0].get("Accept-Encoding", "")
+
+
+def test_read_timeout_is_honoured(serve):
+    url = serve(handler(delay=2.0)) + "/slow"
+    start = time.time()
+    with pytest.raises(requests.Timeout):
+        http_get(url, timeout=(1.0, 0.3))
+    assert time.time() - start < 1.5
+    assert HttpImport(url, timeout=0.3)() is None
+
+
+def test_timeout_is_clamped_to_the_import_deadline(serve):
+    url = serve(handler(delay=2.0)) + "/deadline"
+    use_token(CancelToken(time.time() + 0.3))
+    start = time.time()
+    try:
+        with pytest.raises(requests.Timeout):
+            http_get(url, timeout=(5.0, 30.0))
+    finally:
+        use_token(None)
+    assert time.time() - start < 1.5
+
+
+def test_session_is_reused(serve):
+    h = handler()
+    url = serve(h) + "/session"
+    assert get_session() is get_session()
+    HttpImport(url, conditional=False)()
+    HttpImport(url, conditional=False)()
+    # Both requests were made over the same kept-alive connection
+    assert len(h.requests) == 2
+    assert h.requests[0][1] == h.requests[1][1]
+
+
+def test_validators_are_only_remembered_once_the_data_is_collected(serve):
+    h = handler(etag='"v1"')
+    url = serve(h) + "/collect"
+    q = ThreadQueue()
+
+    def form(lam):
+        return lambda: ApiForm(name="validators",
+                               pre_process=[ListExtract(lam=lam)],
+                               data_features=[Feature(key="id", lam=lambda x: x["id"], dtype=int)])
+
+    # The data cannot be extracted, so the response must be requested again in full
+    Api2Db.collect(HttpImport(url), [Pipeline(name="validators", api_form=form(lambda x: x["missing"]), stream_qs=[q])])
+    assert q.empty()
+    Api2Db.collect(HttpImport(url), [Pipeline(name="validators", api_form=form(lambda x: x["data"]), stream_qs=[q])])
+    assert "If-None-Match" not in h.requests[1][0]
+    assert len(q.get_nowait()) == 1
+    Api2Db.collect(HttpImport(url), [Pipeline(name="validators", api_form=form(lambda x: x["data"]), stream_qs=[q])])
+    assert h.requests[2][0].get("If-None-Match") == '"v1"'
+    assert q.empty()
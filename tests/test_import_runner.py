@@ -0,0 +1,33 @@
+# -*- coding: utf-8 -*-
+"""
+Tests for api2db.ingest.import_runner
+=====================================
+"""
+from api2db.ingest.import_runner import ImportRunner, current_token
+import pytest
+import time
+
+
+def test_generators_truncated_at_the_deadline_raise():
+    tokens = []
+
+    def pages():
+        tokens.append(current_token())
+        yield 0
+        time.sleep(0.5)
+        yield 1
+
+    data = ImportRunner("truncated", timeout=0.3).run(pages)
+    assert next(data) == 0
+    with pytest.raises(TimeoutError):
+        next(data)
+    # The token of the import is cancelled, so the state staged by the import is discarded
+    assert tokens[0].event.is_set()
+
+
+def test_generators_finishing_before_the_deadline_are_complete():
+    def pages():
+        yield 0
+        yield 1
+
+    assert list(ImportRunner("complete", timeout=5.0).run(pages)) == [0, 1]
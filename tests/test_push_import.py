@@ -0,0 +1,116 @@
+# -*- coding: utf-8 -*-
+"""
+Tests for api2db.ingest.push_import
+===================================
+"""
+from api2db.ingest.push_import import PushImport
+from api2db.ingest.import_runner import CancelToken, use_token
+from api2db.stream.retry import RetryPolicy
+from http.server import BaseHTTPRequestHandler
+from threading import Timer
+import json
+import time
+
+
+class Handler(BaseHTTPRequestHandler):
+    """
+    Answers each request with the next list of events in ``connections``, then either closes the connection or holds
+    it open sending heartbeats, recording the headers and time of each request
+    """
+
+    requests = []
+    connections = [[]]
+    hold = 5.0
+
+    def do_GET(self):
+        cls = type(self)
+        cls.requests.append((dict(self.headers), time.time()))
+        events = cls.connections[min(len(cls.requests), len(cls.connections)) - 1]
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.end_headers()
+        for event_id, data in events:
+            self.wfile.write(f"id: {event_id}\ndata: {json.dumps(data)}\n\n".encode("utf-8"))
+        self.wfile.flush()
+        # The last list of events is held open, the others are dropped once sent
+        if len(cls.requests) < len(cls.connections):
+            return
+        end = time.time() + self.hold
+        while time.time() < end:
+            time.sleep(0.1)
+            self.wfile.write(b":\n\n")
+            self.wfile.flush()
+
+    def log_message(self, *args):
+        pass
+
+
+def handler(*connections):
+    """Creates a Handler subclass sending each list of ``(id, data)`` events on a separate connection"""
+    return type("TestHandler", (Handler, ), dict(requests=[], connections=list(connections)))
+
+
+def events(*ids):
+    """Creates an event with each id, whose data holds the id"""
+    return [(i, {"id": i}) for i in ids]
+
+
+def test_batches_are_collected_at_batch_size(serve):
+    url = serve(handler(events(1, 2, 3, 4, 5))) + "/size"
+    batches = PushImport(url, batch_size=2, batch_seconds=30.0)()
+    start = time.time()
+    try:
+        assert next(batches) == [{"id": 1}, {"id": 2}]
+        assert next(batches) == [{"id": 3}, {"id": 4}]
+    finally:
+        batches.close()
+    assert time.time() - start < 5.0
+
+
+def test_batches_are_collected_after_batch_seconds(serve):
+    url = serve(handler(events(1))) + "/seconds"
+    batches = PushImport(url, batch_size=100, batch_seconds=0.3)()
+    try:
+        start = time.time()
+        assert next(batches) == [{"id": 1}]
+        assert time.time() - start < 2.0
+    finally:
+        batches.close()
+
+
+def test_dropped_connections_reconnect_with_backoff(serve):
+    h = handler(events(1), events(2))
+    url = serve(h) + "/reconnect"
+    retry_policy = RetryPolicy(base=0.5, cap=0.5, jitter=False)
+    batches = PushImport(url, batch_size=2, batch_seconds=30.0, retry_policy=retry_policy)()
+    try:
+        assert next(batches) == [{"id": 1}, {"id": 2}]
+    finally:
+        batches.close()
+    assert len(h.requests) == 2
+    assert h.requests[1][1] - h.requests[0][1] >= 0.5
+    # The new connection resumes from the last event received
+    assert "Last-Event-ID" not in h.requests[0][0]
+    assert h.requests[1][0].get("Last-Event-ID") == "1"
+
+
+def test_cancelled_imports_collect_pending_messages_and_resume(serve):
+    h = handler(events(1, 2, 3))
+    url = serve(h) + "/resume"
+    import_target = PushImport(url, batch_size=100, batch_seconds=30.0)
+    token = CancelToken()
+    # Cancel the import once the events have arrived, long before the batch would be collected
+    Timer(0.5, token.cancel).start()
+    use_token(token)
+    try:
+        assert list(import_target()) == [[{"id": 1}, {"id": 2}, {"id": 3}]]
+    finally:
+        use_token(None)
+    assert import_target.last_id == "3"
+    import_target.batch_seconds = 0.3
+    batches = import_target()
+    try:
+        next(batches)
+    finally:
+        batches.close()
+    assert h.requests[-1][0].get("Last-Event-ID") == "3"